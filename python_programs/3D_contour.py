@@ -1,18 +1,25 @@
+import contextlib
 import matplotlib.pyplot as plt
+from matplotlib import animation
 from mpl_toolkits.mplot3d import Axes3D
 import numpy as np
 import pandas as pd
 import os
 import cmocean
 import rasterio
-from scipy.interpolate import griddata
 from mpl_toolkits.axes_grid1.inset_locator import inset_axes
 from tqdm import tqdm
-from PIL import Image
+from dataset_io import read_transect
+from section_geometry import with_section_geometry, middle_shore_distance
+from section_interp import section_interpolator
+from render_farm import figure_job, render_figures
 
 INTERPOLATION_METHOD = 'linear' # linear, cubic, nearest
 DATA_TYPE = 'chlor_a'  # options are 'temp', 'salinity', 'density', 'turbidity', 'cdom', 'chlor_a', 'do'
-EARTH_RADIUS = 6371  # in kilometers
+ANIMATION_FORMAT = 'gif'  # gif or mp4 (needs ffmpeg)
+ANIMATION_FPS = 1  # transects added per second
+ANIMATION_DPI = 100
+SAVE_FRAMES = True  # also save every frame as upto_transect_<k>.png at 500 dpi
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.path.join(SCRIPT_DIR, '..', '..', 'data')
@@ -20,7 +27,6 @@ ACROBAT_DIR = os.path.join(DATA_DIR, 'acrobat', 'transects', 'processed')
 
 SAVE_DIR = os.path.join(SCRIPT_DIR, '..', f'visualization', 'contour_plots', 'wb', DATA_TYPE, '3D_plots')
 INSET_MAP = os.path.join(SCRIPT_DIR, '..', f'visualization', 'maps', 'transects_wb.png')
-SHORE_POINT = (-77.802938, 34.195220)
 
 colormap_and_label = {
     'temp': (cmocean.cm.thermal, 'Temperature (°C)'),
@@ -32,27 +38,18 @@ colormap_and_label = {
     'do': (cmocean.cm.deep, 'Dissolved Oxygen (mg/L)')
 }
 
-def haversine(lon1, lat1, lon2, lat2):
-    lon1, lat1, lon2, lat2 = map(np.radians, [lon1, lat1, lon2, lat2])
-    dlon = lon2 - lon1
-    dlat = lat2 - lat1
-    a = np.sin(dlat/2.0)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon/2.0)**2
-    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1-a))
-    return c * EARTH_RADIUS
-
 global_min_values = {}
 global_max_values = {}
 
-def get_global_min_max(file_names):
+def get_global_min_max(sorted_files_and_dfs):
     global_min = []
     global_max = []
     global_min_depth = []
     global_max_depth = []
     
     print(f"Processing global min/max {DATA_TYPE} values and depth...")
-    for fname in tqdm(file_names):
+    for distance_from_shore, data, fname in tqdm(sorted_files_and_dfs):
         try:
-            data = pd.read_csv(fname)
             global_min.append(data[DATA_TYPE].min())
             global_max.append(data[DATA_TYPE].max())
             global_min_depth.append(data['depth'].min())
@@ -64,47 +61,18 @@ def get_global_min_max(file_names):
     global_max_values[DATA_TYPE] = max(global_max)
     return min(global_min_depth), max(global_max_depth)
 
-def plot_3D_transects(file_names, global_min, global_max, global_min_depth, global_max_depth, upto_idx):
-    colormap, data_label = colormap_and_label.get(DATA_TYPE, (cmocean.cm.haline, f'{DATA_TYPE.capitalize()} value'))
-
-    global_min = global_min_values[DATA_TYPE]
-    global_max = global_max_values[DATA_TYPE]
+def load_sections(file_names):
+    # Read every transect once, ordered by the distance from shore of its middle sample (see section_geometry.py)
+    dfs = [with_section_geometry(read_transect(fname)) for fname in file_names]
+    distances_from_shore = [middle_shore_distance(df) for df in dfs]
+    order = np.argsort(distances_from_shore, kind='stable')
+    return [(distances_from_shore[i], dfs[i], file_names[i]) for i in order]
 
-    fig = plt.figure(figsize=(18, 18), facecolor='#FFFFFF')  # Set figure background color
-    ax = fig.add_subplot(111, projection='3d', facecolor='#FFFFFF')  # Set axes background color
-    
-    distances_from_shore = []
-    
-    dfs = []  # Store DataFrames after reading them
-    for fname in file_names:
-        df = pd.read_csv(fname)
-        dfs.append(df)
-        middle_idx = len(df) // 2
-        middle_lat, middle_lon = df.iloc[middle_idx][['lat', 'lon']]
-        distance_from_shore = haversine(SHORE_POINT[0], SHORE_POINT[1], middle_lon, middle_lat)
-        distances_from_shore.append(distance_from_shore)
-    
-    sorted_files_and_dfs = sorted(zip(distances_from_shore, dfs, file_names))
-    
-    # Only loop through transects up to the specified index
-    for idx, (distance, df, fname) in enumerate(sorted_files_and_dfs[:upto_idx + 1]):
-        print(f"Interpolating and visualizing data for file: {fname}...")
-        
-        accumulated_distance = [0]
-
-        # Modify this loop to calculate distance at every 10th data point
-        for i in range(1, len(df)):
-            if i % 10 == 0:
-                lat1, lon1 = df.iloc[i - 10][['lat', 'lon']]
-                lat2, lon2 = df.iloc[i][['lat', 'lon']]
-                distance = haversine(lon1, lat1, lon2, lat2)
-                accumulated_distance.append(accumulated_distance[-1] + distance)
-            else:
-                accumulated_distance.append(accumulated_distance[-1])  # Keep the same distance for non-10th points
-
-        df['normalized_distance'] = accumulated_distance
-
-        distance_from_shore = distances_from_shore[idx]  # Using the pre-calculated distance from shore
+def section_grids(sorted_files_and_dfs):
+    # Each transect is interpolated once and added to the 3D scene in its own frame
+    grids = []
+    for idx, (distance_from_shore, df, fname) in enumerate(sorted_files_and_dfs):
+        print(f"Interpolating data for file: {fname}...")
 
         # Print the calculated distance
         print(f"Distance from Shore for Transect {idx+1}: {distance_from_shore} km")
@@ -114,12 +82,34 @@ def plot_3D_transects(file_names, global_min, global_max, global_min_depth, glob
         zi = np.linspace(df['depth'].min(), df['depth'].max(), 100)
         yi, zi = np.meshgrid(yi, zi)
 
-        xi = np.full(yi.shape, distance_from_shore) 
+        colors = section_interpolator(df['normalized_distance'], df['depth'])(df[DATA_TYPE], yi, zi, method=INTERPOLATION_METHOD)
+        grids.append({'distance_from_shore': float(distance_from_shore), 'yi': yi, 'zi': zi, 'colors': colors})
+    return grids
+
+def animation_writer(animation_path, fps=ANIMATION_FPS):
+    # Frames are piped to ffmpeg (mp4) or ImageMagick (gif) as they are drawn; without ImageMagick
+    # the gif falls back to Pillow, which keeps the (animation dpi) frames until the end
+    extension = os.path.splitext(animation_path)[1]
+    if extension == '.mp4':
+        if not animation.FFMpegWriter.isAvailable():
+            print("ffmpeg not found, the mp4 animation is not written")
+            return None
+        return animation.FFMpegWriter(fps=fps)
+    if extension == '.gif':
+        if animation.ImageMagickWriter.isAvailable():
+            return animation.ImageMagickWriter(fps=fps)
+        return animation.PillowWriter(fps=fps)
+    print(f"Unsupported animation format: {extension}")
+    return None
+
+def render_3D_animation(data, spec, output):
+    # One persistent 3D scene: each frame adds the next transect from shore, is saved as
+    # upto_transect_<k>.png and is streamed to the animation. Runs in a render_farm worker.
+    colormap, data_label = colormap_and_label.get(spec['data_type'], (cmocean.cm.haline, f"{spec['data_type'].capitalize()} value"))
+    global_min, global_max = spec['global_min'], spec['global_max']
 
-        colors = griddata((df['normalized_distance'], df['depth']), df[DATA_TYPE], (yi, zi), method=INTERPOLATION_METHOD)
-
-        # Plotting
-        ax.scatter(xi, yi, zi, c=colors.flatten(), cmap=colormap, marker='o', alpha=0.6, vmin=global_min, vmax=global_max)
+    fig = plt.figure(figsize=(18, 18), facecolor='#FFFFFF')  # Set figure background color
+    ax = fig.add_subplot(111, projection='3d', facecolor='#FFFFFF')  # Set axes background color
 
     label_fontsize = 20
     labelpad = 20  # Adjust this value as needed to increase the space between labels and ticks
@@ -136,10 +126,9 @@ def plot_3D_transects(file_names, global_min, global_max, global_min_depth, glob
     ax.set_xlim(2.5, 4.5)
     tick_spacing = (4.5 - 2.5) / 10
     ax.set_xticks(np.arange(2.5, 4.5 + tick_spacing, tick_spacing))
+    ax.set_zlim(spec['global_max_depth'], 0)
+    # The along-transect axis keeps autoscaling, so each frame spans the transects drawn so far
 
-    ax.set_ylim(ax.get_ylim())
-    ax.set_zlim(global_max_depth, 0)
-    
     #sm = plt.cm.ScalarMappable(cmap=colormap, norm=plt.Normalize(vmin=global_min, vmax=global_max))
     #sm.set_array([])
     #cbar_ticks = np.linspace(global_min, global_max, 10)
@@ -151,28 +140,38 @@ def plot_3D_transects(file_names, global_min, global_max, global_min_depth, glob
     #axins.imshow(img)
     #axins.axis('off')
 
+    writer = animation_writer(output, spec['fps'])
+    with writer.saving(fig, output, spec['dpi']) if writer is not None else contextlib.nullcontext():
+        for upto_idx, grid in enumerate(data):
+            xi = np.full(grid['yi'].shape, grid['distance_from_shore'])
+
+            # Plotting
+            ax.scatter(xi, grid['yi'], grid['zi'], c=grid['colors'].flatten(), cmap=colormap, marker='o', alpha=0.6, vmin=global_min, vmax=global_max)
+
+            plt.tight_layout()
+            if spec['save_frames']:
+                fig.savefig(os.path.join(spec['frame_dir'], f"upto_transect_{upto_idx + 1}.png"), dpi=500, facecolor='#FFFFFF', bbox_inches='tight')  # Save with white background
+            if writer is not None:
+                writer.grab_frame(facecolor='#FFFFFF')
+    plt.close(fig)
+    if writer is None:
+        raise RuntimeError(f"No animation written to {output}")
+    print(f"Animation saved at {output}")
+
+def plot_3D_transects(sorted_files_and_dfs, global_min, global_max, global_min_depth, global_max_depth):
+    # Frame k shows the k transects closest to shore. The animation is only redrawn (by render_farm)
+    # when one of the transects or the plot settings changed.
+    grids = section_grids(sorted_files_and_dfs)
+    spec = {'data_type': DATA_TYPE, 'global_min': float(global_min), 'global_max': float(global_max),
+            'global_max_depth': float(global_max_depth), 'save_frames': SAVE_FRAMES, 'frame_dir': SAVE_DIR,
+            'fps': ANIMATION_FPS, 'dpi': ANIMATION_DPI}
+
     if not os.path.exists(SAVE_DIR):
         os.makedirs(SAVE_DIR)
-    combined_save_path = f"{SAVE_DIR}/upto_transect_{upto_idx + 1}.png"
-    plt.tight_layout()
-    plt.savefig(combined_save_path, dpi=500, facecolor='#FFFFFF', bbox_inches='tight')  # Save with white background
-    plt.close()
-
-def create_gif(image_folder, gif_path, duration=1000):
-    images = []
-    for file_name in sorted(os.listdir(image_folder)):
-        if file_name.endswith('.png'):
-            file_path = os.path.join(image_folder, file_name)
-            img = Image.open(file_path).convert('RGBA')  # Convert image to RGBA to handle transparency
-            # Create a white background image
-            background = Image.new('RGBA', img.size, (255, 255, 255, 255))
-            # Composite the image on top of the white background
-            combined = Image.alpha_composite(background, img)
-            images.append(combined)
-
-    images[0].save(gif_path, save_all=True, append_images=images[1:], optimize=False, duration=duration, loop=0)
-    print(f"GIF saved at {gif_path}")
-
+    animation_path = os.path.join(SAVE_DIR, f'{DATA_TYPE}_gradient.{ANIMATION_FORMAT}')
+    # the frames are written by the same job, so a deleted frame redraws the animation too
+    frame_paths = [os.path.join(SAVE_DIR, f"upto_transect_{upto_idx + 1}.png") for upto_idx in range(len(grids))] if SAVE_FRAMES else []
+    render_figures([figure_job(render_3D_animation, grids, spec, animation_path, extra_outputs=frame_paths)])
 
 def main():
     if not os.path.exists(SAVE_DIR):
@@ -182,17 +181,14 @@ def main():
     file_names = [os.path.join(ACROBAT_DIR, f'transect_{i}.csv') for i in range(1, 8)]
     file_names = sorted(file_names, key=lambda x: int(x.split('_')[-1].split('.')[0]))
 
-    global_min_depth, global_max_depth = get_global_min_max(file_names)
-    for idx in range(len(file_names)):
-        plot_3D_transects(file_names, global_min_values[DATA_TYPE], global_max_values[DATA_TYPE], global_min_depth, global_max_depth, idx)
+    sections = load_sections(file_names)
+    global_min_depth, global_max_depth = get_global_min_max(sections)
+    plot_3D_transects(sections, global_min_values[DATA_TYPE], global_max_values[DATA_TYPE], global_min_depth, global_max_depth)
     
     print(f"Global Minimum {DATA_TYPE}: {global_min_values[DATA_TYPE]}")
     print(f"Global Maximum {DATA_TYPE}: {global_max_values[DATA_TYPE]}")
 
     print("3D visualizations complete!")
 
-    gif_save_path = os.path.join(SAVE_DIR, f'{DATA_TYPE}_gradient.gif')
-    create_gif(SAVE_DIR, gif_save_path)
-
 if __name__ == "__main__":
     main()
\ No newline at end of file
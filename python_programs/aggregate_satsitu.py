@@ -1,9 +1,9 @@
 import numpy as np
 import pandas as pd
-from scipy.ndimage import generic_filter
+from window_stats import window_mean
+from dataset_io import read_dataset, write_dataset
 import os
 import warnings
-from pandas.errors import PerformanceWarning
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.path.join(SCRIPT_DIR, '..', '..', 'data', 'satsitu', 'satsitu_l2.csv')
@@ -12,7 +12,7 @@ if not os.path.exists(OUTPUT_DIR):
     os.makedirs(OUTPUT_DIR)
 output_filename = os.path.join(OUTPUT_DIR, 'aggregated_satsitu_data_l2.csv')
 
-df = pd.read_csv(DATA_DIR)
+df = read_dataset(DATA_DIR)
 
 # Extract unique identifiers for each satellite data set, considering the column names directly
 sensor_identifiers = set(col.rsplit('_', 1)[0] for col in df.columns if 'irow' in col)
@@ -20,74 +20,91 @@ sensor_identifiers = set(col.rsplit('_', 1)[0] for col in df.columns if 'irow' i
 # Specify the depth ranges
 depth_ranges = [(0, 4), (4, 7), (7, 10), (0, 10)]
 
-# Suppress warnings related to mean of empty slices and DataFrame fragmentation
+# Suppress warnings related to mean of empty slices
 warnings.filterwarnings('ignore', category=RuntimeWarning)
-warnings.filterwarnings('ignore', category=PerformanceWarning)
 
 def apply_sliding_window_aggregation(data, window_size):
-    if window_size == 1:
-        return data
-    return generic_filter(data, np.nanmean, size=(window_size, window_size), mode='constant', cval=np.NaN)
-
-def populate_grid(df, value_column, irow_column, icol_column, grid_shape):
-    grid = np.full(grid_shape, np.nan)
-    for _, row in df.iterrows():
-        irow = int(row[irow_column])
-        icol = int(row[icol_column])
-        if 0 <= irow < grid_shape[0] and 0 <= icol < grid_shape[1]:
-            grid[irow, icol] = row[value_column]
-    return grid
-
-def filter_by_depth_range(df, depth_col, depth_range):
-    return df[(df[depth_col] >= depth_range[0]) & (df[depth_col] < depth_range[1])]
+    # NaN-aware window mean from integral images; same window placement as the former
+    # generic_filter(np.nanmean, mode='constant', cval=NaN) but O(pixels) for any window size
+    return window_mean(data, window_size)
+
+def grid_flat_indices(df, irow_column, icol_column, grid_shape):
+    # Flat (row-major) grid index of every sample, or -1 where the sample has no valid pixel
+    irow = df[irow_column].to_numpy(dtype=float)
+    icol = df[icol_column].to_numpy(dtype=float)
+    valid = np.isfinite(irow) & np.isfinite(icol) & (irow >= 0) & (irow < grid_shape[0]) & (icol >= 0) & (icol < grid_shape[1])
+    flat_index = np.full(len(df), -1, dtype=np.int64)
+    flat_index[valid] = irow[valid].astype(np.int64) * grid_shape[1] + icol[valid].astype(np.int64)
+    return flat_index
+
+def populate_grid(values, flat_index, grid_shape, sample_mask=None):
+    # Scatter samples into the grid in one bincount pass: each pixel holds the mean of the
+    # finite values (optionally restricted by sample_mask) that fall in it, NaN if none do
+    use = (flat_index >= 0) & np.isfinite(values)
+    if sample_mask is not None:
+        use &= sample_mask
+    grid_size = grid_shape[0] * grid_shape[1]
+    sums = np.bincount(flat_index[use], weights=values[use], minlength=grid_size)
+    counts = np.bincount(flat_index[use], minlength=grid_size)
+    grid = np.full(grid_size, np.nan)
+    np.divide(sums, counts, out=grid, where=counts > 0)
+    return grid.reshape(grid_shape)
+
+def gather_from_grid(grid, flat_index):
+    # Look every sample's pixel up in the grid with a single flat-index gather
+    values = np.full(flat_index.shape, np.nan)
+    valid = flat_index >= 0
+    values[valid] = grid.ravel()[flat_index[valid]]
+    return values
+
+def depth_range_mask(df, depth_col, depth_range):
+    return ((df[depth_col] >= depth_range[0]) & (df[depth_col] < depth_range[1])).to_numpy()
 
 def process_sensor(df, sensor_identifier, output_dir, depth_ranges, depth_col='depth', in_situ_chl_col='chlor_a'):
+    # Returns the aggregated columns for one sensor as a dict of arrays aligned with df
     print(f"Processing {sensor_identifier}...")
     irow_col = f'{sensor_identifier}_irow'
     icol_col = f'{sensor_identifier}_icol'
     chl_col = f'{sensor_identifier}_chl'
+
+    if df[irow_col].isna().all():
+        print(f"No samples fall inside {sensor_identifier}; skipping.")
+        return {}
     
     max_irow = int(df[irow_col].max()) + 1
     max_icol = int(df[icol_col].max()) + 1
     grid_shape = (max_irow, max_icol)
+    flat_index = grid_flat_indices(df, irow_col, icol_col, grid_shape)
     
-    sensor_grid = populate_grid(df, chl_col, irow_col, icol_col, grid_shape)
+    sensor_grid = populate_grid(df[chl_col].to_numpy(dtype=float), flat_index, grid_shape)
+
+    # The in-situ grids only depend on the depth range, so build them once for all window sizes
+    in_situ_values = df[in_situ_chl_col].to_numpy(dtype=float)
+    in_situ_grids = {depth_range: populate_grid(in_situ_values, flat_index, grid_shape, depth_range_mask(df, depth_col, depth_range))
+                     for depth_range in depth_ranges}
     
-    window_sizes = [1, 2, 3]
+    window_sizes = [1, 2, 3, 5, 7]
     
+    columns = {}
     for window_size in window_sizes:
         print(f"Applying window size {window_size}x{window_size}...")
         aggregated_sensor = apply_sliding_window_aggregation(sensor_grid, window_size)
-        
-        flat_sensor = aggregated_sensor.flatten()
-        
-        df[f'{sensor_identifier}_chl_{window_size}x{window_size}'] = np.nan
-        for index, row in df.iterrows():
-            flat_index = int(row[irow_col]) * max_icol + int(row[icol_col])
-            if 0 <= flat_index < len(flat_sensor):
-                df.at[index, f'{sensor_identifier}_chl_{window_size}x{window_size}'] = flat_sensor[flat_index]
+        columns[f'{sensor_identifier}_chl_{window_size}x{window_size}'] = gather_from_grid(aggregated_sensor, flat_index)
 
         for depth_range in depth_ranges:
-            df_depth_filtered = filter_by_depth_range(df, depth_col, depth_range)
-            in_situ_grid_depth_filtered = populate_grid(df_depth_filtered, in_situ_chl_col, irow_col, icol_col, grid_shape)
-            
-            aggregated_in_situ_depth_filtered = apply_sliding_window_aggregation(in_situ_grid_depth_filtered, window_size)
-            
-            flat_in_situ_depth_filtered = aggregated_in_situ_depth_filtered.flatten()
+            aggregated_in_situ_depth_filtered = apply_sliding_window_aggregation(in_situ_grids[depth_range], window_size)
             
             depth_range_str = f'{depth_range[0]}-{depth_range[1]}m'
             column_name = f'{sensor_identifier}_insitu_chl_{depth_range_str}_{window_size}x{window_size}'
-            df[column_name] = np.nan
-            for index, row in df.iterrows():
-                flat_index = int(row[irow_col]) * max_icol + int(row[icol_col])
-                if 0 <= flat_index < len(flat_in_situ_depth_filtered):
-                    df.at[index, column_name] = flat_in_situ_depth_filtered[flat_index]
+            columns[column_name] = gather_from_grid(aggregated_in_situ_depth_filtered, flat_index)
+
+    return columns
 
-# Main loop to process each sensor identifier
+# Main loop to process each sensor identifier, joining all new columns to df in one step
+aggregated_columns = {}
 for sensor_identifier in sensor_identifiers:
-    process_sensor(df, sensor_identifier, OUTPUT_DIR, depth_ranges)
+    aggregated_columns.update(process_sensor(df, sensor_identifier, OUTPUT_DIR, depth_ranges))
+df = pd.concat([df, pd.DataFrame(aggregated_columns, index=df.index)], axis=1)
 
-df.to_csv(output_filename, index=False)
+write_dataset(df, output_filename)
 print("Processing completed.")
-
-
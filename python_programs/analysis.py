@@ -5,6 +5,8 @@ import seaborn as sns
 from matplotlib.patches import Patch
 import numpy as np
 import os
+from dataset_io import read_dataset, dataset_columns
+from group_stats import partition
 
 # Define directories and paths
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -13,7 +15,9 @@ ACROBAT_FILE_PATH = os.path.join(DATA_DIR, 'processed_dataset.csv')
 VISUAL_SAVE_DIR = os.path.join(SCRIPT_DIR, '..', 'visualization', 'transect_analysis')
 
 # Load your dataset
-data = pd.read_csv(ACROBAT_FILE_PATH)
+# Only the columns used below are loaded from the stored dataset
+analysis_columns = ['transect_id', 'depth', 'temp', 'salinity', 'chlor_a', 'turbidity', 'do', 'density']
+data = read_dataset(ACROBAT_FILE_PATH, columns=[column for column in dataset_columns(ACROBAT_FILE_PATH) if column in analysis_columns])
 
 # Print the columns in the dataset
 print("Columns in the dataset:")
@@ -34,12 +38,15 @@ data['depth_range'] = pd.cut(data['depth'], bins=depth_bins, labels=depth_labels
 # List of oceanic parameters to analyze
 parameters = ['temp', 'salinity', 'chlor_a', 'turbidity', 'do', 'density']
 
+# Every parameter split by (depth range, transect) in one sort, instead of filtering per test
+groups = partition(data, ['depth_range', 'transect_id'], parameters)
+no_values = np.array([])
+
 for param in parameters:
     print(f"\nAnalyzing parameter: {param}\n")
     results = {}
     for depth_range in depth_labels:
-        depth_data = data[data['depth_range'] == depth_range]
-        transect_params = [depth_data[depth_data['transect_id'] == transect][param].dropna() for transect in unique_transects]
+        transect_params = [groups[param].get((depth_range, transect), no_values) for transect in unique_transects]
 
         # Print the number of observations in each group
         group_sizes = [len(tp) for tp in transect_params]
@@ -0,0 +1,85 @@
+import hashlib
+from collections import OrderedDict
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+from scipy.ndimage import map_coordinates
+
+# Bottom depth along Acrobat transects from a bathymetry GeoTIFF (GEBCO, or any larger regional
+# DEM in lon/lat). The raster is opened once and only the window around a transect's bounding box
+# is read, so the size of the DEM does not matter. Depth is sampled at every sample position of
+# the transect in one bilinear map_coordinates call, and the profiles are cached per transect.
+#
+#   with BathymetrySampler(BATHYMETRY_PATH) as bathymetry:
+#       bottom = bathymetry.profile(df['lon'], df['lat'])   # positive depth (m) at every sample
+
+WINDOW_MARGIN = 2          # pixels read around a transect's bounding box
+PROFILE_CACHE_SIZE = 32    # transect profiles kept by a sampler
+
+class BathymetrySampler:
+    def __init__(self, path, band=1):
+        self.path = path
+        self.band = band
+        self._src = None
+        self._profiles = OrderedDict()
+
+    @property
+    def src(self):
+        if self._src is None:
+            self._src = rasterio.open(self.path)
+        return self._src
+
+    def close(self):
+        if self._src is not None:
+            self._src.close()
+            self._src = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _read_window(self, rows, cols):
+        # Band values in the window covering the (fractional, pixel-centred) rows/cols, NaN for nodata
+        src = self.src
+        row0 = max(int(np.floor(np.nanmin(rows))) - WINDOW_MARGIN, 0)
+        col0 = max(int(np.floor(np.nanmin(cols))) - WINDOW_MARGIN, 0)
+        row1 = min(int(np.ceil(np.nanmax(rows))) + WINDOW_MARGIN + 1, src.height)
+        col1 = min(int(np.ceil(np.nanmax(cols))) + WINDOW_MARGIN + 1, src.width)
+        block = src.read(self.band, window=Window(col0, row0, col1 - col0, row1 - row0)).astype(float)
+        if src.nodata is not None:
+            block[block == src.nodata] = np.nan
+        return block, row0, col0
+
+    def sample(self, lon, lat):
+        # Band values (bilinear) at the given positions, NaN off the raster
+        lon = np.asarray(lon, dtype=float)
+        lat = np.asarray(lat, dtype=float)
+        cols, rows = ~self.src.transform * (lon, lat)
+        # pixel values sit at pixel centres
+        rows = rows - 0.5
+        cols = cols - 0.5
+        inside = ((rows >= -0.5) & (rows <= self.src.height - 0.5) &
+                  (cols >= -0.5) & (cols <= self.src.width - 0.5))
+        values = np.full(lon.shape, np.nan)
+        if not inside.any():
+            print(f"Transect lies outside the bathymetry raster {self.path}")
+            return values
+        block, row0, col0 = self._read_window(rows[inside], cols[inside])
+        values[inside] = map_coordinates(block, [rows[inside] - row0, cols[inside] - col0], order=1, mode='nearest')
+        return values
+
+    def profile(self, lon, lat):
+        # Positive bottom depth at every transect sample, cached by the transect's positions
+        lon = np.asarray(lon, dtype=float)
+        lat = np.asarray(lat, dtype=float)
+        key = hashlib.sha1(np.ascontiguousarray(lon).tobytes() + b'|' + np.ascontiguousarray(lat).tobytes()).hexdigest()
+        if key in self._profiles:
+            self._profiles.move_to_end(key)
+            return self._profiles[key]
+        profile = np.abs(self.sample(lon, lat))
+        self._profiles[key] = profile
+        while len(self._profiles) > PROFILE_CACHE_SIZE:
+            self._profiles.popitem(last=False)
+        return profile
@@ -0,0 +1,212 @@
+import os
+import json
+import shutil
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401  (pandas picks it up as the Parquet engine)
+    HAVE_PYARROW = True
+except ImportError:
+    HAVE_PYARROW = False
+
+# Storage layer for the Acrobat and satsitu intermediate tables (processed_dataset, satsitu_l2,
+# satsitu_l2_rrs, satsitu_l2_kd490, aggregated_satsitu_data_l2). Scripts keep passing the same
+# '.csv' paths they always used; with DATASET_FORMAT = 'parquet' the table is stored next to it
+# as a '.parquet' directory split into one part per (sensor, transect_id):
+#
+#   satsitu_l2.parquet/_manifest.json
+#   satsitu_l2.parquet/sensor=insitu/transect_id=1/part.parquet        <- Acrobat columns
+#   satsitu_l2.parquet/sensor=AQUA_MODIS/transect_id=1/part.parquet    <- that sensor's granule columns
+#
+# so a reader asking for a few columns or one transect only opens and decodes those parts.
+# Granule columns are named '<granule id>_<suffix>' with granule ids like
+# 'AQUA_MODIS.20230507T184501.L2.OC', and the text before the first '.' is the sensor.
+# Set EXPORT_CSV to also write the flat CSV (and per-transect CSVs) for spreadsheets and older
+# tools; without pyarrow installed everything falls back to CSV.
+
+DATASET_FORMAT = 'parquet'  # 'parquet' or 'csv'
+EXPORT_CSV = False
+IN_SITU_GROUP = 'insitu'
+PARTITION_COLUMN = 'transect_id'
+ROW_COLUMN = '_row'
+MANIFEST_NAME = '_manifest.json'
+PROCESSED_DATASET_NAME = 'processed_dataset.csv'
+
+def csv_enabled():
+    return DATASET_FORMAT == 'csv' or EXPORT_CSV or not HAVE_PYARROW
+
+def dataset_path(path):
+    # 'processed_dataset.csv' -> 'processed_dataset.parquet'
+    return os.path.splitext(path)[0] + '.parquet'
+
+def csv_path(path):
+    return os.path.splitext(path)[0] + '.csv'
+
+def sensor_group(column):
+    return column.split('.', 1)[0] if '.' in column else IN_SITU_GROUP
+
+def typed_columns(df):
+    # Numbers that arrived as text (or as object columns after QC assigned pd.NA) become numeric,
+    # and pixel indices are stored as float32, which holds every row/col index exactly.
+    df = df.copy()
+    for column in df.columns:
+        if df[column].dtype == object:
+            converted = pd.to_numeric(df[column], errors='coerce')
+            if converted.notna().sum() == df[column].notna().sum():
+                df[column] = converted
+        if column.endswith('_irow') or column.endswith('_icol'):
+            df[column] = df[column].astype(np.float32)
+    if PARTITION_COLUMN in df.columns and df[PARTITION_COLUMN].notna().all():
+        df[PARTITION_COLUMN] = df[PARTITION_COLUMN].astype(np.int64)
+    return df
+
+def _part_path(path, group, partition):
+    return os.path.join(path, f'sensor={group}', f'{PARTITION_COLUMN}={partition}', 'part.parquet')
+
+def _write_parquet(df, path):
+    df = typed_columns(df).reset_index(drop=True)
+    df[ROW_COLUMN] = np.arange(len(df), dtype=np.int64)
+    columns = [column for column in df.columns if column != ROW_COLUMN]
+    groups = {}
+    for column in columns:
+        groups.setdefault(sensor_group(column), []).append(column)
+
+    if PARTITION_COLUMN in df.columns:
+        partition_values = df[PARTITION_COLUMN].astype(str).to_numpy()
+    else:
+        partition_values = np.full(len(df), 'all')
+    partitions = sorted(set(partition_values), key=lambda value: (len(value), value))
+
+    # Write into a scratch directory and swap it in, so readers never see a half-written dataset
+    tmp_path = path + '.tmp'
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    for partition in partitions:
+        rows = df[partition_values == partition]
+        for group, group_columns in groups.items():
+            part_path = _part_path(tmp_path, group, partition)
+            os.makedirs(os.path.dirname(part_path), exist_ok=True)
+            rows[[ROW_COLUMN] + group_columns].to_parquet(part_path, index=False)
+
+    manifest = {'columns': columns, 'groups': groups, 'partitions': partitions, 'rows': len(df)}
+    with open(os.path.join(tmp_path, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f)
+
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.replace(tmp_path, path)
+
+def parquet_enabled():
+    return DATASET_FORMAT == 'parquet' and HAVE_PYARROW
+
+def write_dataset(df, path):
+    # Write df under the table's '.csv' path; returns the path(s) actually written
+    written = []
+    if parquet_enabled():
+        _write_parquet(df, dataset_path(path))
+        written.append(dataset_path(path))
+    else:
+        if DATASET_FORMAT == 'parquet':
+            print("pyarrow is not installed; writing CSV instead of Parquet.")
+        # A Parquet copy from an earlier run would now be stale
+        if os.path.exists(dataset_path(path)):
+            shutil.rmtree(dataset_path(path))
+    if csv_enabled():
+        df.to_csv(csv_path(path), index=False)
+        written.append(csv_path(path))
+    return written
+
+def read_manifest(path):
+    # Manifest of the table's Parquet dataset, or None when tables are read from CSV
+    # (DATASET_FORMAT = 'csv', no pyarrow, or no Parquet dataset written yet)
+    manifest_path = os.path.join(dataset_path(path), MANIFEST_NAME)
+    if not parquet_enabled() or not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        return json.load(f)
+
+def dataset_columns(path):
+    # Column names of a stored table without loading any of its data
+    manifest = read_manifest(path)
+    if manifest is not None:
+        return list(manifest['columns'])
+    return pd.read_csv(csv_path(path), nrows=0).columns.tolist()
+
+def sensor_columns(columns, sensors):
+    # The in-situ columns plus every granule column belonging to the given sensors
+    sensors = set(sensors)
+    return [column for column in columns if sensor_group(column) == IN_SITU_GROUP or sensor_group(column) in sensors]
+
+def _read_parquet(path, manifest, columns, transect_ids):
+    groups = {}
+    for column in columns:
+        groups.setdefault(sensor_group(column), []).append(column)
+    partitions = manifest['partitions']
+    if transect_ids is not None:
+        wanted = {str(int(transect_id)) for transect_id in transect_ids}
+        partitions = [partition for partition in partitions if partition in wanted]
+
+    group_frames = []
+    for group, group_columns in groups.items():
+        parts = [pd.read_parquet(_part_path(path, group, partition), columns=[ROW_COLUMN] + group_columns)
+                 for partition in partitions]
+        if parts:
+            group_frames.append(pd.concat(parts, ignore_index=True).set_index(ROW_COLUMN))
+    if not group_frames:
+        return pd.DataFrame(columns=columns)
+
+    # Groups hold the same rows, so joining on the stored row number restores the original table order
+    df = pd.concat(group_frames, axis=1).sort_index()
+    return df[columns].reset_index(drop=True)
+
+def _read_csv(path, columns, transect_ids):
+    usecols = None
+    if columns is not None:
+        usecols = list(columns)
+        if transect_ids is not None and PARTITION_COLUMN not in usecols:
+            usecols.append(PARTITION_COLUMN)
+    df = pd.read_csv(csv_path(path), usecols=usecols)
+    if transect_ids is not None:
+        df = df[df[PARTITION_COLUMN].isin(list(transect_ids))].reset_index(drop=True)
+    if columns is not None:
+        df = df[list(columns)]
+    return df
+
+def read_dataset(path, columns=None, transect_ids=None, sensors=None):
+    # Load a stored table from its '.csv' path, reading only the requested columns (and, when
+    # given, only the rows of the requested transects and the granule columns of the requested
+    # sensors). Uses the Parquet dataset when DATASET_FORMAT is 'parquet' and one exists, the CSV otherwise.
+    if columns is None and sensors is not None:
+        columns = sensor_columns(dataset_columns(path), sensors)
+    elif columns is not None:
+        columns = list(columns)
+
+    manifest = read_manifest(path)
+    if manifest is None:
+        return _read_csv(path, columns, transect_ids)
+
+    if columns is None:
+        columns = manifest['columns']
+    unknown = [column for column in columns if column not in manifest['columns']]
+    if unknown:
+        raise KeyError(f"Columns not found in {dataset_path(path)}: {unknown}")
+    return _read_parquet(dataset_path(path), manifest, columns, transect_ids)
+
+def read_transect(transect_file, columns=None):
+    # Load '<processed dir>/transect_N.csv': the transect's partition of the processed dataset
+    # stored alongside it when that is Parquet, otherwise the per-transect CSV itself.
+    processed_path = os.path.join(os.path.dirname(transect_file), PROCESSED_DATASET_NAME)
+    if read_manifest(processed_path) is not None:
+        transect_id = int(os.path.splitext(os.path.basename(transect_file))[0].replace('transect_', ''))
+        return read_dataset(processed_path, columns=columns, transect_ids=[transect_id])
+    return pd.read_csv(transect_file, usecols=columns)
+
+def transect_ids(processed_path):
+    # Transect ids available in the processed dataset, from its partitions or the per-transect CSVs
+    manifest = read_manifest(processed_path)
+    if manifest is not None:
+        return [int(partition) for partition in manifest['partitions'] if partition != 'all']
+    processed_dir = os.path.dirname(processed_path)
+    files = [file for file in os.listdir(processed_dir) if file.startswith('transect_') and file.endswith('.csv')]
+    return sorted(int(file[len('transect_'):-len('.csv')]) for file in files)
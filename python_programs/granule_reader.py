@@ -0,0 +1,122 @@
+import os
+from collections import OrderedDict
+import numpy as np
+from netCDF4 import Dataset
+
+# Shared reader for L2 granules used by the satsitu matchup scripts. Each granule is opened once
+# per call, every requested variable is pulled from the same open file, optionally cropped to a
+# (S, W, N, E) bounding box, and the decoded float arrays are kept in a size-bounded LRU cache.
+# The cache lives at module level, so scripts run in the same interpreter session (e.g. with
+# runpy.run_path) share one warm cache instead of re-decoding the same HDF5 chunks.
+
+FILL_VALUE = -32767.0
+CACHE_MAX_BYTES = 1024 ** 3  # 1 GiB of decoded arrays
+
+class ArrayCache:
+    # LRU mapping of cache key -> read-only ndarray, evicting the least recently used
+    # entries once the total size of the stored arrays exceeds max_bytes.
+    def __init__(self, max_bytes=CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        if key not in self._entries:
+            return None
+        self._entries.move_to_end(key)
+        return self._entries[key]
+
+    def put(self, key, array):
+        if key in self._entries:
+            self.current_bytes -= self._entries.pop(key).nbytes
+        if array.nbytes > self.max_bytes:
+            return
+        array.flags.writeable = False  # arrays are shared between callers, so guard against in-place edits
+        self._entries[key] = array
+        self.current_bytes += array.nbytes
+        self.evict()
+
+    def evict(self):
+        while self.current_bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.current_bytes -= evicted.nbytes
+
+    def clear(self):
+        self._entries.clear()
+        self.current_bytes = 0
+
+_array_cache = ArrayCache()
+
+def set_cache_limit(max_bytes):
+    _array_cache.max_bytes = max_bytes
+    _array_cache.evict()
+
+def clear_cache():
+    _array_cache.clear()
+
+def decode_product(product_data, fill_value=FILL_VALUE):
+    # Convert a (possibly masked) netCDF4 variable to a float array with NaN for fill/masked pixels
+    product_data = np.ma.filled(np.ma.asarray(product_data, dtype=float), np.nan)
+    product_data[product_data == fill_value] = np.nan
+    return product_data
+
+def crop_window(nc, bbox):
+    # Row/col slices of the smallest window containing every pixel whose navigation lat/lon falls
+    # inside bbox, plus the navigation array shape the window applies to. Returns (None, None)
+    # (read the full array) if the granule has no usable navigation data or does not overlap the box.
+    south, west, north, east = bbox
+    try:
+        navigation = nc.groups['navigation_data']
+        lat = decode_product(navigation.variables['latitude'][:])
+        lon = decode_product(navigation.variables['longitude'][:])
+    except KeyError:
+        return None, None
+    if lat.ndim != 2 or lat.shape != lon.shape:
+        return None, None
+
+    inside = (lat >= south) & (lat <= north) & (lon >= west) & (lon <= east)
+    rows = np.flatnonzero(inside.any(axis=1))
+    cols = np.flatnonzero(inside.any(axis=0))
+    if rows.size == 0:
+        return None, None
+    return (slice(rows[0], rows[-1] + 1), slice(cols[0], cols[-1] + 1)), lat.shape
+
+def read_granule(file_path, variables, group_name='geophysical_data', bbox=None):
+    # Returns {variable: decoded array} for every name in variables (None for variables missing
+    # from the file), or None if the file itself could not be read.
+    file_path = os.path.abspath(file_path)
+    try:
+        mtime = os.path.getmtime(file_path)
+    except OSError as e:
+        print(f"An error occurred while reading from {file_path}: {e}")
+        return None
+
+    def cache_key(variable):
+        return (file_path, mtime, f"{group_name}/{variable}", bbox)
+
+    product_data = {variable: _array_cache.get(cache_key(variable)) for variable in variables}
+    missing = [variable for variable, data in product_data.items() if data is None]
+    if not missing:
+        return product_data
+
+    try:
+        with Dataset(file_path, 'r') as nc:
+            group = nc.groups[group_name]
+            window, window_shape = crop_window(nc, bbox) if bbox is not None else (None, None)
+            for variable in missing:
+                if variable not in group.variables:
+                    print(f"KeyError - the variable '{variable}' in group '{group_name}' was not found in {file_path}")
+                    continue
+                var = group.variables[variable]
+                # Only crop variables on the navigation grid; anything else is read whole
+                data = decode_product(var[window] if window is not None and var.shape == window_shape else var[:])
+                _array_cache.put(cache_key(variable), data)
+                product_data[variable] = data
+    except KeyError as e:
+        print(f"KeyError - the group '{group_name}' was not found in {file_path}: {e}")
+        return None
+    except Exception as e:
+        print(f"An error occurred while reading from {file_path}: {e}")
+        return None
+
+    return product_data
@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+
+# Grouped statistics of the Acrobat parameters for transect_analysis.py and analysis.py.
+# grouped_stats computes every parameter x group x statistic in one groupby().agg() pass and
+# returns a wide table, one row per group and one '<statistic>_<parameter>' column per pair.
+# partition sorts the rows by group once and slices every parameter into per-group arrays
+# (NaN dropped), ready to be unpacked into f_oneway, kruskal, levene, shapiro or ttest_ind:
+#
+#   stats = grouped_stats(data, ['transect_id', 'depth_range'], ['temp', 'salinity'])
+#   groups = partition(data, 'transect_id', ['temp'])
+#   h_stat, p_value = kruskal(*groups['temp'].values())
+
+# output column prefix -> pandas aggregation
+STATISTICS = {
+    'mean': 'mean',
+    'median': 'median',
+    'min': 'min',
+    'max': 'max',
+    'std_dev': 'std',
+}
+
+def grouped_stats(data, by, parameters, statistics=STATISTICS):
+    aggregated = data.groupby(by, observed=True, sort=True)[list(parameters)].agg(list(statistics.values()))
+    names = {func: name for name, func in statistics.items()}
+    aggregated.columns = [f'{names[func]}_{parameter}' for parameter, func in aggregated.columns]
+    # parameters in the given order, each with its statistics in STATISTICS order
+    columns = [f'{name}_{parameter}' for parameter in parameters for name in statistics]
+    return aggregated[columns].reset_index()
+
+def partition(data, by, parameters):
+    # {parameter: {group key: values}}, group keys in sorted order; rows whose key is NaN are left out
+    grouper = data.groupby(by, observed=True, sort=True)
+    sizes = grouper.size()
+    codes = grouper.ngroup().to_numpy(dtype=float)
+    in_group = np.isfinite(codes)
+    order = np.argsort(codes[in_group], kind='stable')
+    bounds = np.concatenate([[0], np.cumsum(sizes.to_numpy())])
+
+    groups = {}
+    for parameter in parameters:
+        values = data[parameter].to_numpy(dtype=float)[in_group][order]
+        sliced = {}
+        for key, start, stop in zip(sizes.index, bounds[:-1], bounds[1:]):
+            group_values = values[start:stop]
+            sliced[key] = group_values[~np.isnan(group_values)]
+        groups[parameter] = sliced
+    return groups
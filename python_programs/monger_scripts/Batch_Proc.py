@@ -119,6 +119,19 @@ hires = 'off'
 swir_onoff = 'off'
 
 
+# Number of L1 granules processed at the same time --- Options: an integer >= 1
+# ------------------------------------------------------
+# Each granule runs in its own worker process and working directory inside l2_dir
+# (L12_work), with the output of every seadas program it calls written to
+# l2_dir/L12_logs/<granule>.L12.log.  Use 1 to process granules one at a time.
+#
+# Progress is recorded in l2_dir/L12_ledger.sqlite: rerunning skips granules whose L2
+# file was already made from the same L1 file with the same settings, and granules
+# interrupted mid-way resume after their last finished stage (GEO, L1B, ANC).
+# Delete the ledger to force everything to be reprocessed.
+max_workers_L12 = batch_L12.MAX_WORKERS_L12
+
+
 # L2GEN NOTE:
 # There are about 1 billion different options you can choose to
 # alter how l2gen processes your data and all and 99.999% are outside the
@@ -214,13 +227,16 @@ smi_proj = 'platecarree'
 ################################################################################
 ################################################################################
 
-if Input_Level == '1' and Final_level == '3':
-    batch_L12.batch_proc_L12(l1a_dir, l2_dir, prod_list_L12, prod_list_L12_sst, swir_onoff, hires, latlon)
-    batch_L23.batch_proc_L23(l2_dir, binmap_dir, prod_list_L23, space_res,time_period, color_flags, sst_flags, latlon, smi_proj, stats_yesno, straight_map)
-elif Input_Level =='1' and Final_level == '2':
-    batch_L12.batch_proc_L12(l1a_dir, l2_dir, prod_list_L12, prod_list_L12_sst, swir_onoff, hires, latlon)
-elif Input_Level == '2' and Final_level == '3':
-    batch_L23.batch_proc_L23(l2_dir, binmap_dir, prod_list_L23, space_res,time_period, color_flags, sst_flags, latlon, smi_proj, stats_yesno, straight_map)
-else:
-    print('#####  Please specify different input and output levels  #####')
-    sys.exit()
+# The __main__ guard keeps the L1 -> L2 worker processes from re-running the batch
+# when they import this module.
+if __name__ == '__main__':
+    if Input_Level == '1' and Final_level == '3':
+        batch_L12.batch_proc_L12(l1a_dir, l2_dir, prod_list_L12, prod_list_L12_sst, swir_onoff, hires, latlon, max_workers_L12)
+        batch_L23.batch_proc_L23(l2_dir, binmap_dir, prod_list_L23, space_res,time_period, color_flags, sst_flags, latlon, smi_proj, stats_yesno, straight_map)
+    elif Input_Level =='1' and Final_level == '2':
+        batch_L12.batch_proc_L12(l1a_dir, l2_dir, prod_list_L12, prod_list_L12_sst, swir_onoff, hires, latlon, max_workers_L12)
+    elif Input_Level == '2' and Final_level == '3':
+        batch_L23.batch_proc_L23(l2_dir, binmap_dir, prod_list_L23, space_res,time_period, color_flags, sst_flags, latlon, smi_proj, stats_yesno, straight_map)
+    else:
+        print('#####  Please specify different input and output levels  #####')
+        sys.exit()
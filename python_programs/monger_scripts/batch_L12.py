@@ -5,6 +5,11 @@ from subprocess import *
 import sys, os
 import shutil
 import datetime
+import time
+import fcntl
+import tempfile
+import contextlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from my_general_utilities import *
 
 sys.dont_write_bytecode = True
@@ -14,6 +19,7 @@ sys.path.insert(0, 'utilities')
 
 from my_hdf_cdf_utilities import *
 import my_general_utilities as general_utilities
+import job_ledger
 
 
 
@@ -38,15 +44,22 @@ def modis_level12(file_name, root_name, prod_list, prod_list_sst, color_l2_file_
     #print('\n >-----> First checking for attitude and ephemeris files needed for modis geolocation...')
     #general_utilities.my_modis_atteph(file_name)
 
-    print('\n -----> calling modis_GEO...\n')
     fname_geo = root_name + '.GEO'
-    call('modis_GEO -v -o ' + fname_geo + ' ' + file_name, shell=True)
-    if (not os.path.exists(fname_geo)):
-       call('modis_GEO -v --refreshDB -o ' + fname_geo + ' ' + file_name, shell=True)
-    if (not os.path.exists(fname_geo)):
-        seadas_home= os.environ['OCSSWROOT']
-        call('rm %s/run/var/log/ancillary_data.db' % seadas_home , shell=True)
-        call('modis_GEO -v -o ' + fname_geo + ' ' + file_name, shell=True)
+    if resume_stage('GEO', fname_geo):
+        print('\n -----> reusing ' + fname_geo + ' from the interrupted previous run...\n')
+    else:
+        print('\n -----> calling modis_GEO...\n')
+        # modis_GEO looks up (and with --refreshDB rewrites) the shared ancillary database
+        with ancillary_db_lock():
+            call('modis_GEO -v -o ' + fname_geo + ' ' + file_name, shell=True)
+            if (not os.path.exists(fname_geo)):
+               call('modis_GEO -v --refreshDB -o ' + fname_geo + ' ' + file_name, shell=True)
+            # rebuilding the database from scratch is only safe when no other granule is using it
+            if (not os.path.exists(fname_geo)) and not _parallel_job:
+                seadas_home= os.environ['OCSSWROOT']
+                call('rm %s/run/var/log/ancillary_data.db' % seadas_home , shell=True)
+                call('modis_GEO -v -o ' + fname_geo + ' ' + file_name, shell=True)
+        if os.path.exists(fname_geo): mark_stage('GEO')
 
 
     # -----------------------------------------------------------------------------------------
@@ -60,6 +73,7 @@ def modis_level12(file_name, root_name, prod_list, prod_list_sst, color_l2_file_
     if hires == 'off':
 
         fname_l1b = root_name + '.L1B_LAC'
+        if not resume_stage('L1B', fname_l1b) and os.path.exists(fname_l1b): os.remove(fname_l1b)  # possibly partial
         cnt = 0
         while (not os.path.exists(fname_l1b)) and cnt <= 5:
             print('\n\n ----> starting modis_L1B for standard resolution...\n\n')
@@ -71,12 +85,15 @@ def modis_level12(file_name, root_name, prod_list, prod_list_sst, color_l2_file_
          fname_l1b =     root_name + '.L1B_LAC'
          fname_l1b_hkm = root_name + '.L1B_HKM'
          fname_l1b_qkm = root_name + '.L1B_QKM'
+         if not resume_stage('L1B', fname_l1b, fname_l1b_hkm, fname_l1b_qkm) and os.path.exists(fname_l1b): os.remove(fname_l1b)  # possibly partial
          cnt = 0
          while (not os.path.exists(fname_l1b)) and cnt <= 5:
              print('\n\n ----> starting modis_L1B for hires bands...\n\n')
              call('modis_L1B -v -o ' + fname_l1b + ' ' + file_name + ' ' + fname_geo + ' -k ' + fname_l1b_hkm + ' -q ' + fname_l1b_qkm, shell=True)
              cnt+=1
 
+    if os.path.exists(fname_l1b): mark_stage('L1B')
+
     #sys.exit('exit after L1B generation')
 
     # -----------------------------------------------------------------------------------------
@@ -85,13 +102,16 @@ def modis_level12(file_name, root_name, prod_list, prod_list_sst, color_l2_file_
 
     print('\n >=====>  checking for best ancillary data (Met and Ozone) locally and retrieving from web if needed...\n\n')
 
-    call('getanc -v --refreshDB ' + file_name, shell=True)
-
     if general_utilities.fname_convention(file_name) == 'old':
         old_root_name= os.path.basename(file_name)[0:14]
         fname_ancil_list = old_root_name + '.L1A_LAC.x.hdf.anc'
     else: fname_ancil_list= root_name + '.anc'
 
+    if not resume_stage('ANC', fname_ancil_list):
+        with ancillary_db_lock():
+            call('getanc -v --refreshDB ' + file_name, shell=True)
+        if os.path.exists(fname_ancil_list): mark_stage('ANC')
+
     print('\n\nname of ancillary file determined from get_ancillary_list_fname ---> ',fname_ancil_list, '\n\n')
 
 
@@ -182,14 +202,17 @@ def seawifs_hico_level12(file_name, root_name, prod_list, color_l2_file_fname):
     if general_utilities.fname_convention(file_name) == 'old':
 
         if instrument== 'HICO':
-            os.system('getanc -v -s ' + os.path.basenme(file_name)[1:14])
+            with ancillary_db_lock():
+                os.system('getanc -v -s ' + os.path.basenme(file_name)[1:14])
             fname_ancil_list= general_utilities.get_ancillary_list_fname(os.path.basename(file_name)[1:14])
         if instrument != 'HICO':
-            os.system('getanc -v ' + file_name)
+            with ancillary_db_lock():
+                os.system('getanc -v ' + file_name)
             fname_ancil_list= general_utilities.get_ancillary_list_fname(file_name)
 
     if  general_utilities.fname_convention(file_name) == 'new':
-        os.system('getanc -v ' + file_name)
+        with ancillary_db_lock():
+            os.system('getanc -v ' + file_name)
         fname_ancil_list= general_utilities.get_ancillary_list_fname(file_name)
 
     print('\n >=====> generating level-2 OC data from level-1 data using l2gen...')
@@ -253,18 +276,22 @@ def viirs_level12(ifile, root_name, prod_list, color_l2_file_fname, prod_list_ss
             if misson == 'SNPP':   fname_geo= os.path.basename(ifile)[0:14] +  '.GEO-M_SNPP.nc'
         else: fname_geo=  root_name + '.GEO_M.nc'
 
-        call(['geolocate_viirs',
-              'ifile='       + ifile,
-              'geofile_mod=' + fname_geo,
-              'verbose='     + 'True'])
+        if not resume_stage('GEO', fname_geo):
+            call(['geolocate_viirs',
+                  'ifile='       + ifile,
+                  'geofile_mod=' + fname_geo,
+                  'verbose='     + 'True'])
+            if os.path.exists(fname_geo): mark_stage('GEO')
 
         manual_extraction_done=False
 
         # ---
-        call(['calibrate_viirs',
-              'ifile='       + ifile,
-              'l1bfile_mod=' + 'l1b_file',
-              'verbose='     + 'True'])
+        if not resume_stage('L1B', fname_geo, 'l1b_file'):
+            call(['calibrate_viirs',
+                  'ifile='       + ifile,
+                  'l1bfile_mod=' + 'l1b_file',
+                  'verbose='     + 'True'])
+            if os.path.exists('l1b_file'): mark_stage('L1B')
 
 
 
@@ -318,7 +345,8 @@ def viirs_level12(ifile, root_name, prod_list, color_l2_file_fname, prod_list_ss
     # get ancillary data...
     print('\n >=====>  checking for best ancillary data (Met and Ozone) locally and retrieving from web if needed...')
 
-    call('getanc -v ' + ifile, shell=True)
+    with ancillary_db_lock():
+        call('getanc -v ' + ifile, shell=True)
     fname_ancil_list= general_utilities.get_ancillary_list_fname(ifile)
 
     if prod_list_sst == 'none' or 'JPSS1' in ifile or 'NOAA20' in ifile:
@@ -381,8 +409,9 @@ def oli_level12(file_name, prod_list, color_l2_file_fname,latlon):
     first_band=glob.glob(file_name + '/' + '*_MTL.txt')[0] # input file for l2gen acting on landsat...
 
     #ancillary list
-    os.system('getanc -v ' + first_band)
-    general_utilities.my_getanc(first_band)
+    with ancillary_db_lock():
+        os.system('getanc -v ' + first_band)
+        general_utilities.my_getanc(first_band)
     fname_ancil_list = first_band.split('/')[-1] + '.anc'
 
     print('\n >=====> generating level-2 OC data from level-1 oli data using l2gen...')
@@ -440,7 +469,8 @@ def olci_level12(dir_name, root_name, prod_list, color_l2_file_fname,latlon):
 
 
     olci_YYYYDDDHHMMSS= general_utilities.YYYYDDDHHMMSS_from_new_fname(root_name)
-    os.system('getanc -v -s ' + olci_YYYYDDDHHMMSS)
+    with ancillary_db_lock():
+        os.system('getanc -v -s ' + olci_YYYYDDDHHMMSS)
     #fname_ancil_list = olci_YYYYDDDHHMMSS + '.anc'
     #general_utilities.my_getanc(olci_YYYYDDDHHMMSS)
     fname_ancil_list= general_utilities.get_ancillary_list_fname(olci_YYYYDDDHHMMSS)
@@ -455,13 +485,15 @@ def olci_level12(dir_name, root_name, prod_list, color_l2_file_fname,latlon):
 
     print('\n >=====> generating level-2 OC data from level-1 olci data using l2gen...')
 
+    # getanc wrote the anc list into the job's working directory; l2gen runs inside the scene dir
+    work_dir = os.getcwd()
     os.chdir(dir_name)
     call(['l2gen',
           'ifile='   + 'xfdumanifest.xml',
           'ofile1='  +  color_l2_file_fname,
           'l2prod1=' +  prod_list,
-          'par='     +  os.environ['MYPYTHONPROGRAMS'] + '/' + fname_ancil_list])
-    os.chdir(os.environ['MYPYTHONPROGRAMS'])
+          'par='     +  os.path.join(work_dir, fname_ancil_list)])
+    os.chdir(work_dir)
 
 
 
@@ -489,7 +521,8 @@ def msi_level12(dir_name, root_name, prod_list, color_l2_file_fname):
     msi_YYYYDDDHHMMSS= general_utilities.YYYYDDDHHMMSS_from_new_fname(root_name)
     #os.system('getanc -v -s ' + msi_YYYYDDDHHMMSS)
     #fname_ancil_list =msi_YYYYDDDHHMMSS + '.anc'
-    os.system('getanc -v -s ' + msi_YYYYDDDHHMMSS)
+    with ancillary_db_lock():
+        os.system('getanc -v -s ' + msi_YYYYDDDHHMMSS)
     fname_ancil_list= general_utilities.get_ancillary_list_fname(msi_YYYYDDDHHMMSS)
 
 
@@ -503,13 +536,15 @@ def msi_level12(dir_name, root_name, prod_list, color_l2_file_fname):
 
     print('\n >=====> generating level-2 OC data from level-1 oli data using l2gen...')
 
+    # getanc wrote the anc list into the job's working directory; l2gen runs inside the scene dir
+    work_dir = os.getcwd()
     os.chdir(dir_name)
     call(['l2gen',
           'ifile='   +  'manifest.safe',
           'ofile1='  +  color_l2_file_fname,
           'l2prod1=' +  prod_list,
-          'par='     +  os.environ['MYPYTHONPROGRAMS'] + '/' + fname_ancil_list])
-    os.chdir(os.environ['MYPYTHONPROGRAMS'])
+          'par='     +  os.path.join(work_dir, fname_ancil_list)])
+    os.chdir(work_dir)
 
 
 
@@ -539,7 +574,8 @@ def meris_level12(dir_name, root_name, prod_list, color_l2_file_fname):
 
 
     meris_YYYYDDDHHMMSS= general_utilities.YYYYDDDHHMMSS_from_new_fname(root_name)
-    os.system('getanc -v -s ' + meris_YYYYDDDHHMMSS)
+    with ancillary_db_lock():
+        os.system('getanc -v -s ' + meris_YYYYDDDHHMMSS)
     #fname_ancil_list = olci_YYYYDDDHHMMSS + '.anc'
     #general_utilities.my_getanc(olci_YYYYDDDHHMMSS)
     fname_ancil_list= general_utilities.get_ancillary_list_fname(meris_YYYYDDDHHMMSS)
@@ -554,13 +590,15 @@ def meris_level12(dir_name, root_name, prod_list, color_l2_file_fname):
 
     print('\n >=====> generating level-2 OC data from level-1 meris data using l2gen...\n\n')
 
+    # getanc wrote the anc list into the job's working directory; l2gen runs inside the scene dir
+    work_dir = os.getcwd()
     os.chdir(dir_name)
     call(['l2gen',
           'ifile='   + 'xfdumanifest.xml',
           'ofile1='  +  color_l2_file_fname,
           'l2prod1=' +  prod_list,
-          'par='     +  os.environ['MYPYTHONPROGRAMS'] + '/' + fname_ancil_list])
-    os.chdir(os.environ['MYPYTHONPROGRAMS'])
+          'par='     +  os.path.join(work_dir, fname_ancil_list)])
+    os.chdir(work_dir)
 
 
 
@@ -571,9 +609,12 @@ def hawkeye_level12(file_name, root_name, prod_list, color_l2_file_fname):
     #SEAHAWK1_HAWKEYE.20210927T151412.GEO.nc
 
     fname_geo = file_name[:-7] + '.GEO.nc'  #remove .L1A.nc and add .GEo.nc
-    os.system('geolocate_hawkeye ' + file_name)
+    if not resume_stage('GEO', fname_geo):
+        os.system('geolocate_hawkeye ' + file_name)
+        if os.path.exists(fname_geo): mark_stage('GEO')
 
-    os.system('getanc ' + file_name)
+    with ancillary_db_lock():
+        os.system('getanc ' + file_name)
     fname_ancil_list= general_utilities.get_ancillary_list_fname(file_name)
 
     print('\n\n\n>>>>---------------------> ancillary file name: ',fname_ancil_list)
@@ -593,7 +634,8 @@ def hawkeye_level12(file_name, root_name, prod_list, color_l2_file_fname):
 def oci_level12(file_name, root_name, prod_list, color_l2_file_fname):
 
 
-    os.system('getanc -v ' + file_name)
+    with ancillary_db_lock():
+        os.system('getanc -v ' + file_name)
     fname_ancil_list= general_utilities.get_ancillary_list_fname(file_name)
     print('\n\n\n>>>>---------------------> ancillary file name: ',fname_ancil_list)
 
@@ -643,11 +685,236 @@ def get_oc_suite(satellite_name):
     return prod_list
 
 
+# -----------------------------------------------------------------------------------------
+#       parallel scheduling of the per-granule L1 -> L2 chains
+# -----------------------------------------------------------------------------------------
+
+# Number of granules processed at the same time. Each granule runs its whole chain
+# (GEO, L1B, getanc, l2gen...) in its own worker process and working directory, so
+# the intermediate files of different granules never share a name or a directory.
+# The chains download ancillary data and take turns on the ancillary database, so a
+# few workers already keep the machine busy. Set to 1 to process granules one after
+# another as before.
+MAX_WORKERS_L12 = min(4, os.cpu_count() or 1)
+
+
+def level12_jobs(satellite_name, fname_l1a, root_name_trim, prod_list, prod_list_sst, color_l2_file_fname, sst_l2_file_fname, aerosol_corr_type, hires, latlon):
+
+    # One job per granule: (level12 function, its arguments, root_name, expected L2 file)
+    # ---
+    jobs = []
+    for i in range(0,len(fname_l1a)):
+
+        # MODIS
+        if 'MODIS' in satellite_name:
+            jobs.append((modis_level12, (fname_l1a[i], root_name_trim[i], prod_list, prod_list_sst, color_l2_file_fname[i], sst_l2_file_fname[i],  aerosol_corr_type, hires), root_name_trim[i], color_l2_file_fname[i]))
+
+        # SEAWIFS, MERIS-RR, HICO
+        if ('SEAWIFS' in satellite_name or 'HICO' in satellite_name):
+            jobs.append((seawifs_hico_level12, (fname_l1a[i], root_name_trim[i], prod_list, color_l2_file_fname[i]), root_name_trim[i], color_l2_file_fname[i]))
+
+        # VIIRS
+        if 'VIIRS' in satellite_name:
+            jobs.append((viirs_level12, (fname_l1a[i], root_name_trim[i], prod_list, color_l2_file_fname[i], prod_list_sst, sst_l2_file_fname[i],latlon), root_name_trim[i], color_l2_file_fname[i]))
+
+        # Landsat 8
+        if 'OLI' in satellite_name:
+            jobs.append((oli_level12, (fname_l1a[i], prod_list, color_l2_file_fname[i], latlon), root_name_trim[i], color_l2_file_fname[i]))
+
+        # Sentinal-3 OLCI
+        if 'OLCI' in satellite_name:
+            jobs.append((olci_level12, (fname_l1a[i], root_name_trim[i], prod_list, color_l2_file_fname[i],latlon), root_name_trim[i], color_l2_file_fname[i]))
+
+        # Sentinal-2 MSI
+        if 'MSI' in satellite_name:
+            jobs.append((msi_level12, (fname_l1a[i], root_name_trim[i], prod_list, color_l2_file_fname[i]), root_name_trim[i], color_l2_file_fname[i]))
+
+        # MERIS
+        if 'MERIS' in satellite_name:
+            jobs.append((meris_level12, (fname_l1a[i], root_name_trim[i], prod_list, color_l2_file_fname[i]), root_name_trim[i], color_l2_file_fname[i]))
+
+        # Hawkeye
+        if 'HAWKEYE' in satellite_name:
+            jobs.append((hawkeye_level12, (fname_l1a[i], root_name_trim[i], prod_list, color_l2_file_fname[i]), root_name_trim[i], color_l2_file_fname[i]))
+
+        # PACE
+        if 'OCI' in satellite_name:
+            jobs.append((oci_level12, (fname_l1a[i], root_name_trim[i], prod_list, color_l2_file_fname[i]), root_name_trim[i], color_l2_file_fname[i]))
+
+    return jobs
+
+
+# (ledger connection, job key) of the granule the current process is working on, used
+# by the level12 functions to skip stages an interrupted earlier run already completed.
+_current_job = None
+
+# True while the current process runs a granule next to other workers
+_parallel_job = False
+
+
+@contextlib.contextmanager
+def ancillary_db_lock():
+
+    # getanc and modis_GEO read and rewrite the ancillary database of the OCSSW install
+    # ($OCSSWROOT/run/var/log/ancillary_data.db); only one granule at a time, across
+    # workers and concurrent batch runs, may touch it
+    # ---
+    ocssw_root = os.environ.get('OCSSWROOT')
+    if ocssw_root is not None and os.path.isdir(ocssw_root + '/run/var/log'):
+        lock_fname = ocssw_root + '/run/var/log/ancillary_data.db.lock'
+    else:
+        lock_fname = tempfile.gettempdir() + '/ancillary_data.db.lock'
+    with open(lock_fname, 'a') as lock_file:
+        sys.stdout.flush()
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            sys.stdout.flush()
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def resume_stage(stage, *fnames):
+
+    # True if the ledger says the current job already completed this stage and the
+    # stage's output files are still in the job's working directory
+    if _current_job is None: return False
+    con, key = _current_job
+    return job_ledger.stage_reached(con, key, stage) and all(os.path.exists(f) for f in fnames)
+
+
+def mark_stage(stage):
+
+    if _current_job is None: return
+    con, key = _current_job
+    job_ledger.mark_stage(con, key, stage)
+
+
+def run_level12_job(level12_function, args, root_name, l2_fname, work_dir, log_fname, ledger_fname=None, key=None, parallel=False):
+
+    # Runs one granule's chain inside work_dir with its stdout/stderr (and that of every
+    # seadas program it calls) sent to log_fname. Returns (root_name, status, seconds, message).
+    # ---
+    global _current_job, _parallel_job
+    _parallel_job = parallel
+    if ledger_fname is not None:
+        con = job_ledger.connect(ledger_fname)
+        _current_job = (con, key)
+        # intermediates left by a job with different settings (or none recorded) can't be reused
+        if job_ledger.job_stage(con, key) is None: shutil.rmtree(work_dir, ignore_errors=True)
+
+    os.makedirs(work_dir, exist_ok=True)
+    start_dir = os.getcwd()
+    start_time = time.time()
+    l2_mtime_before = os.path.getmtime(l2_fname) if os.path.exists(l2_fname) else None
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved_stdout, saved_stderr = os.dup(1), os.dup(2)
+    log_file = open(log_fname, 'w')
+    os.dup2(log_file.fileno(), 1)
+    os.dup2(log_file.fileno(), 2)
+
+    message = ''
+    try:
+        os.chdir(work_dir)
+        level12_function(*args)
+    except (Exception, SystemExit) as e:
+        message = repr(e)
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(saved_stdout, 1)
+        os.dup2(saved_stderr, 2)
+        os.close(saved_stdout)
+        os.close(saved_stderr)
+        log_file.close()
+        os.chdir(start_dir)
+
+    if os.path.exists(l2_fname) and os.path.getmtime(l2_fname) != l2_mtime_before:
+        status = 'done'
+        shutil.rmtree(work_dir, ignore_errors=True)  # intermediates are only kept for failed granules
+    else:
+        status = 'failed'
+        if message == '': message = 'no L2 file was produced'
+
+    if _current_job is not None:
+        con, key = _current_job
+        job_ledger.finish_job(con, key, l2_fname, status)
+        con.close()
+        _current_job = None
+
+    return root_name, status, time.time() - start_time, message
+
+
+def run_level12_jobs(jobs, l2_dir, max_workers=MAX_WORKERS_L12, settings=None):
+
+    # Runs every job to completion (a failed granule does not stop the others) and
+    # reports each granule as it finishes. Working directories and logs go in l2_dir.
+    # With settings (the processing options that shape the L2 output) every job is
+    # tracked in the job ledger in l2_dir: jobs that already produced their current L2
+    # file are skipped, and interrupted jobs resume after their last completed stage.
+    # ---
+    work_root = l2_dir + '/' + 'L12_work'
+    log_dir = l2_dir + '/' + 'L12_logs'
+    os.makedirs(work_root, exist_ok=True)
+    os.makedirs(log_dir, exist_ok=True)
+
+    ledger_fname = None
+    keys = [None] * len(jobs)
+    if settings is not None:
+        ledger_fname = l2_dir + '/' + job_ledger.LEDGER_NAME
+        con = job_ledger.connect(ledger_fname)
+        pending = []
+        for level12_function, args, root_name, l2_fname in jobs:
+            key = job_ledger.job_key(job_ledger.input_hash(con, args[0]), dict(settings, level12=level12_function.__name__))
+            if job_ledger.is_complete(con, key, l2_fname):
+                print(' -----> skipping ' + root_name + ': L2 file is up to date')
+                continue
+            job_ledger.start_job(con, key, args[0], l2_fname)
+            pending.append(((level12_function, args, root_name, l2_fname), key))
+        con.close()
+        jobs = [job for job, key in pending]
+        keys = [key for job, key in pending]
+
+    if max_workers is None or max_workers < 1: max_workers = 1
+    max_workers = min(max_workers, max(len(jobs), 1))
+
+    print('\n >=====>  processing ' + str(len(jobs)) + ' granules from L1 to L2 with ' + str(max_workers) + ' worker(s)...')
+    print(' -----> per-granule logs are written to ' + log_dir + '\n')
+
+    job_args = [(level12_function, args, root_name, l2_fname, work_root + '/' + root_name, log_dir + '/' + root_name + '.L12.log', ledger_fname, key, max_workers != 1)
+                for (level12_function, args, root_name, l2_fname), key in zip(jobs, keys)]
+
+    results = []
+    if max_workers == 1:
+        completed = (run_level12_job(*a) for a in job_args)
+    else:
+        executor = ProcessPoolExecutor(max_workers=max_workers)
+        futures = [executor.submit(run_level12_job, *a) for a in job_args]
+        completed = (future.result() for future in as_completed(futures))
+
+    for root_name, status, seconds, message in completed:
+        results.append((root_name, status, seconds, message))
+        print(' [%d/%d] %s: %s (%.0f s) %s' % (len(results), len(job_args), root_name, status, seconds, message))
+
+    if max_workers != 1: executor.shutdown()
+
+    failed = [r for r in results if r[1] != 'done']
+    print('\n >=====>  L1 to L2 finished: ' + str(len(results) - len(failed)) + ' done, ' + str(len(failed)) + ' failed')
+    for root_name, status, seconds, message in failed:
+        print('          failed: ' + root_name + ' -- see ' + log_dir + '/' + root_name + '.L12.log')
+
+    if len(os.listdir(work_root)) == 0: os.rmdir(work_root)
+
+    return results
+
+
 # -----------------------------------------------------------------------------------------
 #       batch processing
 # -----------------------------------------------------------------------------------------
 
-def batch_proc_L12(l1a_dir, l2_dir, prod_list, prod_list_sst, swir_onoff, hires, latlon):
+def batch_proc_L12(l1a_dir, l2_dir, prod_list, prod_list_sst, swir_onoff, hires, latlon, max_workers=MAX_WORKERS_L12):
 
 
 
@@ -655,6 +922,10 @@ def batch_proc_L12(l1a_dir, l2_dir, prod_list, prod_list_sst, swir_onoff, hires,
     l1a_dir = general_utilities.path_reformat(l1a_dir)
     l2_dir = general_utilities.path_reformat(l2_dir)
 
+    # absolute paths, since each granule is processed from inside its own working directory
+    l1a_dir = os.path.abspath(l1a_dir)
+    if l2_dir != 'not_specified': l2_dir = os.path.abspath(l2_dir)
+
 
     # untar any tar files if necessary....
     # Large data orders from the ocweb come as tared directories that contain
@@ -747,51 +1018,14 @@ def batch_proc_L12(l1a_dir, l2_dir, prod_list, prod_list_sst, swir_onoff, hires,
 
 
 
-    # MODIS
-    if 'MODIS' in satellite_name:
-        for i in range(0,len(fname_l1a)):
-            modis_level12(fname_l1a[i], root_name_trim[i], prod_list, prod_list_sst, color_l2_file_fname[i], sst_l2_file_fname[i],  aerosol_corr_type, hires)
-
-    # SEAWIFS, MERIS-RR, HICO
-    if ('SEAWIFS' in satellite_name or 'HICO' in satellite_name):
-        for i in range(0,len(fname_l1a)):
-            seawifs_hico_level12(fname_l1a[i], root_name_trim[i], prod_list, color_l2_file_fname[i])
-
-    # VIIRS
-    if 'VIIRS' in satellite_name:
-        for i in range(0,len(fname_l1a)):
-            viirs_level12(fname_l1a[i], root_name_trim[i], prod_list, color_l2_file_fname[i], prod_list_sst, sst_l2_file_fname[i],latlon)
-
-    # Landsat 8
-    if 'OLI' in satellite_name:
-        for i in range(0,len(fname_l1a)):
-            oli_level12(fname_l1a[i], prod_list, color_l2_file_fname[i], latlon)
-
-    # Sentinal-3 OLCI
-    if 'OLCI' in satellite_name:
-        for i in range(0,len(fname_l1a)):
-            olci_level12(fname_l1a[i], root_name_trim[i], prod_list, color_l2_file_fname[i],latlon)
-
-    # Sentinal-2 MSI
-    if 'MSI' in satellite_name:
-        for i in range(0,len(fname_l1a)):
-            msi_level12(fname_l1a[i], root_name_trim[i], prod_list, color_l2_file_fname[i])
-
-    # Sentinal-2 MSI
-    if 'MERIS' in satellite_name:
-        for i in range(0,len(fname_l1a)):
-            meris_level12(fname_l1a[i], root_name_trim[i], prod_list, color_l2_file_fname[i])
-
-    # Hawkeye
-    if 'HAWKEYE' in satellite_name:
-        for i in range(0,len(fname_l1a)):
-            hawkeye_level12(fname_l1a[i], root_name_trim[i], prod_list, color_l2_file_fname[i])
-
-    # PACE
-    if 'OCI' in satellite_name:
-        for i in range(0,len(fname_l1a)):
-            oci_level12(fname_l1a[i], root_name_trim[i], prod_list, color_l2_file_fname[i])
-
+    # Each granule's L1 -> L2 chain is an independent job; run them in a bounded process pool,
+    # each inside its own working directory so the GEO/L1B/anc temp files never collide...
+    # ---
+    jobs = level12_jobs(satellite_name, fname_l1a, root_name_trim, prod_list, prod_list_sst,
+                        color_l2_file_fname, sst_l2_file_fname, aerosol_corr_type, hires, latlon)
+    settings = {'satellite_name': satellite_name, 'prod_list': prod_list, 'prod_list_sst': prod_list_sst,
+                'aer_opt': aerosol_corr_type, 'hires': hires, 'latlon': latlon}
+    run_level12_jobs(jobs, l2_dir, max_workers, settings)
 
 
 
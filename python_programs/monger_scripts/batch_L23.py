@@ -405,6 +405,7 @@ def process(filelist, time_period, out_dir, products, named_flags_2check, space_
     temp = os.path.dirname(filelist[0])
     l2bin_dir = temp + '/l2bin'
     l3bin_dir = temp + '/l3bin'
+    plan_dir =  temp + '/resampling_plans'   # str_map neighbour searches, shared by all products
 
     # the variable meas_vec is used sequentially by l2bin, l3bin to
     # compute mean, std and nops
@@ -581,7 +582,7 @@ def process(filelist, time_period, out_dir, products, named_flags_2check, space_
                 map_basename=  file_group[0][0] + file_group[0][1]
                 if prod != 'all': map_output_file= map_output_dir + '/' + map_basename + '.' + time_period + '.' + prod + '.map.nc'
                 if prod == 'all': map_output_file= map_output_dir + '/' + map_basename + '.' + time_period + '.' + 'AOP' + '.map.nc'
-                str_map_gen(file_group[1], map_output_file, prod, smi_proj, input_coords, space_res, named_flags_2check, stats_yesno)
+                str_map_gen(file_group[1], map_output_file, prod, smi_proj, input_coords, space_res, named_flags_2check, stats_yesno, plan_dir=plan_dir)
 
 
                 if os.path.exists(map_output_file):
@@ -591,6 +592,8 @@ def process(filelist, time_period, out_dir, products, named_flags_2check, space_
     if mappping_approach == 'binmap':
         shutil.rmtree(l2bin_dir)
         shutil.rmtree(l3bin_dir)
+    if os.path.exists(plan_dir):
+        shutil.rmtree(plan_dir)
 # ===============================================================
 
 
@@ -132,20 +132,18 @@ east=   180.
 #     fhigh requency noise AND to allow faster eof/svd computation, before storing in
 #     the data cube (time series of iamges) for subsequent eof/svd analysis.
 #
-# NOTE:--->  I have written a function called rebin_down_nan that acts
-#            similar to rebin expect that it ignores NANs.  In both cases (rebin and
-#            rebin_down_nan) you MUST rebin by whole factors of 2.  In the cases where
-#            your own data have x-dimensions and y-dimensions that are not divisible by
-#            factors of 2, you need to use CONGRID to temporarly increse/decrease the dimensions
-#            to the closest whole value in size that IS divisible by factors of 2. For
-#            example:  if the orginal dimensions of an image were 347 by 495 you need to
-#            to use CONGIRD to increse/decrease the image size to 346 by 496 before
-#            you use rebin.  It the current SST case this was not necseeary, but it will
-#            be the needed for many cases you encounter....
+# NOTE:--->  block_reduce (utilities/block_reduce.py) averages whole pixel blocks
+#            of reduce_resolution_factor x reduce_resolution_factor while ignoring
+#            NANs, like rebin_down_nan used to but in one vectorized pass.  When your
+#            own data have x-dimensions and y-dimensions that are not divisible by the
+#            factor, the partial blocks along the right and bottom edges are averaged
+#            over the pixels they have (use reduce_to_shape(geophys, ydim, xdim) instead
+#            for an area weighted reduction to any smaller size).  It the current SST
+#            case this was not necseeary, but it will be the needed for many cases you encounter....
 #
 #  --------------------------------------------------------------------------------------------------------
-xdim=       int(data_xdim/reduce_resolution_factor)
-ydim=       int(data_ydim/reduce_resolution_factor)
+xdim=       math.ceil(data_xdim/reduce_resolution_factor)
+ydim=       math.ceil(data_ydim/reduce_resolution_factor)
 print('/nnfiles, ydim, xdim' ,nfiles, ydim, xdim)
 data_cube=  np.zeros((nfiles, ydim, xdim), dtype=float)
 
@@ -183,7 +181,7 @@ if prod_to_analyze == 'chl':
         geophys[bad_locations1[0],bad_locations1[1]]=np.nan
         geophys[bad_locations2[0],bad_locations2[1]]=np.nan
         print('reducing resolutin of orginal file by a factor of: ', reduce_resolution_factor)
-        geophys= rebin_down_nan(geophys,ydim,xdim)
+        geophys= block_reduce(geophys,reduce_resolution_factor,'nanmean')
         print('loading file into data_cube: ', fname[i], '\n')
         data_cube[i,:,:]= geophys
 
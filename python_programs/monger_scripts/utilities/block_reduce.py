@@ -0,0 +1,154 @@
+#! /usr/bin/env python
+import warnings
+import numpy as np
+import scipy.sparse
+
+# Block reduction of 2D images (L3 maps, EOF data-cube layers) to coarser grids.
+# For integer reduction factors the image is reshaped to (ny, fy, nx, fx) and every
+# block is reduced in one numpy call, NaN treated as missing. Images whose shape is
+# not a multiple of the factor are either padded with NaN, so the edge blocks are
+# reduced over the pixels they have, or trimmed. area_reduce handles any smaller
+# output shape by weighting every input pixel by the fraction of it that falls in
+# each output pixel (IDL/congrid style area averaging), NaN again treated as missing.
+
+REDUCTIONS = ['nanmean', 'nanmedian', 'nansum', 'count', 'mean']
+
+
+def _factors(factor):
+    if np.ndim(factor) == 0:
+        return int(factor), int(factor)
+    return int(factor[0]), int(factor[1])
+
+
+def _blocks(img, fy, fx, edge):
+    # (ny, fy, nx, fx) view of the image, NaN padded or trimmed to whole blocks
+    ydim, xdim = img.shape
+    if edge == 'trim':
+        img = img[:ydim - ydim % fy, :xdim - xdim % fx]
+    elif ydim % fy or xdim % fx:
+        img = np.pad(img, ((0, -ydim % fy), (0, -xdim % fx)), mode='constant', constant_values=np.nan)
+    ny, nx = img.shape[0]//fy, img.shape[1]//fx
+    return img.reshape(ny, fy, nx, fx)
+
+
+def block_reduce(img, factor, func='nanmean', edge='pad'):
+#-----------------------------------------------------------------------
+
+    # img:    2D array
+    # factor: integer reduction factor, or (y factor, x factor)
+    # func:   one of REDUCTIONS; 'mean' lets NaN propagate like a plain average,
+    #         'count' is the number of valid (finite) pixels in each block
+    # edge:   'pad' or 'trim' for shapes that are not a multiple of the factor
+
+    if func not in REDUCTIONS:
+        print('block_reduce: func must be one of ', REDUCTIONS)
+        return None
+
+    fy, fx = _factors(factor)
+    blocks = _blocks(np.asarray(img, dtype=float), fy, fx, edge)
+
+    if func == 'mean':
+        return blocks.mean(axis=(1, 3))
+
+    if func == 'nanmedian':
+        ny, _, nx, _ = blocks.shape
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', category=RuntimeWarning)   # all-NaN blocks give NaN
+            return np.nanmedian(blocks.transpose(0, 2, 1, 3).reshape(ny, nx, fy*fx), axis=-1)
+
+    valid = np.isfinite(blocks)
+    count = valid.sum(axis=(1, 3))
+    if func == 'count':
+        return count
+
+    total = np.where(valid, blocks, 0.0).sum(axis=(1, 3))
+    if func == 'nansum':
+        return total
+
+    reduced = np.full(count.shape, np.nan)
+    np.divide(total, count, out=reduced, where=count > 0)
+    return reduced
+
+
+def _overlap_matrix(n_in, n_out):
+    # sparse (n_out, n_in) matrix of the length of input pixel k inside output pixel j,
+    # in input pixel units; when reducing, each input pixel touches at most two output pixels
+    edges = np.arange(n_out + 1)*(n_in/n_out)
+    k = np.arange(n_in)
+    j0 = np.minimum((k*n_out)//n_in, n_out - 1)
+    j1 = np.minimum(j0 + 1, n_out - 1)
+    w0 = np.minimum(k + 1, edges[j0 + 1]) - np.maximum(k, edges[j0])
+    w1 = np.where(j1 != j0, np.minimum(k + 1, edges[j1 + 1]) - np.maximum(k, edges[j1]), 0.0)
+    w1 = np.maximum(w1, 0.0)
+    rows = np.concatenate([j0, j1])
+    cols = np.concatenate([k, k])
+    return scipy.sparse.csr_matrix((np.concatenate([w0, w1]), (rows, cols)), shape=(n_out, n_in))
+
+
+def area_reduce(img, new_ydim, new_xdim, skip_nan=True):
+#-----------------------------------------------------------------------
+
+    # area weighted average of img on a (new_ydim, new_xdim) grid; the new grid must
+    # not be larger than the original in either dimension
+    img = np.asarray(img, dtype=float)
+    orig_ydim, orig_xdim = img.shape
+
+    if new_ydim > orig_ydim or new_xdim > orig_xdim:
+        print('area_reduce: dimensions of new array must not be larger than the orginal array dimmensions')
+        return None
+
+    wy = _overlap_matrix(orig_ydim, new_ydim)
+    wx = _overlap_matrix(orig_xdim, new_xdim)
+
+    def weighted(values):
+        return np.asarray((wx @ (wy @ values).T).T)
+
+    if not skip_nan:
+        return weighted(img)/weighted(np.ones_like(img))
+
+    valid = np.isfinite(img)
+    total = weighted(np.where(valid, img, 0.0))
+    weight = weighted(valid.astype(float))
+    reduced = np.full(total.shape, np.nan)
+    np.divide(total, weight, out=reduced, where=weight > 0)
+    return reduced
+
+
+def reduce_to_shape(img, new_ydim, new_xdim, skip_nan=True):
+#-----------------------------------------------------------------------
+
+    # block average when the new dimensions divide the old ones, area weighted otherwise
+    orig_ydim, orig_xdim = np.shape(img)
+    if orig_ydim % new_ydim == 0 and orig_xdim % new_xdim == 0:
+        func = 'nanmean' if skip_nan else 'mean'
+        return block_reduce(img, (orig_ydim//new_ydim, orig_xdim//new_xdim), func)
+    return area_reduce(img, new_ydim, new_xdim, skip_nan)
+
+
+def block_pyramid(img, levels, factor=2, func='nanmean'):
+#-----------------------------------------------------------------------
+
+    # multi-resolution pyramid of an L3 map: [img, img/factor, img/factor**2, ...] with
+    # levels reductions after the full resolution image. nanmean levels are built from
+    # the running block sums and valid counts, so every level is the mean of the valid
+    # pixels it covers (not a mean of means); nanmedian levels are medians of the level before.
+    img = np.asarray(img, dtype=float)
+    pyramid = [img]
+
+    if func != 'nanmean':
+        for level in range(levels):
+            # sums and counts of the level before add up to the sums and counts of this one
+            step = 'nansum' if level > 0 and func in ['nansum', 'count'] else func
+            pyramid.append(block_reduce(pyramid[-1], factor, step))
+        return pyramid
+
+    total = block_reduce(img, factor, 'nansum')
+    count = block_reduce(img, factor, 'count').astype(float)
+    for level in range(levels):
+        if level > 0:
+            total = block_reduce(total, factor, 'nansum')
+            count = block_reduce(count, factor, 'nansum')
+        reduced = np.full(count.shape, np.nan)
+        np.divide(total, count, out=reduced, where=count > 0)
+        pyramid.append(reduced)
+    return pyramid
@@ -0,0 +1,122 @@
+#! /usr/bin/env python
+import os
+import json
+import time
+import sqlite3
+import hashlib
+
+# Persistent ledger of L1 -> L2 jobs, kept as an SQLite file next to the L2 files.
+# A job is identified by a key built from the content hash of its input granule and
+# every setting that changes the L2 output (sensor, product lists, aer_opt, ...), and
+# the ledger records the last processing stage the job completed. A rerun of
+# batch_proc_L12 skips jobs whose L2 file is still the one the ledger recorded, and
+# resumes interrupted jobs after their last completed stage.
+
+LEDGER_NAME = 'L12_ledger.sqlite'
+STAGES = ['GEO', 'L1B', 'ANC', 'L2']   # in processing order
+HASH_CHUNK_BYTES = 1024 * 1024
+
+
+def connect(ledger_fname):
+
+    con = sqlite3.connect(ledger_fname, timeout=60)   # several worker processes write to it
+    con.execute('PRAGMA journal_mode=WAL')
+    con.execute('''CREATE TABLE IF NOT EXISTS jobs (
+                       job_key    TEXT PRIMARY KEY,
+                       input_file TEXT,
+                       l2_file    TEXT,
+                       stage      TEXT,
+                       status     TEXT,
+                       l2_size    INTEGER,
+                       l2_mtime   REAL,
+                       updated    REAL)''')
+    con.execute('''CREATE TABLE IF NOT EXISTS file_hashes (
+                       path   TEXT PRIMARY KEY,
+                       size   INTEGER,
+                       mtime  REAL,
+                       sha256 TEXT)''')
+    return con
+
+
+def input_hash(con, path):
+
+    # sha256 of a granule file, or of every file in a scene directory (OLCI, MSI,
+    # Landsat...). Hashes are cached by (path, size, mtime) so unchanged inputs are
+    # only read once.
+    # ---
+    if os.path.isdir(path):
+        files = sorted(os.path.join(root, f) for root, dirs, names in os.walk(path) for f in names)
+    else:
+        files = [path]
+
+    size = sum(os.path.getsize(f) for f in files)
+    mtime = max([os.path.getmtime(f) for f in files] + [os.path.getmtime(path)])
+
+    row = con.execute('SELECT size, mtime, sha256 FROM file_hashes WHERE path=?', (path,)).fetchone()
+    if row is not None and row[0] == size and row[1] == mtime:
+        return row[2]
+
+    sha = hashlib.sha256()
+    for f in files:
+        sha.update(os.path.relpath(f, path).encode())
+        with open(f, 'rb') as fh:
+            for chunk in iter(lambda: fh.read(HASH_CHUNK_BYTES), b''):
+                sha.update(chunk)
+
+    with con:
+        con.execute('INSERT OR REPLACE INTO file_hashes VALUES (?,?,?,?)', (path, size, mtime, sha.hexdigest()))
+    return sha.hexdigest()
+
+
+def job_key(input_sha256, settings):
+
+    # settings: dict of everything (besides the input itself) that changes the L2 output
+    return hashlib.sha256((input_sha256 + json.dumps(settings, sort_keys=True)).encode()).hexdigest()
+
+
+def job_stage(con, key):
+
+    # last completed stage of the job, or None if it has not completed any
+    row = con.execute('SELECT stage FROM jobs WHERE job_key=?', (key,)).fetchone()
+    return None if row is None else row[0]
+
+
+def stage_reached(con, key, stage):
+
+    completed = job_stage(con, key)
+    return completed in STAGES and STAGES.index(completed) >= STAGES.index(stage)
+
+
+def is_complete(con, key, l2_fname):
+
+    # True when the job finished and its L2 file is still the one it produced
+    row = con.execute('SELECT status, l2_size, l2_mtime FROM jobs WHERE job_key=?', (key,)).fetchone()
+    if row is None or row[0] != 'done' or not os.path.exists(l2_fname):
+        return False
+    return row[1] == os.path.getsize(l2_fname) and row[2] == os.path.getmtime(l2_fname)
+
+
+def start_job(con, key, input_file, l2_fname):
+
+    with con:
+        con.execute('INSERT OR IGNORE INTO jobs (job_key, input_file, l2_file, stage, status, updated) VALUES (?,?,?,?,?,?)',
+                    (key, input_file, l2_fname, None, 'pending', time.time()))
+        con.execute('UPDATE jobs SET status=?, updated=? WHERE job_key=?', ('running', time.time(), key))
+
+
+def mark_stage(con, key, stage):
+
+    with con:
+        con.execute('UPDATE jobs SET stage=?, updated=? WHERE job_key=?', (stage, time.time(), key))
+
+
+def finish_job(con, key, l2_fname, status):
+
+    # status is 'done' or 'failed'; a failed job keeps its last completed stage for the next run
+    if status == 'done':
+        with con:
+            con.execute('UPDATE jobs SET stage=?, status=?, l2_size=?, l2_mtime=?, updated=? WHERE job_key=?',
+                        ('L2', 'done', os.path.getsize(l2_fname), os.path.getmtime(l2_fname), time.time(), key))
+    else:
+        with con:
+            con.execute('UPDATE jobs SET status=?, updated=? WHERE job_key=?', (status, time.time(), key))
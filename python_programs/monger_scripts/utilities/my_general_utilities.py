@@ -12,6 +12,7 @@ import zipfile, tarfile
 import shutil
 
 from my_hdf_cdf_utilities import *
+from block_reduce import block_reduce, area_reduce, reduce_to_shape, block_pyramid
 import map_coords
 
 import subprocess #Added for Sean Bailey's fix in lines 172... to avoid reading hdf file
@@ -148,8 +149,8 @@ def YYYYDDDHHMMSS_from_new_fname(ifile):
 
 
 def rebin(a,new_shape):
-    a_view= a.reshape(new_shape[0],a.shape[0]/new_shape[0],new_shape[1],a.shape[1]/new_shape[1])
-    return a_view.mean(axis=3).mean(axis=1)
+    # plain average over blocks (NaN propagates); see block_reduce.py
+    return reduce_to_shape(a, new_shape[0], new_shape[1], skip_nan=False)
 
 
 
@@ -242,28 +243,68 @@ def is_compressed(file):
 #   ydim ==> number of y pixels in output image
 # output: 2D array of size (xdim, ydim)
 #
-def map_resize(data, latitudes, longitudes, xdim, ydim):
+def latlon_bin_index(latitudes, longitudes, xdim, ydim):
+    # Flat index (row*xdim + col) of the global ydim x xdim grid cell of every lat/lon pair,
+    # -1 for non-finite positions. Row 0 starts at -90, column 0 at -180; longitudes
+    # given as 0..360 wrap around the 180 degree line onto the same -180..180 grid.
     lon1 = -180.0
     lon2 = 180.0
     lat1 = -90.0
     lat2 = 90.0
 
-    mapped = np.empty((ydim,xdim))
-    mapped[:,:] = np.nan
-
     pixels_per_lat = ydim/(lat2 - lat1)
     pixels_per_lon = xdim/(lon2 - lon1)
 
-    # map longitudes and latitudes to pixel number
-    lon_pix = np.where(longitudes <= 180, (longitudes+180)*pixels_per_lon, (longitudes-179)*pixels_per_lon)
-    lat_pix = [(lat + 90)*pixels_per_lat for lat in latitudes]
+    latitudes = np.asarray(latitudes, dtype=float)
+    longitudes = np.asarray(longitudes, dtype=float)
+    valid = np.isfinite(latitudes) & np.isfinite(longitudes)
+
+    lon_pix = np.floor(np.mod(np.where(valid, longitudes, 0.0) - lon1, 360.0)*pixels_per_lon).astype(np.int64)
+    lat_pix = np.floor((np.where(valid, latitudes, 0.0) - lat1)*pixels_per_lat).astype(np.int64)
+    lon_pix = np.clip(lon_pix, 0, xdim - 1)   # guards the exact +180/+90 edges
+    lat_pix = np.clip(lat_pix, 0, ydim - 1)
+
+    return np.where(valid, lat_pix*xdim + lon_pix, -1)
+
 
-    # put each lat/lon in its spot on rectangular grid
-    def func(lat,lon,value): mapped[lat,lon] = value
-    list(map( lambda i: [func(lat_pix[i], lon_pix[j], data[i,j]) for j in range(0,len(lon_pix))] ,list(range(0,len(lat_pix))) ))
+def map_resize(data, latitudes, longitudes, xdim, ydim, reduce='last'):
+    # Grid data onto a global ydim x xdim lat/lon map in one array operation.
+    # latitudes/longitudes are either the 1D row/column coordinates of a 2D data array
+    # (e.g. Reynolds OI, SSM/I) or arrays with the same shape as data.
+    #   reduce='last'  --> value of the last pixel (in row-major order) landing in each cell
+    #   reduce='mean'  --> mean of the finite values landing in each cell
+    #   reduce='count' --> number of finite values landing in each cell
+    data = np.asarray(data, dtype=float)
+    latitudes = np.asarray(latitudes, dtype=float)
+    longitudes = np.asarray(longitudes, dtype=float)
+    if latitudes.shape != data.shape:
+        latitudes, longitudes = np.meshgrid(latitudes, longitudes, indexing='ij')
 
+    index = latlon_bin_index(latitudes, longitudes, xdim, ydim).ravel()
+    values = data.ravel()
+    ncells = xdim*ydim
 
-    return mapped
+    if reduce == 'last':
+        mapped = np.full(ncells, np.nan)
+        on_grid = np.flatnonzero(index >= 0)
+        # first hit in the reversed order is the last pixel written to each cell
+        cells, first = np.unique(index[on_grid][::-1], return_index=True)
+        mapped[cells] = values[on_grid[::-1][first]]
+        return mapped.reshape(ydim, xdim)
+
+    use = (index >= 0) & np.isfinite(values)
+    count = np.bincount(index[use], minlength=ncells)
+    if reduce == 'count':
+        return count.reshape(ydim, xdim)
+
+    if reduce == 'mean':
+        total = np.bincount(index[use], weights=values[use], minlength=ncells)
+        mapped = np.full(ncells, np.nan)
+        np.divide(total, count, out=mapped, where=count > 0)
+        return mapped.reshape(ydim, xdim)
+
+    print("map_resize: reduce must be 'last', 'mean' or 'count'")
+    return None
 
 
 
@@ -1041,31 +1082,9 @@ def rebin_down_nan(orig_img, new_ydim, new_xdim):
 
     #WRITTEN BY BRUCE MONGER, CORNELL UNIVERSITY, FEBRUARY 14, 2015
 
-    orig_ydim, orig_xdim = orig_img.shape
-
-
-    if (np.mod(orig_xdim, new_xdim) != 0) or (np.mod(orig_ydim, new_ydim) != 0):
-        print('dimensions of new array must be integer value of orginal array dimmension')
-        return ['']
-
-
-    new_img=   np.zeros((new_ydim,new_xdim), dtype=float)
-    xbox=      int(orig_xdim/new_xdim)
-    ybox=      int(orig_ydim/new_ydim)
-
-
-    start_xi=  np.arange(new_xdim)*xbox
-    end_xi=    start_xi + (xbox-1)
-    start_yi=  np.arange(new_ydim)*ybox
-    end_yi=    start_yi + (ybox-1)
-
-
-    for i in range(new_ydim):
-        for j in range(new_xdim):
-            box=   orig_img[start_yi[i]:end_yi[i],start_xi[j]:end_xi[j]]
-            new_img[i,j]=  np.nanmean(box)
-
-    return new_img
+    # Whole-factor reductions average every full pixel block in one vectorized pass;
+    # other new dimensions are area weighted (see block_reduce.py).
+    return reduce_to_shape(orig_img, new_ydim, new_xdim)
 
 
 
@@ -1,7 +1,9 @@
 #!/usr/bin/env python
 
 
+import os
 import subprocess
+from collections import OrderedDict
 from netCDF4 import Dataset
 from pyhdf.SD import *
 
@@ -32,91 +34,144 @@ def hdf_cdf_version(ifile):
     return ftype
 
 
+# Open-file pool: read_hdf_prod and the attribute helpers below keep the most recently
+# used files open (at most HDF_HANDLE_POOL_SIZE, least recently used closed first), so
+# reading a granule's product, longitude, latitude, l2_flags and scaling attributes
+# opens it once instead of once per call. The file type is found once per file and a
+# variable name -> variable index is built when the file is opened, so a read is a
+# dictionary lookup plus one read of the variable. A file that changed on disk since it
+# was opened is reopened. Use close_hdf_files() before rewriting or deleting a file.
+HDF_HANDLE_POOL_SIZE = 8
+_hdf_handles = OrderedDict()
 
 
-def read_hdf_prod(ifile,prod,nc_autoscale=False):
+def _close_hdf_handle(hfile):
+    if hfile['ftype'] == 'hdf4':
+        for d1 in hfile['variables'].values():
+            d1.endaccess()
+        hfile['handle'].end()
+    else:
+        hfile['handle'].close()
+
+
+def _netcdf_variable_index(f):
+    # variable name -> variable. Variables are looked for where read_hdf_prod always looked:
+    # at the top level when the file has no groups or is an smi file (only group 'processing_control'),
+    # otherwise inside the groups, the first group holding the name winning.
+    group_names= list(f.groups.keys())
+
+    if len(group_names) == 0 or group_names[0] == 'processing_control':
+        return dict(f.variables)
+
+    variables= {}
+    for grp_name in group_names:
+        for vn, p in f.groups[grp_name].variables.items():
+            variables.setdefault(vn, p)
+    return variables
+
+
+def open_hdf_file(ifile):
 #---------------------------------------------------------------
+    stat= os.stat(ifile)
+    key= os.path.abspath(ifile)
+
+    hfile= _hdf_handles.get(key)
+    if hfile is not None:
+        if hfile['stat'] == (stat.st_size, stat.st_mtime_ns):
+            _hdf_handles.move_to_end(key)
+            return hfile
+        close_hdf_files(ifile)
+
     ftype= hdf_cdf_version(ifile)
 
     if ftype == 'hdf4':
+        hfile= {'ftype': ftype, 'handle': SD(ifile,SDC.READ), 'variables': {}}   # sds are selected when first read
 
-       DATAFIELD_NAME=prod
+    if ftype == 'hdf5':
+        f = Dataset(ifile, 'r')
+        hfile= {'ftype': ftype, 'handle': f, 'variables': _netcdf_variable_index(f)}
 
-       f= SD(ifile,SDC.READ)
-       d1 = f.select(DATAFIELD_NAME)
+    hfile['stat']= (stat.st_size, stat.st_mtime_ns)
+    _hdf_handles[key]= hfile
 
-       data= d1[:,:]
+    while len(_hdf_handles) > HDF_HANDLE_POOL_SIZE:
+        _close_hdf_handle(_hdf_handles.popitem(last=False)[1])
 
-       d1.endaccess()
-       f.end()
+    return hfile
 
-       return data
 
+def hdf_file_variable(hfile, prod):
+#---------------------------------------------------------------
+    if hfile['ftype'] == 'hdf4':
+        if prod not in hfile['variables']:
+            hfile['variables'][prod]= hfile['handle'].select(prod)
+        return hfile['variables'][prod]
 
-    if ftype == 'hdf5':
+    return hfile['variables'].get(prod)
 
 
-        f = Dataset(ifile, 'r')
-        if nc_autoscale==False:
-            f.set_auto_maskandscale(False)  # NOTE: setting this to False turnes OFF the automatic (on the fly) application of scale_factor and off_set when netdcf4 data are read
-                                            # scale_factor and off_set when netdcf4 data are read in.  This was done to ensure consistent application of slope intercerpt
-                                            # which now will have to be done manually after reading things into the main program not matter how the netcdf data were written out.
-            print('\n----------------------------------------------------------------------------------------------------')
-            print('Reading netCDF4 data (using -- read_hdf_prod -- fuction) with automatic mask and scale turned OFF!!')
-            print('This means you are REQUIRED to manually apply any scale_factor and offset to the NetCDF data after')
-            print('reading it in with this function...')
-            print("TO TURN ON AUTOSCALE USE THE FOLLWING: data=read_hdf_prod(fname, prodname, nc_autoscale='True')")
-            print('----------------------------------------------------------------------------------------------------\n')
+def close_hdf_files(ifile=None):
+#---------------------------------------------------------------
+    # close one pooled file, or all of them when no file is given
+    if ifile is None:
+        keys= list(_hdf_handles.keys())
+    else:
+        keys= [os.path.abspath(ifile)]
 
+    for key in keys:
+        hfile= _hdf_handles.pop(key, None)
+        if hfile is not None:
+            _close_hdf_handle(hfile)
 
-        group_names= list(f.groups.keys())  #get group names (e.g. geophtsical_data_sets or navigation)
 
+def _forget_hdf_files():
+    # a forked worker must not share the parent's library handles, so it starts with an empty pool
+    _hdf_handles.clear()
 
-        if len(group_names) != 0:
+os.register_at_fork(after_in_child=_forget_hdf_files)
 
-              #if smi format has one group called 'processing_control', but the variables at top level (under no group) so read as if no groups
-              if group_names[0] == 'processing_control':
 
-                  p =  f.variables[prod]
-                  if len(p.shape) == 1:data=  p[:]
-                  if len(p.shape) == 2:data=  p[:,:]
-                  if len(p.shape) == 3:data=  p[:,:,:]
-                  if len(p.shape) == 4:data=  p[:,:,:,:]
 
-                  f.close()
-                  return data
 
 
-              #for all other regular l2 netcdf4 files with groups and varibles under groups
-              else:
+def read_hdf_prod(ifile,prod,nc_autoscale=False):
+#---------------------------------------------------------------
+    hfile= open_hdf_file(ifile)
 
-                  for grp_name in group_names:
-                      var_name= list(f.groups[grp_name].variables.keys())  #get names of objects within each group (e,g. chlor_a or longitude)
-                      for vn in var_name:
-                          if vn == prod:
+    if hfile['ftype'] == 'hdf4':
 
-                              p =  f.groups[grp_name].variables[vn]
-                              if len(p.shape) == 1:data=  p[:]
-                              if len(p.shape) == 2:data=  p[:,:]
-                              if len(p.shape) == 3:data=  p[:,:,:]
-                              if len(p.shape) == 4:data=  p[:,:,:,:]
+       DATAFIELD_NAME=prod
 
-                              f.close()
-                              return data
+       d1 = hdf_file_variable(hfile, DATAFIELD_NAME)
+       data= d1[:,:]
 
+       return data
 
-        # netcdf4 file has NO groups so variable are at top level and not under a group...
-        else:
-            var_name= list(f.variables.keys())
 
-            p =  f.variables[prod]
-            if len(p.shape) == 1:data=  p[:]
-            if len(p.shape) == 2:data=  p[:,:]
-            if len(p.shape) == 3:data=  p[:,:,:]
-            if len(p.shape) == 4:data=  p[:,:,:,:]
+    if hfile['ftype'] == 'hdf5':
 
-            f.close()
-            return data
+        if nc_autoscale==False:
+            # NOTE: with autoscale False the automatic (on the fly) application of scale_factor and off_set is turned OFF when netdcf4 data are read
+            # in.  This was done to ensure consistent application of slope intercerpt
+            # which now will have to be done manually after reading things into the main program not matter how the netcdf data were written out.
+            print('\n----------------------------------------------------------------------------------------------------')
+            print('Reading netCDF4 data (using -- read_hdf_prod -- fuction) with automatic mask and scale turned OFF!!')
+            print('This means you are REQUIRED to manually apply any scale_factor and offset to the NetCDF data after')
+            print('reading it in with this function...')
+            print("TO TURN ON AUTOSCALE USE THE FOLLWING: data=read_hdf_prod(fname, prodname, nc_autoscale='True')")
+            print('----------------------------------------------------------------------------------------------------\n')
+
+
+        p = hdf_file_variable(hfile, prod)
+        if p is None:
+            print('\n', prod, ' not found in ', ifile, '\n')
+            return None
+
+        # the handle is shared between calls, so the autoscale setting is made on the variable for every read
+        p.set_auto_maskandscale(nc_autoscale!=False)
+        data= p[:]
+
+        return data
 
 
 
@@ -278,6 +333,7 @@ def write_netcdf4_map(ofile, prod, proj_type, map_coords, space_res, named_flags
 
 
     # groups
+    close_hdf_files(ofile)   # a pooled read handle on ofile would block rewriting it
     root_grp = Dataset(ofile, 'w', format='NETCDF4')
     fcstgrp = root_grp.createGroup('Mapped_Data_and_Params')
 
@@ -329,6 +385,7 @@ def write_generic_2D_netcdf4(ofile, data_2d):
 
     ydim, xdim = data_2d.shape
 
+    close_hdf_files(ofile)   # a pooled read handle on ofile would block rewriting it
     root_grp = Dataset(ofile, 'w', format='NETCDF4')
     fcstgrp = root_grp.createGroup('Data')
 
@@ -476,12 +533,11 @@ def get_l2hdf_slope_intercept(ifile, prod):
     slope_inter= np.asarray([1.0, 0.0])
 
 
-    ftype= hdf_cdf_version(ifile)
+    hfile= open_hdf_file(ifile)
 
-    if ftype == 'hdf4':
+    if hfile['ftype'] == 'hdf4':
 
-        f= SD(ifile)
-        d1 = f.select(prod)
+        d1 = hdf_file_variable(hfile, prod)
 
         d1Attr= d1.attributes()
         attNames= list(d1Attr.keys())
@@ -494,26 +550,16 @@ def get_l2hdf_slope_intercept(ifile, prod):
             if nm == 'scale_factor': slope_inter[0]= float(d1Attr[nm])
             if nm == 'add_offset': slope_inter[1]= float(d1Attr[nm])
 
-        d1.endaccess()
-        f.end()
         return slope_inter
 
 
-    if ftype == 'hdf5':
-
-        f = Dataset(ifile, 'r')
-        group_names= list(f.groups.keys())    #get group names (e.g. geophtsical_data_sets or navigation)
-
+    if hfile['ftype'] == 'hdf5':
 
-        for grp_name in group_names:
-            var_name= list(f.groups[grp_name].variables.keys())  #get names of objects within each group (e,g. chlor_a or longitude)
-            for vn in var_name:
-                if vn == prod:
-                    p =  f.groups[grp_name].variables[vn]
-                    try: slope_inter= np.asarray([float(p.scale_factor), float(p.add_offset)])
-                    except: print('\nDid not find slope intercept valules in l2 file. Using as default: slope = 1.0 and interecept = 0.0\n')
+        p = hdf_file_variable(hfile, prod)
+        if p is not None:
+            try: slope_inter= np.asarray([float(p.scale_factor), float(p.add_offset)])
+            except: print('\nDid not find slope intercept valules in l2 file. Using as default: slope = 1.0 and interecept = 0.0\n')
 
-        f.close()
         return slope_inter
 
 
@@ -542,22 +588,13 @@ def get_l3mapgen_slope_intercept(ifile, prod):
 def get_l2hdf_full_l2flags_names(ifile):
 
 
-    ftype= hdf_cdf_version(ifile)
+    hfile= open_hdf_file(ifile)
+    ftype= hfile['ftype']
 
     if ftype == 'hdf5':
 
-        f = Dataset(ifile, 'r')
-        group_names= list(f.groups.keys())    #get group names (e.g. geophtsical_data_sets or navigation)
-
-
-        for grp_name in group_names:
-            var_name= list(f.groups[grp_name].variables.keys())  #get names of objects within each group (e,g. chlor_a or longitude)
-            for vn in var_name:
-                if vn == 'l2_flags':
-                    p =  f.groups[grp_name].variables[vn]
-                    flag_names= p.flag_meanings
+        flag_names= hdf_file_variable(hfile, 'l2_flags').flag_meanings
 
-        f.close()
         flag_names_list= flag_names.split(' ') ##list form
         flag_names_vec=  np.asarray(flag_names_list, dtype='|S8') #vector form
 
@@ -17,6 +17,10 @@ import sys, os
 import subprocess
 import math
 import shutil
+import hashlib
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 
 from matplotlib import *
 import matplotlib.pyplot as plt
@@ -52,28 +56,21 @@ def compute_cntr_latlon(south,west,north,east):
     return center_lat, center_lon
 
 
-def map_l2_to_cyl(l2_lon, l2_lat, l2_data, l2_resolution, map_coords):
-#-------------------------------------------------------------------------------
-
-    # if lat and lon 2D arrays are not the same dimesions as the geophy data dimensions
-    # then lineratly intereloplte lat lon values to the same 2d dimensions as the data...
-    # ---
-    ydim_data,  xdim_data    = l2_data.shape
-    ydim_latlon, xdim_latlon = l2_lon.shape
-
-
-    if ydim_latlon != ydim_data or xdim_latlon != xdim_data:
-
-        im=Image.fromarray(l2_lon)
-        im= im.resize(l2_data.shape, resample=Image.BILINEAR)
-        l2_lon= np.array(im)
-
-        im=Image.fromarray(l2_lat)
-        im= im.resize(l2_data.shape, resample=Image.BILINEAR)
-        l2_lat= np.array(im)
-
+# Resampling plans: the nearest-neighbour search that maps an l2 swath onto the
+# cylindrical output grid only depends on the swath navigation (lon/lat), the data
+# shape and the map grid, so it is done once per granule and kept as a plan -- for
+# every output pixel, the flat index of the swath pixel it takes its value from (-1
+# for none). Mapping a product is then a plain array gather, so chlor_a, Kd_490 and
+# all the Rrs bands of a granule share a single kd-tree search. Plans are kept in
+# memory (the last RESAMPLING_PLAN_CACHE_SIZE) and, when a plan_dir is given, saved
+# there as .npz files so later runs and other worker processes can reuse them.
+RESAMPLING_PLAN_CACHE_SIZE = 8
+RADIUS_OF_INFLUENCE = 5000   # meters; original radius of influence 5000 works for 1km resoluton swath
+_resampling_plans = OrderedDict()
 
 
+def cyl_area_def(l2_resolution, map_coords):
+#-------------------------------------------------------------------------------
 
     # NOTE: l2_lon, l2_latm l2_data are 2D arrays read in from an l2 files read
     # in the main program
@@ -140,19 +137,115 @@ def map_l2_to_cyl(l2_lon, l2_lat, l2_data, l2_resolution, map_coords):
 
 
     # area_def = pr.utils.get_area_def(area_id, area_name, proj_id, proj4_args, xdim, ydim, area_extent)
-    area_def = AreaDefinition(area_id, area_name, proj_id, proj4_args, xdim, ydim, area_extent)
-    swath_def = pr.geometry.SwathDefinition(l2_lon, l2_lat)
-    result = pr.kd_tree.resample_nearest(swath_def, l2_data, area_def, \
-                        radius_of_influence=5000, fill_value=-32767.0)
+    return AreaDefinition(area_id, area_name, proj_id, proj4_args, xdim, ydim, area_extent)
+
+
+
+def resampling_plan(l2_lon, l2_lat, data_shape, l2_resolution, map_coords, plan_dir=None):
+#-------------------------------------------------------------------------------
+
+    bounds= (float(map_coords.south), float(map_coords.west), float(map_coords.north), float(map_coords.east))
+    key= hashlib.sha1(np.ascontiguousarray(l2_lon).tobytes() + np.ascontiguousarray(l2_lat).tobytes() +
+                      repr((tuple(data_shape), float(l2_resolution), bounds, RADIUS_OF_INFLUENCE)).encode()).hexdigest()
+
+    if key in _resampling_plans:
+        _resampling_plans.move_to_end(key)
+        return _resampling_plans[key]
+
+    plan_fname= None if plan_dir is None else plan_dir + '/' + key + '.npz'
+
+    plan= None
+    if plan_fname is not None and os.path.exists(plan_fname):
+        try:
+            with np.load(plan_fname) as saved:
+                plan= {'shape': tuple(saved['shape']), 'source_index': saved['source_index']}
+        except (OSError, EOFError, ValueError, KeyError, zipfile.BadZipFile) as e:
+            print('\n -----> unreadable resampling plan ' + plan_fname + ' (' + str(e) + '), recomputing it...')
+
+    if plan is None:
+
+        # if lat and lon 2D arrays are not the same dimesions as the geophy data dimensions
+        # then lineratly intereloplte lat lon values to the same 2d dimensions as the data...
+        # ---
+        ydim_data,  xdim_data    = data_shape
+        ydim_latlon, xdim_latlon = l2_lon.shape
+
+
+        if ydim_latlon != ydim_data or xdim_latlon != xdim_data:
+
+            im=Image.fromarray(l2_lon)
+            im= im.resize(data_shape, resample=Image.BILINEAR)
+            l2_lon= np.array(im)
+
+            im=Image.fromarray(l2_lat)
+            im= im.resize(data_shape, resample=Image.BILINEAR)
+            l2_lat= np.array(im)
+
+        area_def = cyl_area_def(l2_resolution, map_coords)
+        swath_def = pr.geometry.SwathDefinition(l2_lon, l2_lat)
+
+        # same neighbour search resample_nearest does, kept as gather indices
+        valid_input_index, valid_output_index, index_array, distance_array = \
+            pr.kd_tree.get_neighbour_info(swath_def, area_def, RADIUS_OF_INFLUENCE, neighbours=1)
+
+        input_positions=  flatnonzero(valid_input_index)
+        output_positions= flatnonzero(valid_output_index)
+        index_array= asarray(index_array).ravel()
+        found= index_array < len(input_positions)       # index == number of inputs means no neighbour
 
-     #original radius of influence 5000 works for 1km resoluton swath
-     #so for 90 meter maybe try 10x high or lower
+        source_index= full(area_def.shape[0]*area_def.shape[1], -1, dtype=int64)
+        source_index[output_positions[found]]= input_positions[index_array[found]]
 
-    fill_locations= where(result == -32767.0)
-    if len(fill_locations[0]) != 0 : result[fill_locations]= nan
+        plan= {'shape': tuple(area_def.shape), 'source_index': source_index}
 
+        if plan_fname is not None:
+            # workers may save plans at the same time; write-then-rename so a plan file is
+            # either complete or absent, even if the run is interrupted
+            os.makedirs(plan_dir, exist_ok=True)
+            tmp_fname= plan_fname + '.' + str(os.getpid()) + '.tmp'
+            with open(tmp_fname, 'wb') as f:
+                np.savez(f, shape=asarray(plan['shape']), source_index=source_index)
+            os.replace(tmp_fname, plan_fname)
 
-    return result
+    _resampling_plans[key]= plan
+    while len(_resampling_plans) > RESAMPLING_PLAN_CACHE_SIZE: _resampling_plans.popitem(last=False)
+
+    return plan
+
+
+
+def apply_resampling_plan(plan, l2_data):
+#-------------------------------------------------------------------------------
+
+    # nearest-neighbour mapped copy of l2_data, NaN where no swath pixel is in range
+    l2_data= np.ma.filled(np.ma.asarray(l2_data, dtype=float), nan).ravel()
+    source_index= plan['source_index']
+
+    result= full(source_index.shape, nan)
+    found= source_index >= 0
+    result[found]= l2_data[source_index[found]]
+
+    result[result == -32767.0]= nan
+    return result.reshape(plan['shape'])
+
+
+
+def map_l2_to_cyl(l2_lon, l2_lat, l2_data, l2_resolution, map_coords, plan_dir=None):
+#-------------------------------------------------------------------------------
+
+    plan= resampling_plan(l2_lon, l2_lat, l2_data.shape, l2_resolution, map_coords, plan_dir)
+    return apply_resampling_plan(plan, l2_data)
+
+
+
+def map_l2_prods_to_cyl(l2_lon, l2_lat, prod_data, l2_resolution, map_coords, plan_dir=None):
+#-------------------------------------------------------------------------------
+
+    # map several products of one granule (prod_data: dict of name -> 2D array of the
+    # same shape) with a single neighbour search; returns dict of name -> mapped array
+    shape= next(iter(prod_data.values())).shape
+    plan= resampling_plan(l2_lon, l2_lat, shape, l2_resolution, map_coords, plan_dir)
+    return {prod: apply_resampling_plan(plan, data) for prod, data in prod_data.items()}
 
 
 
@@ -422,9 +515,42 @@ def write_png_with_basemap(png_fname, geophys_img, product, latlon, proj_name):
 
 
 
+# Combined l2_flags bitmask of every (sensor, flag-name list) seen so far, so the flag
+# names are looked up in a file's flag_meanings only once per sensor and flag set
+_l2flag_bitmasks = {}
+
+
+def l2flag_bitmask(l2_file, l2flag_names_to_check):
+#----------------------------------------------------------------------------------------------------
+
+    # one uint32 with the bit of every named flag set (flag number n is bit n-1)
+    sensor= os.path.basename(l2_file).split('.')[0]    # MISSION_INSTRUMENT for new style names
+    key= (sensor, l2flag_names_to_check)
+
+    if key not in _l2flag_bitmasks:
+
+        flag_names= [(name.decode() if isinstance(name, bytes) else str(name))[:8] for name in get_l2hdf_full_l2flags_names(l2_file)]
+
+        combined= uint32(0)
+        for name in l2flag_names_to_check.split(','):
+            name= name.strip()[:8]       # names are compared as |S8, as in l2flag_names_to_2lflag_number
+            if name not in flag_names:
+                print('\n l2 flag ' + name + ' not found in the l2_flags of ' + l2_file + ' -- it will not be checked\n')
+                continue
+            combined |= uint32(1) << uint32(flag_names.index(name))
+
+        _l2flag_bitmasks[key]= combined
+
+    return _l2flag_bitmasks[key]
+
+
+
 def mask_from_l2flags(l2_file, l2flag_names_to_check):
 #----------------------------------------------------------------------------------------------------
 
+    # Returns a boolean array that is True where the data are valid (no checked
+    # flag tripped / acceptable sst quality) and False elsewhere, so callers can
+    # apply it with where(mask, data, nan) instead of multiplying by a NaN mask.
 
     sst_mask_chk= 'SST' in l2_file
 
@@ -437,50 +563,29 @@ def mask_from_l2flags(l2_file, l2flag_names_to_check):
        print(' found within my_mapping_utilities...\n')
 
        qual_img= read_hdf_prod(l2_file, 'qual_sst')
-       mask_img= ones(qual_img.shape)                # make a 2D array of ones that has the same dimensions as qual_img
 
-
-       bad_data_locations= where((qual_img == -1) | (qual_img > 2))  # See: http://oceancolor.gsfc.nasa.gov/forum/oceancolor/topic_show.pl?dln=13190;pid=26263
-       mask_img[bad_data_locations[0],bad_data_locations[1]]=nan
+       # See: http://oceancolor.gsfc.nasa.gov/forum/oceancolor/topic_show.pl?dln=13190;pid=26263
+       mask_img= ~((qual_img == -1) | (qual_img > 2))
 
 
 
     if sst_mask_chk == False:
 
-        # Begin with an array mask_img of all ones and then whenever there is an
-        # occurance of a tripped flag in the l2flag_img, the mask_img at that location
-        # is set to zero.  In the end the mask has ones where no flag tripped and
-        # zeros where is tripped....
+        # All the flags to check are packed into one bitmask, so a single pass over
+        # l2_flags finds the pixels where none of them tripped...
 
         print('l2flag_names_to_check ----->  ', l2flag_names_to_check)
         print('\n')
 
         l2flag_img= read_hdf_prod(l2_file, 'l2_flags')
 
-        flags_to_check= l2flag_names_to_2lflag_number(l2_file, l2flag_names_to_check)
-
-        flags_to_check=sort(flags_to_check)
-
-        print('\n\nflags to check >>>>----->  ', flags_to_check, '\n\n')
+        flags_to_check= l2flag_bitmask(l2_file, l2flag_names_to_check)
 
-        x,y =       l2flag_img.shape
-        mask_img=   ones((x,y))
+        print('\n\nflags to check (bitmask) >>>>----->  ', hex(int(flags_to_check)), '\n\n')
 
-        full_flags=   arange(32,dtype=int32) + 1
-        deciml_flag=  [2]**(full_flags-1)
-
-
-        for i in range(len(flags_to_check)):
-
-            flags_on=    where(full_flags == flags_to_check[i])
-            dmflag=      deciml_flag[flags_on]
-            match_flag=  where((l2flag_img & dmflag[0]) == dmflag[0])
-
-            if len(l2flag_img[match_flag]) != 0:
-                mask_img[match_flag]= nan
-
-    return mask_img
+        mask_img= (asarray(l2flag_img).astype(uint32) & flags_to_check) == 0
 
+    return asarray(mask_img, dtype=bool)
 
 
 
@@ -810,7 +915,83 @@ def get_prod_min_max(fname, prod):
 
 
 
-def str_map_gen(l2_file_list, ofname, prod, proj_type, input_coords, space_res, named_flags_2check, stats_yesno):
+# Number of worker processes str_map_gen uses to map granules. Each worker maps a
+# contiguous chunk of the L2 file list and keeps its own running count/mean/M2 per
+# map pixel, and the per-worker results are merged at the end. 1 maps serially.
+STR_MAP_WORKERS = os.cpu_count()
+
+
+def str_map_stats_init(shape):
+#-------------------------------------------------------------------------------
+
+    # running statistics of every map pixel: number of observations, mean and M2
+    # (sum of squared differences from the mean), so variance = M2/nobs
+    return zeros(shape, dtype=float), zeros(shape, dtype=float), zeros(shape, dtype=float)
+
+
+def str_map_stats_merge(stats_a, stats_b):
+#-------------------------------------------------------------------------------
+
+    # Chan et al. pairwise merge of two sets of running statistics. Unlike
+    # sumxx/nobs - avg**2 it never subtracts two large nearly equal numbers, so the
+    # variance can't go negative through cancellation. Adding a single mapped granule
+    # (nobs 0 or 1 per pixel, M2 = 0) is the Welford update.
+    # ---
+    nobs_a, mean_a, m2_a = stats_a
+    nobs_b, mean_b, m2_b = stats_b
+
+    nobs = nobs_a + nobs_b
+    safe_nobs = where(nobs > 0, nobs, 1.0)
+    delta = mean_b - mean_a
+    mean = mean_a + delta*(nobs_b/safe_nobs)
+    m2 = m2_a + m2_b + delta**2.0*(nobs_a*nobs_b/safe_nobs)
+
+    return nobs, mean, m2
+
+
+def str_map_granule(ifile, prod, named_flags_2check, swath_resolution, input_coords, plan_dir=None):
+#-------------------------------------------------------------------------------
+
+    # read, scale, flag-mask and map a single l2 granule to the output map grid
+    swath_data=    read_hdf_prod(ifile, prod)
+    slope_intercept= get_l2hdf_slope_intercept(ifile, prod)
+
+
+    print('\n>>>>---  str map slope_intercept -----> ', slope_intercept)
+
+    swath_data= swath_data*slope_intercept[0] + slope_intercept[1]  # if no scaling found, assumed: slope=1, interecept=0.
+
+    swath_qcmask=  mask_from_l2flags(ifile, named_flags_2check)
+    swath_data=    where(swath_qcmask, swath_data, nan)             # mask is True for valid and False where not valid...
+
+    swath_lon=  read_hdf_prod(ifile,"longitude")
+    swath_lat=  read_hdf_prod(ifile,"latitude")
+
+    print('\n\n: input_coords', input_coords, '\n\n')
+    return map_l2_to_cyl(swath_lon, swath_lat, swath_data, swath_resolution, input_coords, plan_dir)
+
+
+def str_map_accumulate(l2_file_list, shape, prod, named_flags_2check, swath_resolution, input_coords, plan_dir=None):
+#-------------------------------------------------------------------------------
+
+    # running statistics of a chunk of granules (runs in a worker process)
+    stats= str_map_stats_init(shape)
+
+    for ifile in l2_file_list:
+
+        mapped_data= str_map_granule(ifile, prod, named_flags_2check, swath_resolution, input_coords, plan_dir)
+
+        valid= ~isnan(mapped_data)
+        granule_stats= (valid.astype(float), where(valid, mapped_data, 0.0), zeros(shape, dtype=float))
+        stats= str_map_stats_merge(stats, granule_stats)
+
+    return stats
+
+
+def str_map_gen(l2_file_list, ofname, prod, proj_type, input_coords, space_res, named_flags_2check, stats_yesno, max_workers=STR_MAP_WORKERS, plan_dir=None):
+
+      # plan_dir: optional directory of saved resampling plans, so mapping another
+      # product from the same granules skips the neighbour search
 
 
       north= float(input_coords.north)
@@ -839,36 +1020,30 @@ def str_map_gen(l2_file_list, ofname, prod, proj_type, input_coords, space_res,
       else: xdim= int(math.ceil(abs(west-east)*pix_per_deg*lon_scale_fac))
 
 
-      sumx=  zeros((ydim,xdim), dtype=float)
-      sumxx= zeros((ydim,xdim), dtype=float)
-      nobs=  zeros((ydim,xdim), dtype=float)
-
-
-      for ifile in l2_file_list:
-
-          swath_data=    read_hdf_prod(ifile, prod)
-          slope_intercept= get_l2hdf_slope_intercept(ifile, prod)
-
-
-          print('\n>>>>---  str map slope_intercept -----> ', slope_intercept)
-
-          swath_data= swath_data*slope_intercept[0] + slope_intercept[1]  # if no scaling found, assumed: slope=1, interecept=0.
+      # split the granules into one contiguous chunk per worker, map the chunks in
+      # parallel and merge the per-chunk statistics...
+      # ---
+      if max_workers is None or max_workers < 1: max_workers = 1
+      n_chunks= min(max_workers, len(l2_file_list))
+      chunk_size= int(math.ceil(len(l2_file_list)/float(n_chunks)))
+      chunks= [l2_file_list[i:i+chunk_size] for i in range(0, len(l2_file_list), chunk_size)]
 
-          swath_qcmask=  mask_from_l2flags(ifile, named_flags_2check)
-          swath_data=    swath_qcmask*swath_data                          # mask has 1's for valid and NaNs where not valid...
+      chunk_args= [(chunk, (ydim,xdim), prod, named_flags_2check, swath_resolution, input_coords, plan_dir) for chunk in chunks]
 
-          swath_lon=  read_hdf_prod(ifile,"longitude")
-          swath_lat=  read_hdf_prod(ifile,"latitude")
+      if len(chunks) == 1:
+          chunk_stats= [str_map_accumulate(*chunk_args[0])]
+      else:
+          with ProcessPoolExecutor(max_workers=len(chunks)) as executor:
+              chunk_stats= list(executor.map(str_map_accumulate, *zip(*chunk_args)))
 
-          print('\n\n: input_coords', input_coords, '\n\n')
-          mapped_data= map_l2_to_cyl(swath_lon, swath_lat, swath_data, swath_resolution, input_coords)
+      stats= chunk_stats[0]
+      for partial_stats in chunk_stats[1:]:
+          stats= str_map_stats_merge(stats, partial_stats)
 
-          sumx  += nan_to_num(mapped_data)
-          sumxx += nan_to_num(mapped_data)**2.0
-          nobs  += (~isnan(mapped_data)).astype(int)
+      nobs, mean, m2 = stats
 
-      data_avg= sumx/nobs
-      data_var= sumxx/nobs - data_avg**2.0
+      data_avg= where(nobs > 0, mean, nan)
+      data_var= where(nobs > 0, m2/where(nobs > 0, nobs, 1.0), nan)
 
       if len(l2_file_list) == 1: stats_yesno = 'no'  #if only a single file (i.e., DLY), then force stats to "no"
 
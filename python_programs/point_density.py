@@ -0,0 +1,136 @@
+import numpy as np
+from scipy.stats import gaussian_kde
+from scipy.signal import fftconvolve
+from scipy.ndimage import map_coordinates
+from scipy.spatial import cKDTree
+
+# Density of every point of a scatter plot, used to color the satsitu matchup plots.
+#
+#   'exact'  gaussian_kde(xy)(xy): O(N^2), for small matchups
+#   'fft'    the same Gaussian KDE (gaussian_kde's Scott bandwidth and full covariance). The grid
+#            spans the bulk of the points (ROBUST_QUANTILE to 1 - ROBUST_QUANTILE on each axis,
+#            plus one kernel width) with GRID_POINTS_PER_SIGMA nodes per kernel standard deviation
+#            (conditional on the other axis, so correlated matchups keep the kernel resolved);
+#            points on it are linearly binned, the kernel is applied by FFT convolution and the
+#            density is read back by bilinear interpolation. Points off the grid (outliers, the
+#            long tail of a lognormal matchup) and their contributions to points on it are summed
+#            exactly over neighbours within KERNEL_SIGMAS, so tails never coarsen the grid.
+#            Falls back to 'exact' (or 'hist' beyond EXACT_MAX_POINTS) when the grid would need
+#            more than MAX_GRID_SIZE nodes on an axis.
+#   'hist'   a HIST_BINS^2 2D histogram read back by bilinear interpolation of the bin densities;
+#            O(N), a coarser picture for very large matchups
+#   'auto'   'exact' up to EXACT_MAX_POINTS points, 'fft' up to FFT_MAX_POINTS, 'hist' beyond
+#
+# All methods return a probability density (the same units as gaussian_kde).
+
+DENSITY_METHODS = ['auto', 'exact', 'fft', 'hist']
+EXACT_MAX_POINTS = 2000
+FFT_MAX_POINTS = 1000000
+GRID_POINTS_PER_SIGMA = 6
+MAX_GRID_SIZE = 2048
+ROBUST_QUANTILE = 0.005
+HIST_BINS = 64
+KERNEL_SIGMAS = 4  # kernel truncated this many standard deviations from its centre
+
+def density_method(n_points, method='auto'):
+    if method != 'auto':
+        return method
+    if n_points <= EXACT_MAX_POINTS:
+        return 'exact'
+    if n_points <= FFT_MAX_POINTS:
+        return 'fft'
+    return 'hist'
+
+def _grid_coordinates(values, size):
+    # fractional index of every value on `size` nodes spanning the values; None when they do not spread
+    low, high = values.min(), values.max()
+    if not high > low:
+        return None, None
+    step = (high - low) / (size - 1)
+    return (values - low) / step, step
+
+def _linear_binning(gx, gy, size_x, size_y):
+    # every point shares its unit weight between the four surrounding grid nodes
+    ix = np.minimum(np.floor(gx).astype(int), size_x - 2)
+    iy = np.minimum(np.floor(gy).astype(int), size_y - 2)
+    fx = gx - ix
+    fy = gy - iy
+    grid = np.zeros(size_x * size_y)
+    for dx, dy, weight in [(0, 0, (1 - fx) * (1 - fy)), (1, 0, fx * (1 - fy)), (0, 1, (1 - fx) * fy), (1, 1, fx * fy)]:
+        grid += np.bincount((ix + dx) * size_y + (iy + dy), weights=weight, minlength=size_x * size_y)
+    return grid.reshape(size_x, size_y)
+
+def _gaussian_kernel(covariance, step_x, step_y):
+    # kernel pdf on grid offsets, truncated at KERNEL_SIGMAS along each axis
+    half_x = int(np.ceil(KERNEL_SIGMAS * np.sqrt(covariance[0, 0]) / step_x))
+    half_y = int(np.ceil(KERNEL_SIGMAS * np.sqrt(covariance[1, 1]) / step_y))
+    offset_x, offset_y = np.meshgrid(np.arange(-half_x, half_x + 1) * step_x,
+                                     np.arange(-half_y, half_y + 1) * step_y, indexing='ij')
+    offsets = np.stack([offset_x, offset_y], axis=-1)
+    inverse = np.linalg.inv(covariance)
+    exponent = np.einsum('...i,ij,...j->...', offsets, inverse, offsets)
+    return np.exp(-0.5 * exponent) / (2 * np.pi * np.sqrt(np.linalg.det(covariance)))
+
+def _kernel_sums(sources, targets, covariance):
+    # sum over sources of the kernel pdf at every target, from source/target pairs within KERNEL_SIGMAS
+    sums = np.zeros(len(targets))
+    if len(sources) == 0 or len(targets) == 0:
+        return sums
+    whiten = np.linalg.cholesky(np.linalg.inv(covariance))  # Mahalanobis distance -> Euclidean
+    pairs = cKDTree(targets @ whiten).sparse_distance_matrix(cKDTree(sources @ whiten), KERNEL_SIGMAS, output_type='ndarray')
+    np.add.at(sums, pairs['i'], np.exp(-0.5 * pairs['v'] ** 2))
+    return sums / (2 * np.pi * np.sqrt(np.linalg.det(covariance)))
+
+def fft_kde_density(x, y):
+    points = np.column_stack([x, y])
+    covariance = gaussian_kde(points.T).covariance
+    sigma = np.sqrt(np.diag(covariance))
+    # node spacing from the kernel's width along each axis at fixed other coordinate, which for
+    # strongly correlated matchups is much narrower than its marginal width
+    steps = 1 / np.sqrt(np.diag(np.linalg.inv(covariance))) / GRID_POINTS_PER_SIGMA
+    low = np.quantile(points, ROBUST_QUANTILE, axis=0) - sigma
+    high = np.quantile(points, 1 - ROBUST_QUANTILE, axis=0) + sigma
+    sizes = np.floor((high - low) / steps).astype(int) + 2
+    if not np.all(np.isfinite(steps) & (steps > 0)) or np.any(sizes > MAX_GRID_SIZE):
+        # a grid fine enough for the kernel would be too large
+        return exact_kde_density(x, y) if len(x) <= EXACT_MAX_POINTS else hist_density(x, y)
+
+    grid_coordinates = (points - low) / steps
+    on_grid = np.all((grid_coordinates >= 0) & (grid_coordinates <= sizes - 1), axis=1)
+    gx, gy = grid_coordinates[on_grid].T
+
+    counts = _linear_binning(gx, gy, sizes[0], sizes[1])
+    grid_density = fftconvolve(counts, _gaussian_kernel(covariance, steps[0], steps[1]), mode='same')
+    np.maximum(grid_density, 0, out=grid_density)  # FFT round-off around empty regions
+
+    density = np.empty(len(points))
+    off_grid_points = points[~on_grid]
+    density[on_grid] = map_coordinates(grid_density, [gx, gy], order=1) + _kernel_sums(off_grid_points, points[on_grid], covariance)
+    density[~on_grid] = _kernel_sums(points, off_grid_points, covariance)
+    return density / len(points)
+
+def hist_density(x, y, bins=HIST_BINS):
+    gx, step_x = _grid_coordinates(x, bins + 1)
+    gy, step_y = _grid_coordinates(y, bins + 1)
+    if gx is None or gy is None:
+        return exact_kde_density(x, y)
+    counts, _, _ = np.histogram2d(x, y, bins=bins)
+    density = counts / (len(x) * step_x * step_y)
+    # bin densities sit at bin centres, half a bin in from the bin edges the points were counted against
+    return map_coordinates(density, [gx - 0.5, gy - 0.5], order=1, mode='nearest')
+
+def exact_kde_density(x, y):
+    xy = np.vstack([x, y])
+    return gaussian_kde(xy)(xy)
+
+def point_density(x, y, method='auto'):
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    method = density_method(len(x), method)
+    if method == 'exact':
+        return exact_kde_density(x, y)
+    if method == 'fft':
+        return fft_kde_density(x, y)
+    if method == 'hist':
+        return hist_density(x, y)
+    raise ValueError(f"Unknown density method '{method}', expected one of {DENSITY_METHODS}")
@@ -1,8 +1,13 @@
 import os
+import json
+import hashlib
+import numpy as np
 import pandas as pd
 import logging
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 import csv
+from dataset_io import write_dataset, csv_enabled
+from section_geometry import add_section_geometry
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -12,8 +17,14 @@ UNPROCESSED_ACROBAT_DIR = os.path.join(DATA_DIR, 'acrobat', 'transects', 'unproc
 SAVE_DIR = os.path.join(DATA_DIR, 'acrobat', 'transects', 'processed')
 QC_REPORT = os.path.join(SAVE_DIR, 'QC_report.txt')
 OUTPUT_DATASET_FILE = os.path.join(SAVE_DIR, 'processed_dataset.csv')
-for directory in [DATA_DIR, SAVE_DIR]:
+# Per-transect QC results are cached so a rerun only QCs new or changed files (see load_qc_cache)
+QC_CACHE_DIR = os.path.join(SAVE_DIR, 'qc_cache')
+QC_CACHE_MANIFEST = os.path.join(SAVE_DIR, 'qc_cache_manifest.json')
+QC_CACHE_VERSION = 3  # bump when process_file output changes so cached results are redone
+QC_SWEEP_REPORT = os.path.join(SAVE_DIR, 'QC_threshold_sweep.csv')
+for directory in [DATA_DIR, SAVE_DIR, QC_CACHE_DIR]:
     os.makedirs(directory, exist_ok=True)
+MAX_WORKERS = os.cpu_count()
 
 QC_PARAMS = {
     'time_increment': pd.Timedelta(minutes=15),
@@ -26,27 +37,54 @@ QC_PARAMS = {
     'ox_sat_min': 7.36, 'ox_sat_max': 7.54, 'ox_sat_spike_threshold': 0.1
 }
 
+# Threshold sweep: with QC_SWEEP = True the script only counts, for every transect, how many points each
+# combination of min, max and spike threshold below would flag, and writes the table to QC_SWEEP_REPORT.
+# Variables or settings left out keep their QC_PARAMS value.
+QC_SWEEP = False
+QC_SWEEP_GRID = {
+    'temp': {'min': np.arange(19.0, 20.0, 0.1), 'max': np.arange(20.0, 21.0, 0.1), 'spike_threshold': np.arange(0.1, 1.01, 0.1)},
+    'salinity': {'min': np.arange(34.80, 34.95, 0.01), 'max': np.arange(35.00, 35.15, 0.01), 'spike_threshold': np.arange(0.01, 0.11, 0.01)},
+    'chlor_a': {'max': np.arange(1.0, 5.01, 0.2), 'spike_threshold': np.arange(0.25, 2.01, 0.25)},
+}
+
 def reverse_dataframe_rows(df):
     return df.iloc[::-1].reset_index(drop=True)
 
-def perform_qc_tests(df, qc_params):
+QC_DATA_TYPES = ['temp', 'conductivity', 'density', 'salinity', 'turbidity', 'chlor_a', 'ox_sat']
+QC_CHUNK_ROWS = 100_000  # rows per chunk in stream_qc_file
+
+def perform_qc_tests(df, qc_params, state=None):
+    # state carries the last raw row of the previous chunk (its timestamp and QC column values) so the
+    # gap and spike tests see across chunk boundaries; pass the same dict for every chunk of a file
     qc_report = {'timing_gap_flags': 0, 'total_points_removed': 0}
-    flagged = pd.Series([False] * len(df))
+    flagged = pd.Series(False, index=df.index)
+    previous = dict(state) if state is not None else {}
+    if state is not None and len(df):
+        state.update({column: df[column].iloc[-1] for column in QC_DATA_TYPES if column in df.columns})
+
+    def diff(series, previous_value):
+        differences = series.diff()
+        if previous_value is not None and len(series):
+            differences.iloc[0] = series.iloc[0] - previous_value
+        return differences
+
     df['timestamp'] = pd.to_datetime(df['time'], unit='s')
-    timing_gap_flags = (df['timestamp'].diff().abs() > qc_params['time_increment']) | df['timestamp'].isnull()
+    if state is not None and len(df):
+        state['timestamp'] = df['timestamp'].iloc[-1]
+    timing_gap_flags = (diff(df['timestamp'], previous.get('timestamp')).abs() > qc_params['time_increment']) | df['timestamp'].isnull()
     flagged |= timing_gap_flags
 
     def qc_for_data_type(column, min_val, max_val, spike_threshold):
         if column not in df.columns:
-            return pd.Series([False] * len(df))
+            return pd.Series(False, index=df.index)
         range_flags = (df[column] < min_val) | (df[column] > max_val)
-        spike_flags = df[column].diff().abs() > spike_threshold
+        spike_flags = diff(df[column], previous.get(column)).abs() > spike_threshold
         df.loc[range_flags | spike_flags, column] = pd.NA
         qc_report[f'{column}_range_flags'] = range_flags.sum()
         qc_report[f'{column}_spike_flags'] = spike_flags.sum()
         return range_flags | spike_flags
 
-    for data_type in ['temp', 'conductivity', 'density', 'salinity', 'turbidity', 'chlor_a', 'ox_sat']:
+    for data_type in QC_DATA_TYPES:
         flagged |= qc_for_data_type(data_type, qc_params[f'{data_type}_min'], qc_params[f'{data_type}_max'], qc_params[f'{data_type}_spike_threshold'])
 
     qc_report['timing_gap_flags'] = timing_gap_flags.sum()
@@ -54,45 +92,187 @@ def perform_qc_tests(df, qc_params):
 
     return df, qc_report
 
+def _common_dtype(chunk_dtypes):
+    # dtype a single pd.read_csv of the whole file infers for a column, from the dtypes of its chunks:
+    # integers with a gap somewhere become float64, and a column with text anywhere is text throughout
+    if all(pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype) for dtype in chunk_dtypes):
+        return np.result_type(*chunk_dtypes)
+    if all(dtype == chunk_dtypes[0] for dtype in chunk_dtypes):
+        return chunk_dtypes[0]
+    return str
+
+def acrobat_dtypes(file_path, chunksize=QC_CHUNK_ROWS):
+    # Explicit dtypes for every column, inferred over the whole log (one chunk at a time), so each
+    # chunk parses exactly as the same rows would in a single whole-file read. This is an extra
+    # parse of the log, only worth it when the log does not fit in memory (stream_qc_file).
+    chunk_dtypes = {}
+    for chunk in pd.read_csv(file_path, chunksize=chunksize):
+        for column in chunk.columns:
+            chunk_dtypes.setdefault(column, []).append(chunk[column].dtype)
+    return {column: _common_dtype(dtypes) for column, dtypes in chunk_dtypes.items()}
+
+def read_acrobat_log(file_path):
+    return pd.read_csv(file_path)
+
+def qc_chunks(file_path, qc_params, qc_report, chunksize=QC_CHUNK_ROWS):
+    # Yield the QC'd chunks of a log in order, adding their flag counts to qc_report. Only one
+    # chunk is in memory at a time, and the results equal perform_qc_tests(read_acrobat_log(file_path)).
+    # The log is parsed twice (dtypes, then QC), so logs that fit in memory go through perform_qc_tests.
+    state = {}
+    for chunk in pd.read_csv(file_path, dtype=acrobat_dtypes(file_path, chunksize), chunksize=chunksize):
+        cleaned_chunk, chunk_report = perform_qc_tests(chunk, qc_params, state)
+        for test, count in chunk_report.items():
+            qc_report[test] = qc_report.get(test, 0) + count
+        yield cleaned_chunk
+
+def stream_qc_file(file_path, output_path, qc_params=QC_PARAMS, chunksize=QC_CHUNK_ROWS):
+    # QC a log of any length (e.g. a multi-day tow before it is split into transects) with flat
+    # memory, streaming the cleaned rows to output_path as CSV. Returns the QC report.
+    qc_report = {}
+    with open(output_path, 'w', newline='') as output_file:
+        for i, cleaned_chunk in enumerate(qc_chunks(file_path, qc_params, qc_report, chunksize)):
+            cleaned_chunk.to_csv(output_file, index=False, header=(i == 0))
+    return qc_report
+
 def process_file(file):
     try:
         file_path = os.path.join(UNPROCESSED_ACROBAT_DIR, file)
-        df = pd.read_csv(file_path)
-        cleaned_df, qc_report = perform_qc_tests(df, QC_PARAMS)
+        cleaned_df, qc_report = perform_qc_tests(read_acrobat_log(file_path), QC_PARAMS)
         transect_id_str = file.split('.')[0].replace('transect_', '')
         transect_id = int(transect_id_str)
         if transect_id % 2 != 0:
             cleaned_df = reverse_dataframe_rows(cleaned_df)
         cleaned_df['transect_id'] = transect_id
+        if 'lon' in cleaned_df.columns and 'lat' in cleaned_df.columns:
+            # distances along the track and from shore, in plotting order, for the section plots
+            cleaned_df = add_section_geometry(cleaned_df)
         return cleaned_df, qc_report, transect_id
     except Exception as e:
         logging.error(f"Error processing file {file}: {e}")
         return None, {}, None
 
-if not os.path.exists(UNPROCESSED_ACROBAT_DIR):
-    print(f"Data directory '{UNPROCESSED_ACROBAT_DIR}' does not exist.")
-else:
-    combined_data = pd.DataFrame()
-    qc_reports = {}
+def sweep_thresholds(values, mins, maxs, spike_thresholds):
+    # Flag counts of the range and spike tests for every (min, max, spike threshold) combination at once.
+    # Each test only needs the values and their |diff| sorted once; a count for a whole threshold axis is
+    # then one searchsorted. Returns (nmin, nmax, nspike) arrays of range, spike and union counts,
+    # matching perform_qc_tests (NaN values or diffs are never flagged by a test).
+    mins, maxs, spike_thresholds = (np.atleast_1d(np.asarray(a, dtype=float)) for a in (mins, maxs, spike_thresholds))
+    spikes = np.abs(np.diff(values, prepend=np.nan))
+    finite = np.isfinite(values)
+
+    sorted_values = np.sort(values[finite])
+    in_range = np.maximum(np.searchsorted(sorted_values, maxs, 'right')[None, :] - np.searchsorted(sorted_values, mins, 'left')[:, None], 0)
+    range_flags = sorted_values.size - in_range
+
+    sorted_spikes = np.sort(spikes[np.isfinite(spikes)])
+    spike_flags = sorted_spikes.size - np.searchsorted(sorted_spikes, spike_thresholds, 'right')
+
+    # Points passing both tests, per spike threshold: those without a spike above it, counted in range
+    unflagged = np.empty((mins.size, maxs.size, spike_thresholds.size), dtype=np.int64)
+    spike_order = np.argsort(np.where(np.isfinite(spikes), spikes, -np.inf), kind='stable')
+    ordered_spikes = np.where(np.isfinite(spikes), spikes, -np.inf)[spike_order]
+    for k, threshold in enumerate(spike_thresholds):
+        passing = spike_order[:np.searchsorted(ordered_spikes, threshold, 'right')]
+        passing_values = values[passing]
+        passing_finite = np.sort(passing_values[np.isfinite(passing_values)])
+        in_range_passing = np.maximum(np.searchsorted(passing_finite, maxs, 'right')[None, :] - np.searchsorted(passing_finite, mins, 'left')[:, None], 0)
+        unflagged[:, :, k] = in_range_passing + (passing_values.size - passing_finite.size)
+    points_flagged = values.size - unflagged
+
+    return (np.broadcast_to(range_flags[:, :, None], unflagged.shape), np.broadcast_to(spike_flags[None, None, :], unflagged.shape), points_flagged)
+
+def sweep_file(file, sweep_grid=QC_SWEEP_GRID, qc_params=QC_PARAMS):
+    # Threshold sweep table (one row per variable and setting) for one unprocessed transect
+    try:
+        df = read_acrobat_log(os.path.join(UNPROCESSED_ACROBAT_DIR, file))
+        transect_id = int(file.split('.')[0].replace('transect_', ''))
+    except Exception as e:
+        logging.error(f"Error sweeping file {file}: {e}")
+        return None
+
+    tables = []
+    for data_type, grid in sweep_grid.items():
+        if data_type not in df.columns:
+            continue
+        mins = grid.get('min', qc_params[f'{data_type}_min'])
+        maxs = grid.get('max', qc_params[f'{data_type}_max'])
+        spike_thresholds = grid.get('spike_threshold', qc_params[f'{data_type}_spike_threshold'])
+        range_flags, spike_flags, points_flagged = sweep_thresholds(df[data_type].to_numpy(dtype=float), mins, maxs, spike_thresholds)
+        min_grid, max_grid, spike_grid = np.meshgrid(np.atleast_1d(mins), np.atleast_1d(maxs), np.atleast_1d(spike_thresholds), indexing='ij')
+        tables.append(pd.DataFrame({'transect_id': transect_id, 'variable': data_type,
+                                    'min': min_grid.ravel(), 'max': max_grid.ravel(), 'spike_threshold': spike_grid.ravel(),
+                                    'range_flags': range_flags.ravel(), 'spike_flags': spike_flags.ravel(),
+                                    'points_flagged': points_flagged.ravel(), 'points': len(df)}))
+    return pd.concat(tables, ignore_index=True) if tables else None
+
+def sweep_main():
+    if not os.path.exists(UNPROCESSED_ACROBAT_DIR):
+        print(f"Data directory '{UNPROCESSED_ACROBAT_DIR}' does not exist.")
+        return None
+
     valid_files = [file for file in os.listdir(UNPROCESSED_ACROBAT_DIR) if file.endswith('.csv') and not file.startswith('~$')]
     sorted_files = sorted(valid_files, key=lambda x: int(x.replace('transect_', '').split('.')[0]))
+    with ProcessPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        tables = [table for table in executor.map(sweep_file, sorted_files) if table is not None]
+    if not tables:
+        print("No transects to sweep.")
+        return None
 
-    with ThreadPoolExecutor() as executor:
-        futures = {executor.submit(process_file, file): file for file in sorted_files}
-        for future in futures:
-            result, qc_report, transect_id = future.result()
-            qc_reports[transect_id] = qc_report
-            if result is not None:
-                combined_data = pd.concat([combined_data, result], ignore_index=True)
+    sweep = pd.concat(tables, ignore_index=True)
+    sweep.to_csv(QC_SWEEP_REPORT, index=False)
+    print(f'QC threshold sweep ({len(sweep)} rows) saved to {QC_SWEEP_REPORT}')
+    return sweep
 
-    combined_data.to_csv(OUTPUT_DATASET_FILE, index=False)
-    print(f'Entire processed dataset saved to {OUTPUT_DATASET_FILE}')
+def qc_params_hash(qc_params):
+    settings = {'version': QC_CACHE_VERSION, 'qc_params': {key: str(value) for key, value in qc_params.items()}}
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()
 
-    for transect_id, data in combined_data.groupby('transect_id'):
-        output_file_path = os.path.join(SAVE_DIR, f'transect_{transect_id}.csv')
-        data.to_csv(output_file_path, index=False)
-        print(f'Processed DataFrame for Transect {transect_id} saved to {output_file_path}')
+def file_sha256(file_path, cached_entry=None):
+    # Content hash of an input file; reused from the manifest entry while its size and mtime are unchanged
+    stat = os.stat(file_path)
+    if cached_entry and cached_entry.get('size') == stat.st_size and cached_entry.get('mtime') == stat.st_mtime:
+        return cached_entry['sha256']
+    sha = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(block)
+    return sha.hexdigest()
 
+def load_qc_cache():
+    # {input file name: {'sha256', 'size', 'mtime', 'qc_params_hash', 'transect_id', 'qc_report', 'cache_file'}}
+    if not os.path.exists(QC_CACHE_MANIFEST):
+        return {}
+    try:
+        with open(QC_CACHE_MANIFEST) as f:
+            return json.load(f)['files']
+    except (ValueError, KeyError) as e:
+        logging.warning(f"Ignoring unreadable QC cache manifest {QC_CACHE_MANIFEST}: {e}")
+        return {}
+
+def save_qc_cache(entries):
+    # write-then-rename so an interrupted run never leaves a half-written manifest
+    tmp_path = QC_CACHE_MANIFEST + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'files': entries}, f, indent=1)
+    os.replace(tmp_path, QC_CACHE_MANIFEST)
+
+def cache_entry(file, sha256, params_hash, transect_id, qc_report):
+    stat = os.stat(os.path.join(UNPROCESSED_ACROBAT_DIR, file))
+    return {'sha256': sha256, 'size': stat.st_size, 'mtime': stat.st_mtime, 'qc_params_hash': params_hash,
+            'transect_id': transect_id, 'qc_report': {test: int(count) for test, count in qc_report.items()},
+            'cache_file': f'transect_{transect_id}.pkl'}
+
+def is_cached(entry, sha256, params_hash):
+    return (entry is not None and entry['sha256'] == sha256 and entry['qc_params_hash'] == params_hash
+            and os.path.exists(os.path.join(QC_CACHE_DIR, entry['cache_file'])))
+
+def save_transect(cleaned_df):
+    transect_id = cleaned_df['transect_id'].iloc[0]
+    output_file_path = os.path.join(SAVE_DIR, f'transect_{transect_id}.csv')
+    cleaned_df.to_csv(output_file_path, index=False)
+    print(f'Processed DataFrame for Transect {transect_id} saved to {output_file_path}')
+
+def write_qc_report(qc_reports):
     try:
         with open(QC_REPORT, 'w') as report_file:
             for transect_id, report in qc_reports.items():
@@ -102,8 +282,80 @@ else:
     except IsADirectoryError:
         print(f"Error: {QC_REPORT} is a directory, not a file.")
 
-print("\nQC Test Reports for Each Transect:")
-for transect_id, report in qc_reports.items():
-    print(f"\nTransect ID: {transect_id}")
-    for test, count in report.items():
-        print(f"{test}: {count}")
+def main():
+    qc_reports = {}
+    if not os.path.exists(UNPROCESSED_ACROBAT_DIR):
+        print(f"Data directory '{UNPROCESSED_ACROBAT_DIR}' does not exist.")
+        return qc_reports
+
+    valid_files = [file for file in os.listdir(UNPROCESSED_ACROBAT_DIR) if file.endswith('.csv') and not file.startswith('~$')]
+    sorted_files = sorted(valid_files, key=lambda x: int(x.replace('transect_', '').split('.')[0]))
+
+    cache = load_qc_cache()
+    params_hash = qc_params_hash(QC_PARAMS)
+    hashes = {file: file_sha256(os.path.join(UNPROCESSED_ACROBAT_DIR, file), cache.get(file)) for file in sorted_files}
+    stale_files = [file for file in sorted_files if not is_cached(cache.get(file), hashes[file], params_hash)]
+    print(f"{len(sorted_files) - len(stale_files)} transect(s) unchanged since the last run, {len(stale_files)} to QC.")
+
+    # QC is CPU-bound pandas work, so each file gets its own process; map returns them in transect order
+    fresh = {}
+    if stale_files:
+        with ProcessPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            for file, (result, qc_report, transect_id) in zip(stale_files, executor.map(process_file, stale_files)):
+                fresh[file] = (result, qc_report, transect_id)
+
+    entries = {}
+    results = []
+    qcd_transects = set()
+    for file in sorted_files:
+        if file in fresh:
+            result, qc_report, transect_id = fresh[file]
+            if result is not None:
+                result.to_pickle(os.path.join(QC_CACHE_DIR, f'transect_{transect_id}.pkl'))
+                entries[file] = cache_entry(file, hashes[file], params_hash, transect_id, qc_report)
+                qcd_transects.add(transect_id)
+        else:
+            entries[file] = cache[file]
+            result = pd.read_pickle(os.path.join(QC_CACHE_DIR, cache[file]['cache_file']))
+            qc_report, transect_id = cache[file]['qc_report'], cache[file]['transect_id']
+        qc_reports[transect_id] = qc_report
+        if result is not None:
+            results.append(result)
+
+    # Cached results of inputs that were removed or replaced are dropped with their manifest entries
+    kept_files = {entry['cache_file'] for entry in entries.values()}
+    for cache_file in os.listdir(QC_CACHE_DIR):
+        if cache_file not in kept_files:
+            os.remove(os.path.join(QC_CACHE_DIR, cache_file))
+    save_qc_cache(entries)
+
+    combined_data = pd.concat(results, ignore_index=True) if results else pd.DataFrame()
+
+    # The combined dataset and the per-transect CSVs are written side by side straight from the
+    # per-file results. The Parquet dataset is partitioned by transect_id, so per-transect CSVs are
+    # only an export, and only rewritten for transects that were QC'd again or are missing.
+    transect_exports = []
+    if csv_enabled():
+        transect_exports = [result for result in results if result['transect_id'].iloc[0] in qcd_transects
+                            or not os.path.exists(os.path.join(SAVE_DIR, f"transect_{result['transect_id'].iloc[0]}.csv"))]
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        dataset_write = executor.submit(write_dataset, combined_data, OUTPUT_DATASET_FILE)
+        transect_writes = [executor.submit(save_transect, result) for result in transect_exports]
+        for transect_write in transect_writes:
+            transect_write.result()
+        for saved_path in dataset_write.result():
+            print(f'Entire processed dataset saved to {saved_path}')
+
+    write_qc_report(qc_reports)
+    return qc_reports
+
+if __name__ == '__main__' and QC_SWEEP:
+    sweep_main()
+elif __name__ == '__main__':
+    qc_reports = main()
+
+    print("\nQC Test Reports for Each Transect:")
+    for transect_id, report in qc_reports.items():
+        print(f"\nTransect ID: {transect_id}")
+        for test, count in report.items():
+            print(f"{test}: {count}")
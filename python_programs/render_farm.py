@@ -0,0 +1,185 @@
+import os
+import sys
+import json
+import hashlib
+import inspect
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+# Parallel, incremental figure rendering for the plotting scripts (2D_contour, 3D_contour,
+# transect_analysis, satsitu_matchup_histogram, sat_mosaic). A script describes every figure as a
+# job: a module-level render function, the slice of data it draws, a JSON-able plot spec and the
+# output path. render_figures renders the jobs in a process pool on the Agg backend, each worker
+# starting from the script's rcParams, and skips jobs whose data hash, spec and code are unchanged
+# since the output was last written and whose outputs all still exist. The code is the source of
+# the render function's whole module (its helpers, colormaps, font sizes, ...) and of the modules
+# next to it that the module imports from (point_density, section_geometry, ...). The hashes are
+# kept next to the figures in RENDER_MANIFEST_NAME, one per output directory.
+#
+#   jobs = [figure_job(render_boxplot, data[['transect_id', 'temp']], {'variable': 'temp'}, 'temp.png')]
+#   render_figures(jobs, rc={'font.size': 28})
+#
+# render(data, spec, output) draws one figure and saves it to output. Workers are forked where the
+# platform allows it, so scripts without a __main__ guard are not re-run in every worker.
+
+RENDER_WORKERS = os.cpu_count()
+RENDER_MANIFEST_NAME = '.render_manifest.json'
+RENDER_VERSION = 1  # bump to re-render every figure
+
+def figure_job(render, data, spec, output, input_files=(), extra_outputs=()):
+    # input_files: files the render function reads itself (satellite images, ...), hashed by content
+    # extra_outputs: files the render function writes besides output (animation frames, ...)
+    return {'render': render, 'data': data, 'spec': spec, 'output': output, 'input_files': list(input_files),
+            'extra_outputs': list(extra_outputs)}
+
+def _update_hash(sha, data):
+    if isinstance(data, pd.DataFrame):
+        sha.update(json.dumps([str(column) for column in data.columns]).encode())
+        sha.update(json.dumps([str(dtype) for dtype in data.dtypes]).encode())
+        sha.update(pd.util.hash_pandas_object(data, index=True).to_numpy().tobytes())
+    elif isinstance(data, pd.Series):
+        sha.update(f'{data.name}|{data.dtype}'.encode())
+        sha.update(pd.util.hash_pandas_object(data, index=True).to_numpy().tobytes())
+    elif isinstance(data, np.ndarray):
+        sha.update(f'{data.dtype}|{data.shape}'.encode())
+        sha.update(np.ascontiguousarray(data).tobytes())
+    elif isinstance(data, dict):
+        for key in sorted(data, key=str):
+            sha.update(f'<{key}>'.encode())
+            _update_hash(sha, data[key])
+    elif isinstance(data, (list, tuple)):
+        sha.update(f'[{len(data)}]'.encode())
+        for item in data:
+            _update_hash(sha, item)
+    else:
+        sha.update(repr(data).encode())
+
+def _source(obj):
+    try:
+        return inspect.getsource(obj)
+    except (OSError, TypeError):
+        return getattr(obj, '__qualname__', getattr(obj, '__name__', ''))
+
+def _local_modules(module):
+    # Modules in the script's directory that the module imported, or imported names from
+    module_dir = os.path.dirname(os.path.abspath(getattr(module, '__file__', '') or ''))
+    local = {}
+    for value in vars(module).values():
+        source_module = value if inspect.ismodule(value) else sys.modules.get(getattr(value, '__module__', None) or '')
+        source_file = getattr(source_module, '__file__', None)
+        if source_module is None or source_module in (module, sys.modules[__name__]) or not source_file:
+            continue
+        if os.path.dirname(os.path.abspath(source_file)) == module_dir:
+            local[source_module.__name__] = source_module
+    return [local[name] for name in sorted(local)]
+
+def _render_source(render):
+    # Editing the render function's module, or a local module it uses, re-renders its figures
+    module = sys.modules.get(render.__module__)
+    if module is None:
+        return _source(render)
+    return ''.join(_source(m) for m in [module] + _local_modules(module))
+
+def job_hash(job):
+    sha = hashlib.sha256(f'{RENDER_VERSION}|{job["render"].__module__}.{job["render"].__qualname__}'.encode())
+    sha.update(_render_source(job['render']).encode())
+    sha.update(json.dumps(job['spec'], sort_keys=True, default=str).encode())
+    _update_hash(sha, job['data'])
+    for file_path in job['input_files']:
+        sha.update(os.path.basename(file_path).encode())
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                sha.update(chunk)
+    return sha.hexdigest()
+
+def _manifest_path(output):
+    return os.path.join(os.path.dirname(os.path.abspath(output)), RENDER_MANIFEST_NAME)
+
+def load_render_manifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        return {}
+    try:
+        with open(manifest_path) as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable render manifest {manifest_path}: {e}")
+        return {}
+
+def save_render_manifest(manifest_path, manifest):
+    # write-then-rename so an interrupted run never leaves a half-written manifest
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+def _init_worker(rc):
+    import matplotlib
+    matplotlib.use('Agg', force=True)
+    import matplotlib.pyplot as plt
+    plt.close('all')
+    if rc:
+        plt.rcParams.update(rc)
+
+def _render_job(job):
+    try:
+        job['render'](job['data'], job['spec'], job['output'])
+        return job['output'], None
+    except Exception as e:
+        return job['output'], f"{type(e).__name__}: {e}"
+
+def _render_worker_job(job):
+    # A figure a failed job left open must not leak into the worker's next job
+    import matplotlib.pyplot as plt
+    result = _render_job(job)
+    plt.close('all')
+    return result
+
+def _pool_context():
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    return None
+
+def render_figures(jobs, rc=None, max_workers=RENDER_WORKERS, force=False):
+    # Renders the jobs whose output is missing or out of date; returns {output: 'rendered' | 'skipped' | 'failed'}
+    status = {}
+    manifests = {}
+    pending = []
+    for job in jobs:
+        manifest_path = _manifest_path(job['output'])
+        if manifest_path not in manifests:
+            manifests[manifest_path] = load_render_manifest(manifest_path)
+        key = os.path.basename(job['output'])
+        job_digest = job_hash(job)
+        outputs_exist = all(os.path.exists(path) for path in [job['output']] + job['extra_outputs'])
+        if not force and outputs_exist and manifests[manifest_path].get(key) == job_digest:
+            status[job['output']] = 'skipped'
+            continue
+        os.makedirs(os.path.dirname(os.path.abspath(job['output'])), exist_ok=True)
+        pending.append((job, manifest_path, key, job_digest))
+
+    print(f"Rendering {len(pending)} figures ({len(jobs) - len(pending)} unchanged)...")
+    if len(pending) <= 1 or max_workers == 1:
+        # Not worth a pool; render here with the same rcParams (savefig draws on an Agg canvas anyway)
+        import matplotlib.pyplot as plt
+        with plt.rc_context(rc):
+            results = [_render_job(job) for job, _, _, _ in pending]
+    else:
+        with ProcessPoolExecutor(max_workers=min(max_workers, len(pending)), mp_context=_pool_context(),
+                                 initializer=_init_worker, initargs=(rc,)) as executor:
+            results = list(executor.map(_render_worker_job, [job for job, _, _, _ in pending]))
+
+    for (job, manifest_path, key, job_digest), (output, error) in zip(pending, results):
+        if error is None:
+            manifests[manifest_path][key] = job_digest
+            status[output] = 'rendered'
+        else:
+            manifests[manifest_path].pop(key, None)
+            status[output] = 'failed'
+            print(f"Error rendering {output}: {error}")
+
+    for manifest_path, manifest in manifests.items():
+        if os.path.isdir(os.path.dirname(manifest_path)):
+            save_render_manifest(manifest_path, manifest)
+    return status
@@ -1,12 +1,17 @@
+import os
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 from sklearn.linear_model import LinearRegression
 from sklearn.metrics import r2_score
+from dataset_io import read_dataset
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(SCRIPT_DIR, '..', '..', 'data')
 
 # Load the merged dataset
-data_path = '/Users/mitchtork/Thesis/data/satsitu/satsitu_l2_rrs.csv'
-data = pd.read_csv(data_path)
+data_path = os.path.join(DATA_DIR, 'satsitu', 'satsitu_l2_rrs.csv')
+data = read_dataset(data_path)
 
 # Function to calculate MBR using OC4
 def calculate_oc4_mbr(row, rrs_bands, rrs_green):
@@ -5,6 +5,7 @@ import matplotlib.pyplot as plt
 from netCDF4 import Dataset
 from scipy.optimize import curve_fit
 from scipy.interpolate import griddata
+from dataset_io import read_dataset
 
 # Define directories
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -57,7 +58,7 @@ s3b_files = {
 
 # Load in-situ chlorophyll data using a relative path
 print(f"Loading in-situ chlorophyll data from {INSITU_DIR}...")
-df = pd.read_csv(INSITU_DIR)
+df = read_dataset(INSITU_DIR)
 print("Data loaded successfully.")
 
 # Define sensor datetime and other parameters
@@ -5,6 +5,7 @@ import matplotlib.pyplot as plt
 from netCDF4 import Dataset
 from scipy.optimize import curve_fit
 from scipy.interpolate import griddata
+from dataset_io import read_dataset
 
 # Define directories
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -38,7 +39,7 @@ s3b_file = os.path.join(SAT_DIR, 's3b', 'l2', 'S3B_OLCI_EFRNT.20230507T145511.L2
 
 # Load in-situ chlorophyll data using a relative path
 print(f"Loading in-situ chlorophyll data from {INSITU_DIR}...")
-df = pd.read_csv(INSITU_DIR)
+df = read_dataset(INSITU_DIR)
 print("Data loaded successfully.")
 
 print(df.columns)
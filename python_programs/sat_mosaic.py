@@ -10,6 +10,8 @@ from matplotlib.lines import Line2D
 import seaborn as sns
 import cartopy.mpl.ticker as cticker
 import matplotlib.ticker as mticker
+from dataset_io import read_transect, transect_ids
+from render_farm import figure_job, render_figures
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.path.join(SCRIPT_DIR, '..', '..', 'data')
@@ -18,7 +20,7 @@ SATELLITE_IMAGES_DIR = os.path.join(DATA_DIR, 'satellite', 'crops', 'single', 'c
 SAVE_DIR = os.path.join(SCRIPT_DIR, '..', 'visualization', 'maps')
 os.makedirs(SAVE_DIR, exist_ok=True)
 
-TRANSECTS = [os.path.join(ACROBAT_DIR, file) for file in os.listdir(ACROBAT_DIR) if file.startswith('transect_') and file.endswith('.csv')]
+TRANSECTS = [os.path.join(ACROBAT_DIR, f'transect_{i}.csv') for i in transect_ids(os.path.join(ACROBAT_DIR, 'processed_dataset.csv'))]
 SATELLITE_IMGS = [file for file in os.listdir(SATELLITE_IMAGES_DIR) if file.endswith('.png')]
 
 TITLE_FONT_SIZE = 32
@@ -41,7 +43,7 @@ def meters_to_degrees(meters, latitude):
 
 def load_transect_data(files):
     try:
-        dfs = [pd.read_csv(file).apply(pd.to_numeric, errors='coerce').dropna(subset=['lon', 'lat']) for file in files]
+        dfs = [read_transect(file).apply(pd.to_numeric, errors='coerce').dropna(subset=['lon', 'lat']) for file in files]
         combined_df = pd.concat(dfs, ignore_index=True)
         return dfs, combined_df
     except Exception as e:
@@ -63,29 +65,20 @@ def add_scale_bar(ax, length_km, location=(0.05, 0.25), linewidth=1, color='blac
     ax.plot([x, x + length_deg], [y, y], transform=ccrs.Geodetic(), color=color, linewidth=linewidth)
     ax.text(x + length_deg / 2, y - 0.001, f'{length_km} km', verticalalignment='top', horizontalalignment='center', transform=ccrs.Geodetic(), color=color, fontsize=fontsize)
 
-def main():
-    dfs, _ = load_transect_data(TRANSECTS)
-
-    if not os.path.exists(SAVE_DIR):
-        os.makedirs(SAVE_DIR)
-
-    may_7_images = [img for img in SATELLITE_IMGS]
+def render_mosaic(data, spec, output):
+    # Draws the 2x2 satellite mosaic with the transects on top; runs in a render_farm worker
+    dfs = data['transects']
 
     fig, axes = plt.subplots(nrows=2, ncols=2, figsize=(20, 20), subplot_kw={'projection': ccrs.PlateCarree()})
     fig.patch.set_facecolor('#FFFFFF')
 
     axes = axes.flatten()
 
-    # Desired order for images: MODIS, Hawkeye, S3B, S3A
-    #order = [3, 2, 0, 1]  # for kd490
-    order = [0, 1, 3, 2]  # for chlor_a
-    for i, idx in enumerate(order):
+    for i, satellite_img_path in enumerate(spec['satellite_images']):
         ax = axes[i]
         ax.set_facecolor('#FFFFFF')
 
-        satellite_img_path = os.path.join(SATELLITE_IMAGES_DIR, may_7_images[idx])
-
-        min_lat, max_lat, min_lon, max_lon = SAT_IMG_BOUNDS
+        min_lat, max_lat, min_lon, max_lon = spec['bounds']
         ax.set_extent([min_lon, max_lon, min_lat, max_lat], crs=ccrs.PlateCarree())
 
         try:
@@ -96,7 +89,7 @@ def main():
             continue
 
         plot_transects(ax, dfs, 'red')
-        ax.set_title(SUBPLOT_TITLES[i], fontsize=TITLE_FONT_SIZE)
+        ax.set_title(spec['titles'][i], fontsize=TITLE_FONT_SIZE)
 
         compass_rose_image = mpimg.imread(COMPASS_ROSE_PATH)
         compass_size = 0.02  # Define the size of the compass rose
@@ -111,8 +104,8 @@ def main():
         gl = ax.gridlines(crs=ccrs.PlateCarree(), draw_labels=True, linewidth=1, color='gray', alpha=0.5, linestyle='--')
         gl.top_labels = False
         gl.right_labels = False
-        gl.xlocator = mticker.FixedLocator(np.arange(SAT_IMG_BOUNDS[2], SAT_IMG_BOUNDS[3]+0.01, 0.05))
-        gl.ylocator = mticker.FixedLocator(np.arange(SAT_IMG_BOUNDS[0], SAT_IMG_BOUNDS[1]+0.01, 0.05))
+        gl.xlocator = mticker.FixedLocator(np.arange(spec['bounds'][2], spec['bounds'][3]+0.01, 0.05))
+        gl.ylocator = mticker.FixedLocator(np.arange(spec['bounds'][0], spec['bounds'][1]+0.01, 0.05))
         gl.xlabel_style = {'size': LABEL_FONT_SIZE}
         gl.ylabel_style = {'size': LABEL_FONT_SIZE}
 
@@ -121,8 +114,33 @@ def main():
         axes[j].axis('off')
 
     plt.subplots_adjust(wspace=0.25, hspace=0.50)
-    plt.savefig(os.path.join(SAVE_DIR, "mosaic_masonboro_chl_single.png"), dpi=500, bbox_inches='tight')  # Adjusted dpi
+    plt.savefig(output, dpi=500, bbox_inches='tight')  # Adjusted dpi
     plt.close(fig)
 
+def main():
+    dfs, _ = load_transect_data(TRANSECTS)
+
+    if not os.path.exists(SAVE_DIR):
+        os.makedirs(SAVE_DIR)
+
+    may_7_images = [img for img in SATELLITE_IMGS]
+
+    # Desired order for images: MODIS, Hawkeye, S3B, S3A
+    #order = [3, 2, 0, 1]  # for kd490
+    order = [0, 1, 3, 2]  # for chlor_a
+    satellite_images = [os.path.join(SATELLITE_IMAGES_DIR, may_7_images[idx]) for idx in order]
+
+    # The mosaic is only redrawn when the transects, the satellite crops or the layout changed
+    spec = {
+        'satellite_images': satellite_images,
+        'titles': SUBPLOT_TITLES,
+        'bounds': SAT_IMG_BOUNDS,
+        'fonts': [TITLE_FONT_SIZE, LABEL_FONT_SIZE, TICK_FONT_SIZE, SCALE_BAR_FONT_SIZE],
+    }
+    input_files = [path for path in satellite_images + [COMPASS_ROSE_PATH] if os.path.exists(path)]
+    job = figure_job(render_mosaic, {'transects': [df[['lon', 'lat']] for df in dfs]}, spec,
+                     os.path.join(SAVE_DIR, "mosaic_masonboro_chl_single.png"), input_files)
+    render_figures([job])
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,155 @@
+import os
+import hashlib
+import pickle
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+from granule_reader import read_granule
+
+# Matchup columns written per granule: <granule>_<product> values and the <granule>_irow /
+# <granule>_icol pixel they were taken from. In grid mode the granule is read whole and the
+# indices are rows/cols of the full granule arrays. In navigation mode the granule is read
+# cropped to the bbox given to read_granule and build_navigation_index, and the indices are
+# rows/cols of that cropped window (row 0, col 0 is the window's first row and column in the
+# granule, as found by granule_reader.crop_window).
+
+# Masonboro Inlet study box the extracted L2 granules are assumed to cover (S, W, N, E)
+MASONBORO_BOUNDS = (34.10, -77.85, 34.25, -77.70)
+EARTH_RADIUS = 6371  # in kilometers
+
+def calculate_indices(lat, lon, array_shape, bounds=MASONBORO_BOUNDS):
+    # Vectorized form of the per-sample index calculation: accepts scalars or arrays of lat/lon
+    # and returns float row/col indices, with NaN wherever the sample falls outside the granule.
+    # The array is taken to span exactly bounds, so it must be the whole (uncropped) granule.
+    south_bound, west_bound, north_bound, east_bound = bounds
+
+    lat_res = (north_bound - south_bound) / array_shape[0]
+    lon_res = (east_bound - west_bound) / array_shape[1]
+
+    # np.trunc keeps the int() rounding toward zero used by the original per-row loop
+    irow = np.trunc((north_bound - np.asarray(lat, dtype=float)) / lat_res)
+    icol = np.trunc((np.asarray(lon, dtype=float) - west_bound) / lon_res)
+
+    in_bounds = (irow >= 0) & (irow < array_shape[0]) & (icol >= 0) & (icol < array_shape[1])
+    irow = np.where(in_bounds, irow, np.nan)
+    icol = np.where(in_bounds, icol, np.nan)
+
+    return irow, icol
+
+def latlon_to_xyz(lat, lon):
+    # Earth-centred cartesian coordinates (km), so straight-line KD-tree distances track
+    # great-circle distances at matchup scales without any lat/lon distortion
+    lat, lon = np.radians(lat), np.radians(lon)
+    return EARTH_RADIUS * np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+def build_navigation_index(file_path, bbox=MASONBORO_BOUNDS, cache_dir=None):
+    # KD-tree over the granule's navigation_data latitude/longitude pixels, cropped with the same
+    # bbox as the geophysical arrays so row/col indices line up. When cache_dir is given the
+    # index is pickled there, keyed by (path, mtime, bbox), and reused on later runs.
+    cache_path = None
+    if cache_dir is not None:
+        key = f"{os.path.abspath(file_path)}|{os.path.getmtime(file_path)}|{bbox}"
+        cache_path = os.path.join(cache_dir, hashlib.sha1(key.encode()).hexdigest() + '.pkl')
+        if os.path.exists(cache_path):
+            with open(cache_path, 'rb') as f:
+                return pickle.load(f)
+
+    navigation = read_granule(file_path, ['latitude', 'longitude'], 'navigation_data', bbox=bbox)
+    if navigation is None or navigation['latitude'] is None or navigation['longitude'] is None:
+        return None
+    nav_lat, nav_lon = navigation['latitude'], navigation['longitude']
+
+    valid_pixels = np.flatnonzero(np.isfinite(nav_lat) & np.isfinite(nav_lon))
+    if valid_pixels.size == 0:
+        return None
+    tree = cKDTree(latlon_to_xyz(nav_lat.ravel()[valid_pixels], nav_lon.ravel()[valid_pixels]))
+
+    # Typical pixel size from neighbouring pixels along each row, used as the default match radius
+    xyz = latlon_to_xyz(nav_lat.ravel(), nav_lon.ravel()).reshape(nav_lat.shape + (3,))
+    along_row = np.linalg.norm(np.diff(xyz, axis=1), axis=-1)
+    pixel_spacing = np.nanmedian(along_row) if np.isfinite(along_row).any() else np.nan
+
+    navigation_index = {'tree': tree, 'valid_pixels': valid_pixels, 'shape': nav_lat.shape, 'pixel_spacing': pixel_spacing}
+
+    if cache_path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(cache_path, 'wb') as f:
+            pickle.dump(navigation_index, f)
+
+    return navigation_index
+
+def navigation_indices(navigation_index, lat, lon, max_distance=None):
+    # Nearest swath pixel for every sample in one batched tree query. Samples farther than
+    # max_distance (km; defaults to one pixel spacing) from any pixel centre get NaN indices.
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    if max_distance is None:
+        max_distance = navigation_index['pixel_spacing']
+
+    irow = np.full(lat.shape, np.nan)
+    icol = np.full(lat.shape, np.nan)
+    finite = np.isfinite(lat) & np.isfinite(lon)
+    if not finite.any():
+        return irow, icol
+
+    distance, nearest = navigation_index['tree'].query(latlon_to_xyz(lat[finite], lon[finite]), distance_upper_bound=max_distance)
+    matched = np.isfinite(distance)
+    rows, cols = np.unravel_index(navigation_index['valid_pixels'][nearest[matched]], navigation_index['shape'])
+
+    matched_samples = np.flatnonzero(finite)[matched]
+    irow[matched_samples] = rows
+    icol[matched_samples] = cols
+    return irow, icol
+
+def navigation_pixels_within(navigation_index, lat, lon, radius):
+    # All swath pixels within radius (km) of each sample, as a list of (rows, cols) array pairs
+    xyz = latlon_to_xyz(np.asarray(lat, dtype=float), np.asarray(lon, dtype=float))
+    neighbours = navigation_index['tree'].query_ball_point(xyz, r=radius)
+    return [np.unravel_index(navigation_index['valid_pixels'][np.asarray(pixels, dtype=int)], navigation_index['shape'])
+            for pixels in neighbours]
+
+def gather_values(product_array, irow, icol):
+    # Fancy-index product_array at every (irow, icol), returning NaN where the indices are NaN
+    values = np.full(irow.shape, np.nan)
+    valid = ~np.isnan(irow)
+    values[valid] = product_array[irow[valid].astype(int), icol[valid].astype(int)]
+    return values
+
+def match_granule(lat, lon, product_arrays, unique_identifier, navigation_index=None):
+    # Match every sample against one granule in a single pass. product_arrays maps the column
+    # suffix (e.g. 'chl' or 'Rrs_412') to its 2D array; all arrays share the granule's shape.
+    # With a navigation_index the granule's real lat/lon is used instead of the fixed grid.
+    if navigation_index is not None:
+        irow, icol = navigation_indices(navigation_index, lat, lon)
+    else:
+        array_shape = next(array.shape for array in product_arrays.values() if array is not None)
+        irow, icol = calculate_indices(lat, lon, array_shape)
+
+    columns = {
+        f"{unique_identifier}_irow": irow,
+        f"{unique_identifier}_icol": icol,
+    }
+    for suffix, product_array in product_arrays.items():
+        if product_array is None:
+            columns[f"{unique_identifier}_{suffix}"] = np.full(irow.shape, np.nan)
+        else:
+            columns[f"{unique_identifier}_{suffix}"] = gather_values(product_array, irow, icol)
+
+    return columns
+
+def add_matchup_columns(df, granule_products, navigation_indexes=None):
+    # granule_products maps each granule's unique identifier to its {suffix: array} dict, and
+    # navigation_indexes optionally maps the same identifiers to build_navigation_index results.
+    # The matchup columns for every granule are built as arrays first and joined to df once,
+    # rather than growing the DataFrame cell by cell.
+    if navigation_indexes is None:
+        navigation_indexes = {}
+    lat = df['lat'].to_numpy(dtype=float)
+    lon = df['lon'].to_numpy(dtype=float)
+
+    columns = {}
+    for unique_identifier, product_arrays in granule_products.items():
+        columns.update(match_granule(lat, lon, product_arrays, unique_identifier, navigation_indexes.get(unique_identifier)))
+
+    matchup_df = pd.DataFrame(columns, index=df.index)
+    return pd.concat([df.drop(columns=matchup_df.columns, errors='ignore'), matchup_df], axis=1)
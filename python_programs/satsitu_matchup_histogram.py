@@ -8,22 +8,18 @@ from sklearn.metrics import mean_squared_error, r2_score
 from sklearn.preprocessing import PolynomialFeatures
 from sklearn.pipeline import make_pipeline
 from sklearn.linear_model import LinearRegression
-from scipy.stats import gaussian_kde, ttest_rel
+from scipy.stats import ttest_rel
+from dataset_io import read_dataset, dataset_columns
+from render_farm import figure_job, render_figures
+from point_density import point_density
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.path.join(SCRIPT_DIR, '..', '..', 'data', 'satsitu', 'aggregated_satsitu_data_l2.csv')
 VISUAL_SAVE_DIR = os.path.join(SCRIPT_DIR, '..', 'visualization', 'satsitu', 'matchup_histograms')
-if not os.path.exists(VISUAL_SAVE_DIR):
-    os.makedirs(VISUAL_SAVE_DIR)
-
 CSV_SAVE_DIR = os.path.join(SCRIPT_DIR, '..', '..', 'data', 'satsitu')
-if not os.path.exists(CSV_SAVE_DIR):
-    os.makedirs(CSV_SAVE_DIR)
 
 warnings.filterwarnings('ignore', category=FutureWarning)
 
-df = pd.read_csv(DATA_DIR)
-print("Data loaded successfully.")
 
 title_font_size = 18
 axis_label_font_size = 16
@@ -31,6 +27,8 @@ tick_label_font_size = 26
 annotation_font_size = 18
 colorbar_label_font_size = 18
 
+DENSITY_METHOD = 'auto'  # auto, exact, fft or hist (see point_density.py)
+
 # Dictionary mapping sensor names to identifiers
 sensor_datetime_dict = {
     'Hawkeye': ('SEAHAWK1_HAWKEYE', '20230507T150955'),
@@ -43,12 +41,8 @@ pixel_window_sizes = ['1x1']  # '2x2', '3x3'
 
 depth_ranges = [(0, 4), (4, 7), (7, 10), (0, 10)]
 
-global_density_max = 0
-
-# Initialize a DataFrame to collect comprehensive statistics
+# Columns of the comprehensive statistics table
 columns = ['Sensor_Name', 'Sensor_File', 'Depth_Range', 'Pixel_Window_Size', 'RMSE', 'MAPE (%)', 'Bias', 'R-squared', 'CV_true', 'CV_predicted', 'p-value']
-comprehensive_stats_df = pd.DataFrame(columns=columns)
-print("Dataframe for storing results initialized.")
 
 # Function to get p-value significance label
 def get_p_value_label(p_value):
@@ -61,104 +55,147 @@ def get_p_value_label(p_value):
     else:
         return 'p-value > 0.05'
 
-# Loop through each combination of parameters
-for sensor_name, (sensor_identifier, date) in sensor_datetime_dict.items():
-    for pixel_size in pixel_window_sizes:
-        print(f"Processing {sensor_name}, DateTime: {date}, Pixel Size: {pixel_size}")
-        sensor_file_pattern = f"{sensor_identifier}.{date}.L2.OC{'.x' if 'OLCI_EFRNT' in sensor_identifier or 'MODIS' in sensor_identifier else ''}"
-
-        for depth_range in depth_ranges:
-            depth_range_str = f"{depth_range[0]}-{depth_range[1]}m"
-            true_value_col = f'{sensor_file_pattern}_insitu_chl_{depth_range_str}_{pixel_size}'
-            predicted_value_col = f'{sensor_file_pattern}_chl_{pixel_size}'
-
-            if true_value_col not in df.columns or predicted_value_col not in df.columns:
-                print(f"Missing columns: {true_value_col} or {predicted_value_col}")
-                continue
-
-            mask = ~df[true_value_col].isna() & ~df[predicted_value_col].isna()
-            if mask.sum() == 0:
-                print(f"No data available for {sensor_name} on {date} with {depth_range_str}")
-                continue
-
-            true_values = df.loc[mask, true_value_col]
-            predicted_values = df.loc[mask, predicted_value_col]
-
-            combined_values = pd.DataFrame({'true_values': true_values, 'predicted_values': predicted_values}).drop_duplicates()
-            true_values = combined_values['true_values']
-            predicted_values = combined_values['predicted_values']
-
-            if len(true_values) == len(predicted_values):
-                rmse = np.sqrt(mean_squared_error(true_values, predicted_values))
-                mape = np.mean(np.abs((true_values - predicted_values) / true_values)) * 100
-                bias_value = np.mean(predicted_values - true_values)
-                cv_true = np.std(true_values) / np.mean(true_values) if np.mean(true_values) != 0 else 0
-                cv_predicted = np.std(predicted_values) / np.mean(predicted_values) if np.mean(predicted_values) != 0 else 0
-
-                polyreg = make_pipeline(PolynomialFeatures(1), LinearRegression())
-                polyreg.fit(true_values.values.reshape(-1, 1), predicted_values.values)
-                predicted_chl_poly = polyreg.predict(true_values.values.reshape(-1, 1))
-                r_squared_poly = r2_score(predicted_values, predicted_chl_poly)
-
-                # Perform paired t-test
-                t_stat, p_value = ttest_rel(true_values, predicted_values)
-
-                new_row = pd.DataFrame({
-                    'Sensor_Name': [sensor_name.title()],
-                    'Sensor_File': [sensor_file_pattern],
-                    'Depth_Range': [depth_range_str],
-                    'Pixel_Window_Size': [pixel_size],
-                    'RMSE': [rmse],
-                    'MAPE (%)': [mape],
-                    'Bias': [bias_value],
-                    'R-squared': [r_squared_poly],
-                    'CV_true': [cv_true * 100],
-                    'CV_predicted': [cv_predicted * 100],
-                    'p-value': [p_value]
-                })
-                comprehensive_stats_df = pd.concat([comprehensive_stats_df, new_row], ignore_index=True)
-
-                # Calculate the point density
-                xy = np.vstack([true_values, predicted_values])
-                z = gaussian_kde(xy)(xy)
-
-                # Sort the points by density, so that the densest points are plotted last
-                idx = z.argsort()
-                true_values, predicted_values, z = true_values.values[idx], predicted_values.values[idx], z[idx]
-
-                f, ax = plt.subplots(figsize=(10, 6))
-                f.set_facecolor('#FFFFFF')  # Set the background color of the figure
-                ax.set_facecolor('#FFFFFF')  # Set the background color of the axes
-
-                sc = ax.scatter(true_values, predicted_values, c=z, s=50, cmap='viridis', edgecolor=None)
-                cbar = plt.colorbar(sc, ax=ax, label='Density')
-                cbar.ax.tick_params(labelsize=colorbar_label_font_size)  # Increase colorbar label font size
-                cbar.set_label('Density', fontsize=colorbar_label_font_size)  # Increase colorbar label font size
-
-                # Regression model
-                x_range = np.linspace(true_values.min(), true_values.max(), 100)
-                y_range = polyreg.predict(x_range.reshape(-1, 1))
-                sns.lineplot(x=x_range, y=y_range, color='red', linewidth=2, ax=ax)
-                ax.plot(x_range, x_range, color='black', linestyle='--', linewidth=2)
-
-                # Adding annotations for the metrics
-                #ax.annotate(f'N: {len(true_values)}\np-value: {p_value:.4f}',
-                #            xy=(0.97, 0.95), xycoords='axes fraction',
-                #            horizontalalignment='right', verticalalignment='top',
-                #            bbox=dict(boxstyle='round,pad=0.5', fc='#FFFFFF', alpha=0.5),
-                #            fontsize=annotation_font_size)  # Increase font size for annotation
-
-                ax.set_xlabel('')
-                ax.set_ylabel('')
-                ax.tick_params(axis='both', which='major', labelsize=tick_label_font_size)
-
-                plot_filename = os.path.join(VISUAL_SAVE_DIR, f"{sensor_name}_{date}_{depth_range_str}_{pixel_size}.png")
-                plt.savefig(plot_filename, dpi=500, bbox_inches='tight')
-                plt.close(f)
-            else:
-                print(f"Mismatched data lengths for {sensor_name} {depth_range_str}")
-
-print("All processing complete. Saving results...")
-comprehensive_csv_filename = os.path.join(CSV_SAVE_DIR, 'comprehensive_stats.csv')
-comprehensive_stats_df.to_csv(comprehensive_csv_filename, index=False)
-print("Results saved successfully.")
\ No newline at end of file
+# Fonts of the density scatter plots (part of every figure job's spec)
+plot_spec = {
+    'tick_label_font_size': tick_label_font_size,
+    'colorbar_label_font_size': colorbar_label_font_size,
+    'density_method': DENSITY_METHOD,
+}
+
+def render_matchup_density(data, spec, output):
+    # Density-colored matchup scatter with its regression line; runs in a render_farm worker
+    true_values, predicted_values = data['true_values'], data['predicted_values']
+
+    # Calculate the point density (exact KDE for small matchups, FFT KDE or histogram for large ones)
+    z = point_density(true_values, predicted_values, spec['density_method'])
+
+    # Sort the points by density, so that the densest points are plotted last
+    idx = z.argsort()
+    true_values, predicted_values, z = true_values[idx], predicted_values[idx], z[idx]
+
+    f, ax = plt.subplots(figsize=(10, 6))
+    f.set_facecolor('#FFFFFF')  # Set the background color of the figure
+    ax.set_facecolor('#FFFFFF')  # Set the background color of the axes
+
+    sc = ax.scatter(true_values, predicted_values, c=z, s=50, cmap='viridis', edgecolor=None)
+    cbar = plt.colorbar(sc, ax=ax, label='Density')
+    cbar.ax.tick_params(labelsize=spec['colorbar_label_font_size'])  # Increase colorbar label font size
+    cbar.set_label('Density', fontsize=spec['colorbar_label_font_size'])  # Increase colorbar label font size
+
+    # Regression model
+    sns.lineplot(x=data['x_range'], y=data['y_range'], color='red', linewidth=2, ax=ax)
+    ax.plot(data['x_range'], data['x_range'], color='black', linestyle='--', linewidth=2)
+
+    # Adding annotations for the metrics
+    #ax.annotate(f'N: {len(true_values)}\np-value: {p_value:.4f}',
+    #            xy=(0.97, 0.95), xycoords='axes fraction',
+    #            horizontalalignment='right', verticalalignment='top',
+    #            bbox=dict(boxstyle='round,pad=0.5', fc='#FFFFFF', alpha=0.5),
+    #            fontsize=annotation_font_size)  # Increase font size for annotation
+
+    ax.set_xlabel('')
+    ax.set_ylabel('')
+    ax.tick_params(axis='both', which='major', labelsize=spec['tick_label_font_size'])
+
+    plt.savefig(output, dpi=500, bbox_inches='tight')
+    plt.close(f)
+
+def main():
+    if not os.path.exists(VISUAL_SAVE_DIR):
+        os.makedirs(VISUAL_SAVE_DIR)
+    if not os.path.exists(CSV_SAVE_DIR):
+        os.makedirs(CSV_SAVE_DIR)
+
+    # Load only the matchup columns of the granules and window sizes compared below
+    granule_prefixes = tuple(f"{sensor_identifier}.{date}." for sensor_identifier, date in sensor_datetime_dict.values())
+    matchup_columns = [column for column in dataset_columns(DATA_DIR)
+                       if column.startswith(granule_prefixes) and column.endswith(tuple(f'_{pixel_size}' for pixel_size in pixel_window_sizes))]
+    df = read_dataset(DATA_DIR, columns=matchup_columns)
+    print("Data loaded successfully.")
+
+    # Initialize a DataFrame to collect comprehensive statistics
+    comprehensive_stats_df = pd.DataFrame(columns=columns)
+    print("Dataframe for storing results initialized.")
+
+    # The figures are collected while the statistics are computed and drawn afterwards by render_farm
+    # workers; figures whose matchups did not change are not redrawn
+    figure_jobs = []
+
+    # Loop through each combination of parameters
+    for sensor_name, (sensor_identifier, date) in sensor_datetime_dict.items():
+        for pixel_size in pixel_window_sizes:
+            print(f"Processing {sensor_name}, DateTime: {date}, Pixel Size: {pixel_size}")
+            sensor_file_pattern = f"{sensor_identifier}.{date}.L2.OC{'.x' if 'OLCI_EFRNT' in sensor_identifier or 'MODIS' in sensor_identifier else ''}"
+
+            for depth_range in depth_ranges:
+                depth_range_str = f"{depth_range[0]}-{depth_range[1]}m"
+                true_value_col = f'{sensor_file_pattern}_insitu_chl_{depth_range_str}_{pixel_size}'
+                predicted_value_col = f'{sensor_file_pattern}_chl_{pixel_size}'
+
+                if true_value_col not in df.columns or predicted_value_col not in df.columns:
+                    print(f"Missing columns: {true_value_col} or {predicted_value_col}")
+                    continue
+
+                mask = ~df[true_value_col].isna() & ~df[predicted_value_col].isna()
+                if mask.sum() == 0:
+                    print(f"No data available for {sensor_name} on {date} with {depth_range_str}")
+                    continue
+
+                true_values = df.loc[mask, true_value_col]
+                predicted_values = df.loc[mask, predicted_value_col]
+
+                combined_values = pd.DataFrame({'true_values': true_values, 'predicted_values': predicted_values}).drop_duplicates()
+                true_values = combined_values['true_values']
+                predicted_values = combined_values['predicted_values']
+
+                if len(true_values) == len(predicted_values):
+                    rmse = np.sqrt(mean_squared_error(true_values, predicted_values))
+                    mape = np.mean(np.abs((true_values - predicted_values) / true_values)) * 100
+                    bias_value = np.mean(predicted_values - true_values)
+                    cv_true = np.std(true_values) / np.mean(true_values) if np.mean(true_values) != 0 else 0
+                    cv_predicted = np.std(predicted_values) / np.mean(predicted_values) if np.mean(predicted_values) != 0 else 0
+
+                    polyreg = make_pipeline(PolynomialFeatures(1), LinearRegression())
+                    polyreg.fit(true_values.values.reshape(-1, 1), predicted_values.values)
+                    predicted_chl_poly = polyreg.predict(true_values.values.reshape(-1, 1))
+                    r_squared_poly = r2_score(predicted_values, predicted_chl_poly)
+
+                    # Perform paired t-test
+                    t_stat, p_value = ttest_rel(true_values, predicted_values)
+
+                    new_row = pd.DataFrame({
+                        'Sensor_Name': [sensor_name.title()],
+                        'Sensor_File': [sensor_file_pattern],
+                        'Depth_Range': [depth_range_str],
+                        'Pixel_Window_Size': [pixel_size],
+                        'RMSE': [rmse],
+                        'MAPE (%)': [mape],
+                        'Bias': [bias_value],
+                        'R-squared': [r_squared_poly],
+                        'CV_true': [cv_true * 100],
+                        'CV_predicted': [cv_predicted * 100],
+                        'p-value': [p_value]
+                    })
+                    comprehensive_stats_df = pd.concat([comprehensive_stats_df, new_row], ignore_index=True)
+
+                    # Regression model
+                    x_range = np.linspace(true_values.min(), true_values.max(), 100)
+                    y_range = polyreg.predict(x_range.reshape(-1, 1))
+
+                    plot_filename = os.path.join(VISUAL_SAVE_DIR, f"{sensor_name}_{date}_{depth_range_str}_{pixel_size}.png")
+                    figure_jobs.append(figure_job(render_matchup_density,
+                                                  {'true_values': true_values.to_numpy(), 'predicted_values': predicted_values.to_numpy(),
+                                                   'x_range': x_range, 'y_range': y_range},
+                                                  plot_spec, plot_filename))
+                else:
+                    print(f"Mismatched data lengths for {sensor_name} {depth_range_str}")
+
+    render_figures(figure_jobs)
+
+    print("All processing complete. Saving results...")
+    comprehensive_csv_filename = os.path.join(CSV_SAVE_DIR, 'comprehensive_stats.csv')
+    comprehensive_stats_df.to_csv(comprehensive_csv_filename, index=False)
+    print("Results saved successfully.")
+
+if __name__ == '__main__':
+    main()
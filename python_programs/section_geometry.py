@@ -0,0 +1,67 @@
+import numpy as np
+
+# Along-track geometry of Acrobat transects, computed once per transect in preprocessing.py and
+# stored as columns of the processed dataset:
+#
+#   along_track_distance  km travelled from the first sample, summed over every pair of samples
+#   normalized_distance   the x axis of the section plots: km from the first sample, advanced every
+#                         DISTANCE_STEP samples by the distance to the sample DISTANCE_STEP back
+#   shore_distance        km from SHORE_POINT
+#
+# The plotting scripts call with_section_geometry, which only computes the columns for datasets
+# processed before they were stored.
+
+EARTH_RADIUS = 6371  # in kilometers
+SHORE_POINT = (-77.802938, 34.195220)  # (lon, lat)
+DISTANCE_STEP = 10
+GEOMETRY_COLUMNS = ['along_track_distance', 'normalized_distance', 'shore_distance']
+
+def haversine(lon1, lat1, lon2, lat2):
+    # Great circle distance between points (decimal degrees, scalars or arrays)
+    lon1, lat1, lon2, lat2 = map(np.radians, [lon1, lat1, lon2, lat2])
+    dlon = lon2 - lon1
+    dlat = lat2 - lat1
+    a = np.sin(dlat/2.0)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon/2.0)**2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1-a))
+    return c * EARTH_RADIUS
+
+def _cumulative(steps):
+    # Samples without a position add no distance rather than turning the rest of the track NaN
+    distance = np.zeros(len(steps) + 1)
+    np.cumsum(np.where(np.isfinite(steps), steps, 0.0), out=distance[1:])
+    return distance
+
+def along_track_distance(lon, lat):
+    lon = np.asarray(lon, dtype=float)
+    lat = np.asarray(lat, dtype=float)
+    if len(lon) == 0:
+        return np.zeros(0)
+    return _cumulative(haversine(lon[:-1], lat[:-1], lon[1:], lat[1:]))
+
+def normalized_distance(lon, lat, step=DISTANCE_STEP):
+    lon = np.asarray(lon, dtype=float)
+    lat = np.asarray(lat, dtype=float)
+    if len(lon) == 0:
+        return np.zeros(0)
+    steps = np.zeros(len(lon) - 1)
+    steps[step - 1::step] = haversine(lon[:-step:step], lat[:-step:step], lon[step::step], lat[step::step])
+    return _cumulative(steps)
+
+def shore_distance(lon, lat, shore_point=SHORE_POINT):
+    return haversine(shore_point[0], shore_point[1], np.asarray(lon, dtype=float), np.asarray(lat, dtype=float))
+
+def add_section_geometry(df):
+    # Adds the GEOMETRY_COLUMNS to one transect, in its stored (plotting) row order
+    df['along_track_distance'] = along_track_distance(df['lon'], df['lat'])
+    df['normalized_distance'] = normalized_distance(df['lon'], df['lat'])
+    df['shore_distance'] = shore_distance(df['lon'], df['lat'])
+    return df
+
+def with_section_geometry(df):
+    if all(column in df.columns for column in GEOMETRY_COLUMNS):
+        return df
+    return add_section_geometry(df)
+
+def middle_shore_distance(df):
+    # Distance from shore of the transect's middle sample, used to place transects in 3D
+    return df['shore_distance'].iloc[len(df) // 2]
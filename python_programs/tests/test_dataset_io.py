@@ -0,0 +1,35 @@
+import numpy as np
+import pandas as pd
+import pytest
+import dataset_io
+
+
+def table(lat):
+    return pd.DataFrame({'transect_id': [1, 1, 2, 2, 3], 'lat': lat, 'temp': [20.5, 21.0, 21.5, 22.0, 22.5]})
+
+
+@pytest.mark.skipif(not dataset_io.HAVE_PYARROW, reason='needs pyarrow')
+def test_csv_write_is_read_back_after_parquet(tmp_path, monkeypatch):
+    path = str(tmp_path / 'processed_dataset.csv')
+    monkeypatch.setattr(dataset_io, 'DATASET_FORMAT', 'parquet')
+    dataset_io.write_dataset(table([1.0, 2.0, 3.0, 4.0, 5.0]), path)
+
+    monkeypatch.setattr(dataset_io, 'DATASET_FORMAT', 'csv')
+    dataset_io.write_dataset(table([0.0] * 5), path)
+
+    assert dataset_io.read_dataset(path)['lat'].tolist() == [0.0] * 5
+    assert dataset_io.read_dataset(path, columns=['lat'], transect_ids=[2])['lat'].tolist() == [0.0, 0.0]
+    assert dataset_io.dataset_columns(path) == ['transect_id', 'lat', 'temp']
+    assert dataset_io.read_manifest(path) is None
+
+
+@pytest.mark.skipif(not dataset_io.HAVE_PYARROW, reason='needs pyarrow')
+def test_parquet_round_trip(tmp_path, monkeypatch):
+    path = str(tmp_path / 'processed_dataset.csv')
+    monkeypatch.setattr(dataset_io, 'DATASET_FORMAT', 'parquet')
+    df = table([1.0, 2.0, 3.0, 4.0, 5.0])
+    dataset_io.write_dataset(df, path)
+
+    pd.testing.assert_frame_equal(dataset_io.read_dataset(path), df)
+    assert dataset_io.transect_ids(path) == [1, 2, 3]
+    np.testing.assert_array_equal(dataset_io.read_dataset(path, columns=['temp'], transect_ids=[3])['temp'], [22.5])
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+from scipy.stats import spearmanr
+from point_density import point_density
+
+
+def lognormal_matchups(n, rng):
+    true_values = rng.lognormal(0, 0.6, n)
+    return true_values, true_values * rng.lognormal(0, 0.3, n) + 0.05 * rng.random(n)
+
+
+def normal_with_outlier(n, rng):
+    x, y = rng.normal(size=(2, n))
+    return np.append(x, 1000.0), np.append(y, 1000.0)
+
+
+@pytest.mark.parametrize('points', [
+    lambda rng: lognormal_matchups(5000, rng),
+    lambda rng: lognormal_matchups(20000, rng),
+    lambda rng: normal_with_outlier(5000, rng),
+    lambda rng: (rng.lognormal(0, 1.5, 5000), rng.lognormal(0, 1.5, 5000)),
+], ids=['lognormal-5k', 'lognormal-20k', 'outlier', 'heavy-tails'])
+def test_fft_kde_matches_exact(points):
+    x, y = points(np.random.default_rng(0))
+    exact = point_density(x, y, 'exact')
+    fft = point_density(x, y, 'fft')
+    assert np.abs(fft - exact).max() < 0.02 * exact.max()
+    assert spearmanr(fft, exact)[0] > 0.999
+
+
+def test_auto_picks_exact_for_small_matchups():
+    x, y = lognormal_matchups(500, np.random.default_rng(1))
+    np.testing.assert_array_equal(point_density(x, y), point_density(x, y, 'exact'))
@@ -0,0 +1,59 @@
+import io
+import numpy as np
+import pandas as pd
+import pytest
+import preprocessing
+from preprocessing import QC_PARAMS, perform_qc_tests, qc_chunks, stream_qc_file
+
+
+@pytest.fixture
+def acrobat_log(tmp_path):
+    # Integer time and depth, QC columns with range and spike failures, and gaps and text that
+    # only appear after the first chunks
+    rng = np.random.default_rng(0)
+    n = 1000
+    df = pd.DataFrame({
+        'time': 1683000000 + np.arange(n) * 2,
+        'depth': rng.integers(0, 10, n),
+        'lat': 34.2 + rng.random(n) * 0.01,
+        'lon': -77.8 + rng.random(n) * 0.01,
+        'temp': 20 + rng.normal(0, 0.3, n),
+        'salinity': 34.97 + rng.normal(0, 0.03, n),
+        'chlor_a': rng.random(n) * 2.5,
+        'note': '',
+    })
+    df['time'] = df['time'].astype(object)
+    df.loc[700, 'time'] = 1683009000   # timing gap
+    df.loc[850, 'depth'] = None         # integer column with a gap late in the file
+    df.loc[900, 'note'] = 'calibration'  # text late in the file
+    path = tmp_path / 'transect_1.csv'
+    df.to_csv(path, index=False)
+    return path
+
+
+def baseline_csv(path):
+    cleaned_df, qc_report = perform_qc_tests(pd.read_csv(path), QC_PARAMS)
+    return cleaned_df.to_csv(index=False), qc_report
+
+
+@pytest.mark.parametrize('chunksize', [64, 333, 1000, 5000])
+def test_chunked_qc_matches_whole_file(acrobat_log, chunksize):
+    expected_csv, expected_report = baseline_csv(acrobat_log)
+    qc_report = {}
+    chunked = pd.concat(qc_chunks(acrobat_log, QC_PARAMS, qc_report, chunksize), ignore_index=True)
+    assert chunked.to_csv(index=False) == expected_csv
+    assert {test: int(count) for test, count in qc_report.items()} == {test: int(count) for test, count in expected_report.items()}
+
+
+@pytest.mark.parametrize('chunksize', [64, 1000])
+def test_streamed_qc_is_byte_identical(acrobat_log, tmp_path, chunksize):
+    expected_csv, _ = baseline_csv(acrobat_log)
+    output_path = tmp_path / 'cleaned.csv'
+    stream_qc_file(acrobat_log, output_path, chunksize=chunksize)
+    assert output_path.read_bytes() == expected_csv.encode()
+
+
+def test_integer_columns_stay_integer(acrobat_log):
+    dtypes = preprocessing.acrobat_dtypes(acrobat_log, chunksize=64)
+    assert dtypes['time'] == np.int64
+    assert dtypes['depth'] == np.float64  # has a gap, as in a whole-file read
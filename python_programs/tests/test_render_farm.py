@@ -0,0 +1,51 @@
+import importlib
+import sys
+import pytest
+import render_farm
+
+SCRIPT = '''
+from figure_helpers import label
+
+FONT_SIZE = {font_size}
+
+def render(data, spec, output):
+    with open(output, 'w') as f:
+        f.write(f'{{label(spec)}} {{FONT_SIZE}}')
+    with open(output + '.frame', 'w') as f:
+        f.write('frame')
+'''
+
+
+def load_script(tmp_path, monkeypatch, font_size=20, helper='spec["name"]'):
+    (tmp_path / 'figure_helpers.py').write_text(f'def label(spec):\n    return {helper}\n')
+    (tmp_path / 'figure_script.py').write_text(SCRIPT.format(font_size=font_size))
+    monkeypatch.syspath_prepend(str(tmp_path))
+    for name in ['figure_script', 'figure_helpers']:
+        sys.modules.pop(name, None)
+    importlib.invalidate_caches()
+    return importlib.import_module('figure_script')
+
+
+def script_hash(tmp_path, monkeypatch, **kwargs):
+    script = load_script(tmp_path, monkeypatch, **kwargs)
+    return render_farm.job_hash(render_farm.figure_job(script.render, [1, 2], {'name': 'temp'}, str(tmp_path / 'temp.png')))
+
+
+def test_job_hash_covers_module_globals_and_local_helpers(tmp_path, monkeypatch):
+    digest = script_hash(tmp_path, monkeypatch)
+    assert script_hash(tmp_path, monkeypatch) == digest
+    assert script_hash(tmp_path, monkeypatch, font_size=24) != digest
+    assert script_hash(tmp_path, monkeypatch, helper='spec["name"].upper()') != digest
+
+
+def test_missing_extra_output_is_rendered_again(tmp_path, monkeypatch):
+    pytest.importorskip('matplotlib')
+    script = load_script(tmp_path, monkeypatch)
+    output = str(tmp_path / 'temp.png')
+    job = render_farm.figure_job(script.render, [1, 2], {'name': 'temp'}, output, extra_outputs=[output + '.frame'])
+
+    assert render_farm.render_figures([job]) == {output: 'rendered'}
+    assert render_farm.render_figures([job]) == {output: 'skipped'}
+    (tmp_path / 'temp.png.frame').unlink()
+    assert render_farm.render_figures([job]) == {output: 'rendered'}
+    assert (tmp_path / 'temp.png.frame').exists()
@@ -4,8 +4,12 @@ import seaborn as sns
 import matplotlib.pyplot as plt
 from matplotlib.ticker import ScalarFormatter
 import numpy as np
-from scipy.interpolate import griddata
 from scipy.stats import f_oneway, ttest_ind, shapiro, levene
+from dataset_io import read_dataset
+from section_geometry import haversine, SHORE_POINT
+from section_interp import section_interpolator
+from render_farm import figure_job, render_figures
+from group_stats import grouped_stats, partition
 
 # Define directories and paths
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -20,13 +24,11 @@ os.makedirs(os.path.dirname(CSV_SAVE_PATH), exist_ok=True)
 os.makedirs(VISUAL_SAVE_DIR, exist_ok=True)
 os.makedirs(os.path.dirname(STATS_SAVE_PATH), exist_ok=True)
 
-EARTH_RADIUS = 6371  # in kilometers
 WINDOW_SIZE = 100  # Define the window size for the rolling mean
-SHORE_POINT = (-77.802938, 34.195220)
 
 # Load the dataset
 print("Loading data...")
-data = pd.read_csv(ACROBAT_DIR)
+data = read_dataset(ACROBAT_DIR)
 print("Data loaded successfully.")
 
 # Define the depth bins and labels
@@ -56,8 +58,9 @@ def get_p_value_label(p_value):
     else:
         return 'p-value > 0.05'
 
-# Function to create and save box plots
-def create_and_save_plots(data, variable, unit, save_dir, anova_results, t_test_results):
+# Function to create and save box plots; runs in a render_farm worker
+def render_boxplot(data, spec, output):
+    variable, unit = spec['variable'], spec['unit']
     plt.figure(figsize=(25, 15))
     ax = sns.boxplot(data=data, x='transect_id', y=variable, hue='depth_range', palette='viridis')
     plt.title(f'{variable.capitalize()} Distribution Across Transects and Depth', fontsize=26)
@@ -68,8 +71,8 @@ def create_and_save_plots(data, variable, unit, save_dir, anova_results, t_test_
         ax.yaxis.set_major_formatter(ScalarFormatter(useOffset=False))
     
     # Annotate with ANOVA p-values and T-test p-values
-    anova_p_value = anova_results.get(f'mean_{variable}', {}).get('p-value', None)
-    t_test_p_value = t_test_results.get(f'mean_{variable}', {}).get('p-value', None)
+    anova_p_value = spec['anova_p_value']
+    t_test_p_value = spec['t_test_p_value']
     handles, labels = ax.get_legend_handles_labels()
     if anova_p_value is not None:
         handles.append(plt.Line2D([], [], color='w', label=f'ANOVA {get_p_value_label(anova_p_value)}'))
@@ -79,14 +82,10 @@ def create_and_save_plots(data, variable, unit, save_dir, anova_results, t_test_
     
     plt.xticks(fontsize=24)
     plt.yticks(fontsize=24)
-    plt.savefig(os.path.join(save_dir, f'{variable}.png'), dpi=500, bbox_inches='tight')
+    plt.savefig(output, dpi=500, bbox_inches='tight')
     plt.close()
 
-# Generate plots for each variable
 sns.set_context("talk")
-for variable, unit in variables_to_plot.items():
-    create_and_save_plots(data, variable, unit, VISUAL_SAVE_DIR, {}, {})
-    print(f"Completed plotting for {variable}.")
 
 # Calculate and save average parameters by depth
 numeric_cols = data.select_dtypes(include=[np.number]).columns
@@ -94,13 +93,6 @@ avg_params_by_depth = data.groupby('depth_range')[numeric_cols].mean().reset_ind
 avg_params_by_depth.to_csv(CSV_SAVE_PATH, index=False)
 print(f"Average parameters by depth CSV file has been written to {CSV_SAVE_PATH}")
 
-# Function to calculate distance from shore using the Haversine formula
-def haversine(lon1, lat1, lon2, lat2):
-    lon1, lat1, lon2, lat2 = map(np.radians, [lon1, lat1, lon2, lat2])
-    dlon, dlat = lon2 - lon1, lat2 - lat1
-    a = np.sin(dlat/2.0)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon/2.0)**2
-    return 2 * EARTH_RADIUS * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
-
 # Calculate buoyancy frequency squared (N²)
 g, rho0 = 9.81, data['density'].mean()
 data['d_density_dz'] = data.groupby('transect_id')['density'].diff() / data.groupby('transect_id')['depth'].diff()
@@ -113,9 +105,14 @@ distances_from_shore = [(transect, haversine(SHORE_POINT[0], SHORE_POINT[1], gro
 distances_from_shore.sort(key=lambda x: x[1])
 
 # Prepare data for contour plot
-xi, yi, zi = zip(*[(dist, depth, n2) for transect, dist in distances_from_shore for depth, n2 in zip(data[data['transect_id'] == transect]['depth'], data[data['transect_id'] == transect]['N2_smoothed'])])
+# Samples ordered by their transect's distance from shore, keeping their order within each transect
+transect_rank = data['transect_id'].map({transect: rank for rank, (transect, dist) in enumerate(distances_from_shore)})
+section = data.iloc[np.argsort(transect_rank.to_numpy(), kind='stable')]
+xi = section['transect_id'].map(dict(distances_from_shore)).to_numpy(dtype=float)
+yi = section['depth'].to_numpy(dtype=float)
+zi = section['N2_smoothed'].to_numpy(dtype=float)
 grid_x, grid_y = np.meshgrid(np.linspace(min(xi), max(xi), 100), np.linspace(min(yi), max(yi), 100))
-grid_z = griddata((xi, yi), zi, (grid_x, grid_y), method='cubic')
+grid_z = section_interpolator(xi, yi)(zi, grid_x, grid_y, method='cubic')
 
 # Plotting
 fig, ax1 = plt.subplots(figsize=(16, 8))
@@ -155,8 +152,9 @@ plt.savefig(os.path.join(VISUAL_SAVE_DIR, 'N2_distribution.png'), dpi=300, bbox_
 # Calculate mean parameter measurement for transects 1-7
 transect_1_7_mean = data[data['transect_id'].isin(range(1, 8))].groupby('transect_id')[list(variables_to_plot.keys())].mean()
 
-# Function to create line graph for each variable
-def create_line_graph(data, variable, unit, t_test_results):
+# Function to create line graph for each variable; runs in a render_farm worker
+def render_line_graph(data, spec, output):
+    variable, unit = spec['variable'], spec['unit']
     plt.figure(figsize=(10, 6))
     plt.plot(data.index, data[variable], marker='o', linestyle='-', color='b')
     plt.title(f'Mean {variable.capitalize()} from Transect 1 to Transect 7')
@@ -168,58 +166,32 @@ def create_line_graph(data, variable, unit, t_test_results):
     plt.xticks(data.index)
     
     # Annotate with T-test results
-    t_test_result = t_test_results.get(f'mean_{variable}', {}).get('p-value', None)
+    t_test_result = spec['t_test_p_value']
     if t_test_result is not None:
         plt.annotate(f'T-test {get_p_value_label(t_test_result)}', xy=(0.5, 0.95), xycoords='axes fraction', ha='center', fontsize=12, color='red')
 
-    plt.savefig(os.path.join(VISUAL_SAVE_DIR, f'{variable}_mean_transect_1_to_7.png'), dpi=300, bbox_inches='tight')
+    plt.savefig(output, dpi=300, bbox_inches='tight')
     plt.close()
 
-# Generate line graph for each variable
-for variable, unit in variables_to_plot.items():
-    create_line_graph(transect_1_7_mean, variable, unit, {})
-    print(f"Line graph for {variable} created.")
-
-print("All line graphs created successfully.")
-
-# Calculate and save statistics for each parameter
-rows_list = []
-for parameter in variables_to_plot.keys():
-    for group_key, group in data.groupby(['transect_id', 'depth_range']):
-        transect_id, depth_range = group_key
-        stats = {
-            'transect_id': transect_id,
-            'depth_range': depth_range,
-            f'mean_{parameter}': group[parameter].mean(),
-            f'median_{parameter}': group[parameter].median(),
-            f'min_{parameter}': group[parameter].min(),
-            f'max_{parameter}': group[parameter].max(),
-            f'std_dev_{parameter}': group[parameter].std()
-        }
-        rows_list.append(stats)
-    for group_key, group in data.groupby(['transect_id', 'overall_range']):
-        transect_id, overall_range = group_key
-        stats.update({
-            'transect_id': transect_id,
-            'depth_range': overall_range,
-            f'mean_{parameter}': group[parameter].mean(),
-            f'median_{parameter}': group[parameter].median(),
-            f'min_{parameter}': group[parameter].min(),
-            f'max_{parameter}': group[parameter].max(),
-            f'std_dev_{parameter}': group[parameter].std()
-        })
-        rows_list.append(stats)
-
-results_df = pd.DataFrame(rows_list)
+# Calculate and save statistics for each parameter: every parameter x (transect, depth range)
+# and (transect, whole profile) group x statistic in one pass per grouping
+parameters = list(variables_to_plot.keys())
+depth_stats = grouped_stats(data, ['transect_id', 'depth_range'], parameters)
+overall_stats = grouped_stats(data, ['transect_id', 'overall_range'], parameters).rename(columns={'overall_range': 'depth_range'})
+results_df = pd.concat([depth_stats.astype({'depth_range': str}), overall_stats], ignore_index=True)
+results_df = results_df.sort_values('transect_id', kind='stable', ignore_index=True)
 results_df.to_csv(STATS_SAVE_PATH, index=False)
 print(f"Statistics CSV file has been written to {STATS_SAVE_PATH}")
 
 anova_results = {}
 t_test_results = {}
 
-# Perform significance tests
-data_stats = pd.read_csv(STATS_SAVE_PATH)
-transects_1_to_7 = data_stats[data_stats['transect_id'].isin(range(1, 8))]
+# Perform significance tests on the group means, partitioned once by transect and by depth range
+transects_1_to_7 = results_df[results_df['transect_id'].isin(range(1, 8))]
+mean_columns = [f'mean_{param}' for param in parameters]
+by_transect = partition(transects_1_to_7, 'transect_id', mean_columns)
+by_depth = partition(transects_1_to_7, 'depth_range', mean_columns)
+no_values = np.array([])
 
 print("\nNormality test (Shapiro-Wilk test):")
 for param in variables_to_plot.keys():
@@ -228,13 +200,13 @@ for param in variables_to_plot.keys():
 
 print("\nLevene's test for homogeneity of variances:")
 for param in variables_to_plot.keys():
-    stat, p = levene(*[group[f'mean_{param}'].dropna() for name, group in transects_1_to_7.groupby('transect_id')])
+    stat, p = levene(*by_transect[f'mean_{param}'].values())
     print(f"Levene's test for mean_{param}: statistic={stat}, p-value={p}")
 
 print("\nNormality and Equality of Variances for T-test:")
 for param in variables_to_plot.keys():
-    shallow_data = transects_1_to_7[transects_1_to_7['depth_range'] == '0-2 m'][f'mean_{param}'].dropna()
-    deep_data = transects_1_to_7[transects_1_to_7['depth_range'] == '8-10 m'][f'mean_{param}'].dropna()
+    shallow_data = by_depth[f'mean_{param}'].get('0-2 m', no_values)
+    deep_data = by_depth[f'mean_{param}'].get('8-10 m', no_values)
     stat_shallow, p_shallow = shapiro(shallow_data)
     stat_deep, p_deep = shapiro(deep_data)
     stat, p = levene(shallow_data, deep_data)
@@ -244,27 +216,33 @@ for param in variables_to_plot.keys():
 
 print("\nANOVA results across transects:")
 for param in variables_to_plot.keys():
-    transect_groups = [group[f'mean_{param}'].dropna() for name, group in transects_1_to_7.groupby('transect_id')]
-    f_val, p_val = f_oneway(*transect_groups)
+    f_val, p_val = f_oneway(*by_transect[f'mean_{param}'].values())
     anova_results[f'mean_{param}'] = {'F-value': f_val, 'p-value': p_val}
     print(f"ANOVA results for mean_{param}: F-value = {f_val}, p-value = {p_val}")
 
 print("\nT-test results between shallow (0-2m) and deep (8-10m) depth bins:")
 for param in variables_to_plot.keys():
-    shallow_data = transects_1_to_7[transects_1_to_7['depth_range'] == '0-2 m'][f'mean_{param}'].dropna()
-    deep_data = transects_1_to_7[transects_1_to_7['depth_range'] == '8-10 m'][f'mean_{param}'].dropna()
+    shallow_data = by_depth[f'mean_{param}'].get('0-2 m', no_values)
+    deep_data = by_depth[f'mean_{param}'].get('8-10 m', no_values)
     t_stat, p_val = ttest_ind(shallow_data, deep_data, equal_var=False)
     t_test_results[f'mean_{param}'] = {'t-statistic': t_stat, 'p-value': p_val}
     print(f"T-test results for mean_{param} between shallow and deep depths: t-statistic = {t_stat}, p-value = {p_val}")
 
-# Generate plots for each variable with ANOVA results and T-test results in legend
-for variable, unit in variables_to_plot.items():
-    create_and_save_plots(data, variable, unit, VISUAL_SAVE_DIR, anova_results, t_test_results)
-    print(f"Completed plotting for {variable}.")
-
-# Generate line graph for each variable with T-test results
+# Generate plots for each variable with ANOVA results and T-test results in legend, and a line
+# graph for each variable with T-test results. Each figure is drawn once, after the tests, by
+# render_farm workers; figures whose data and p-values did not change are not redrawn.
+figure_jobs = []
 for variable, unit in variables_to_plot.items():
-    create_line_graph(transect_1_7_mean, variable, unit, t_test_results)
-    print(f"Line graph for {variable} created.")
-
-print("All line graphs created successfully.")
+    spec = {
+        'variable': variable,
+        'unit': unit,
+        'anova_p_value': anova_results.get(f'mean_{variable}', {}).get('p-value', None),
+        't_test_p_value': t_test_results.get(f'mean_{variable}', {}).get('p-value', None),
+    }
+    figure_jobs.append(figure_job(render_boxplot, data[['transect_id', variable, 'depth_range']], spec,
+                                  os.path.join(VISUAL_SAVE_DIR, f'{variable}.png')))
+    figure_jobs.append(figure_job(render_line_graph, transect_1_7_mean[[variable]], spec,
+                                  os.path.join(VISUAL_SAVE_DIR, f'{variable}_mean_transect_1_to_7.png')))
+
+render_figures(figure_jobs, rc=sns.plotting_context("talk"))
+print("All box plots and line graphs created successfully.")
@@ -7,6 +7,7 @@ import numpy as np
 import os
 import matplotlib.ticker as mticker
 import xarray as xr
+from dataset_io import read_dataset
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.path.join(SCRIPT_DIR, '..', '..', 'data')
@@ -25,7 +26,7 @@ def add_scale_bar(ax, length, location=(0.940, 0.075), linewidth=3):
     ax.text(x - scale_length / 2, y - 0.001, f'{length} km', verticalalignment='top', horizontalalignment='center', fontsize=28, transform=ccrs.Geodetic(), color='black')
 
 # Load transect data
-data = pd.read_csv(ACROBAT_DIR)
+data = read_dataset(ACROBAT_DIR, columns=['transect_id', 'lon', 'lat'])
 
 extent = [-77.85, -77.70, 34.10, 34.25]
 
@@ -0,0 +1,83 @@
+import warnings
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# NaN-aware NxN window statistics on 2D grids. Mean, count, std and coefficient of variation
+# come from integral images (cumulative sums of value, value² and valid-count), so their cost
+# is O(pixels) whatever the window size. Windows follow scipy.ndimage's size=(N, N),
+# mode='constant', cval=NaN placement: N//2 pixels before the centre, N-1-N//2 after it, with
+# pixels beyond the grid edge treated as missing.
+
+def _window_pad(window_size):
+    before = window_size // 2
+    return before, window_size - 1 - before
+
+def _integral_image(values, window_size):
+    # Zero-padded summed-area table with an extra leading row/column of zeros
+    before, after = _window_pad(window_size)
+    padded = np.pad(values, ((before, after), (before, after)), mode='constant', constant_values=0)
+    table = np.zeros((padded.shape[0] + 1, padded.shape[1] + 1))
+    np.cumsum(np.cumsum(padded, axis=0), axis=1, out=table[1:, 1:])
+    return table
+
+def _window_sum(values, window_size):
+    table = _integral_image(values, window_size)
+    n = window_size
+    return table[n:, n:] - table[:-n, n:] - table[n:, :-n] + table[:-n, :-n]
+
+def window_count(data, window_size):
+    valid = np.isfinite(data)
+    # counts are exact integers, so round away the floating point residue of the table differences
+    return np.rint(_window_sum(valid.astype(float), window_size))
+
+def _window_moments(data, window_size):
+    # count, mean and population variance of the valid pixels in every window
+    valid = np.isfinite(data)
+    count = window_count(data, window_size)
+    if not valid.any():
+        nan_grid = np.full(data.shape, np.nan)
+        return count, nan_grid, nan_grid.copy()
+
+    # shift by the grid mean before summing to limit cancellation in the squared sums
+    offset = data[valid].mean()
+    centered = np.where(valid, data - offset, 0.0)
+    sum_x = _window_sum(centered, window_size)
+    sum_xx = _window_sum(centered ** 2, window_size)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_centered = np.where(count > 0, sum_x / count, np.nan)
+        variance = np.maximum(sum_xx / count - mean_centered ** 2, 0.0)
+    variance[count == 1] = 0.0
+    variance[count == 0] = np.nan
+    return count, mean_centered + offset, variance
+
+def window_mean(data, window_size):
+    if window_size == 1:
+        return np.array(data, dtype=float)
+    return _window_moments(data, window_size)[1]
+
+def window_std(data, window_size):
+    return np.sqrt(_window_moments(data, window_size)[2])
+
+def window_cv(data, window_size):
+    _, mean, variance = _window_moments(data, window_size)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(mean != 0, np.sqrt(variance) / mean, np.nan)
+
+def window_median(data, window_size):
+    # Medians have no integral-image form, so this gathers each window as a strided view and
+    # reduces them all in one nanmedian call (cost grows with window area, unlike the others).
+    before, after = _window_pad(window_size)
+    padded = np.pad(np.asarray(data, dtype=float), ((before, after), (before, after)), mode='constant', constant_values=np.nan)
+    windows = sliding_window_view(padded, (window_size, window_size))
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)  # all-NaN windows give NaN
+        return np.nanmedian(windows.reshape(data.shape + (-1,)), axis=-1)
+
+def window_statistics(data, window_size):
+    # All statistics for one window size, sharing the integral images between them
+    count, mean, variance = _window_moments(data, window_size)
+    std = np.sqrt(variance)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cv = np.where(mean != 0, std / mean, np.nan)
+    return {'mean': mean, 'count': count, 'std': std, 'median': window_median(data, window_size), 'cv': cv}